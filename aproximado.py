@@ -0,0 +1,66 @@
+"""
+Búsqueda aproximada de candidatas para /recomendaciones (MinHash + LSH).
+
+Cada mascota tiene una firma MinHash de su conjunto de etiquetas (sobre los
+ids de columna del índice, que no cambian). La firma se corta en BANDAS
+bandas de FILAS valores; dos conjuntos caen en el mismo cubo de alguna banda
+con probabilidad 1 - (1 - J^FILAS)^BANDAS, con J su Jaccard. Una consulta
+solo puntúa (con el coseno exacto) a las mascotas que comparten algún cubo
+con el adoptante, en vez de a todo el catálogo.
+
+IndiceEtiquetas mantiene este índice al agregar y quitar filas.
+"""
+import os
+from typing import Dict, Iterable, List, Set, Tuple
+
+import numpy as np # type: ignore
+
+BANDAS = int(os.getenv("RECOMENDACIONES_LSH_BANDAS", "40"))
+FILAS = int(os.getenv("RECOMENDACIONES_LSH_FILAS", "3"))
+PRIMO = (1 << 31) - 1
+
+
+class IndiceLSH:
+    def __init__(self, bandas: int = BANDAS, filas: int = FILAS, semilla: int = 7):
+        self.bandas, self.filas = bandas, filas
+        rng = np.random.default_rng(semilla)
+        n = bandas * filas
+        # h_i(x) = (a_i * x + b_i) mod p, con x el id de columna de la etiqueta
+        self._a = rng.integers(1, PRIMO, size=n, dtype=np.int64)
+        self._b = rng.integers(0, PRIMO, size=n, dtype=np.int64)
+        self.reset()
+
+    def reset(self):
+        self.cubos: List[Dict[Tuple[int, ...], Set[int]]] = [{} for _ in range(self.bandas)]
+        self.claves: Dict[int, List[Tuple[int, ...]]] = {}   # mascota_id -> clave de cada banda
+
+    def _claves(self, columnas: Iterable[int]) -> List[Tuple[int, ...]]:
+        cols = np.fromiter(columnas, dtype=np.int64)
+        if len(cols) == 0:
+            return []
+        firma = ((self._a[:, None] * cols[None, :] + self._b[:, None]) % PRIMO).min(axis=1)
+        return [tuple(firma[i * self.filas:(i + 1) * self.filas].tolist()) for i in range(self.bandas)]
+
+    def agregar(self, mascota_id: int, columnas: Iterable[int]):
+        self.quitar(mascota_id)
+        claves = self._claves(columnas)
+        if not claves:
+            return   # sin etiquetas: su similitud con cualquiera es 0
+        self.claves[mascota_id] = claves
+        for banda, clave in zip(self.cubos, claves):
+            banda.setdefault(clave, set()).add(mascota_id)
+
+    def quitar(self, mascota_id: int):
+        for banda, clave in zip(self.cubos, self.claves.pop(mascota_id, ())):
+            cubo = banda.get(clave)
+            if cubo is not None:
+                cubo.discard(mascota_id)
+                if not cubo:
+                    del banda[clave]
+
+    def candidatas(self, columnas: Iterable[int]) -> Set[int]:
+        """Mascotas que comparten al menos un cubo con este conjunto de columnas."""
+        resultado: Set[int] = set()
+        for banda, clave in zip(self.cubos, self._claves(columnas)):
+            resultado |= banda.get(clave, set())
+        return resultado
@@ -0,0 +1,241 @@
+"""
+Almacenamiento de imágenes direccionado por contenido.
+
+Cada archivo se guarda una sola vez, en <directorio>/ab/cd/<sha256><ext>,
+donde ab y cd son los primeros caracteres del hash. Dos subidas con los
+mismos bytes terminan en la misma ruta, y las filas de Imagen/ImagenPerfil
+la comparten. Un nombre de archivo repetido ya no pisa la foto de otro. Los
+blobs no se borran nunca: son inmutables y cualquier fila puede apuntarles.
+
+La subida se lee por bloques de BLOQUE: cada uno se suma al hash y se escribe
+en un temporal del mismo directorio (en el threadpool, sin bloquear el event
+loop). Al final el temporal se renombra a su ruta, o se descarta si ese
+contenido ya estaba. La extensión sale de los primeros bytes (JPEG, PNG, GIF,
+WebP) y, si no, del nombre subido; así FileResponse sigue mandando el tipo
+correcto.
+
+Límites: MAX_BYTES por imagen (IMAGENES_MAX_BYTES) y MAX_LOTE imágenes por
+subida en lote (IMAGENES_MAX_LOTE). LimiteCuerpo corta con
+413 los cuerpos que se pasan antes de que Starlette los guarde en su
+temporal, por Content-Length o contando a medida que llegan.
+
+Para servir: RutasImagenes guarda id -> ruta en memoria. Se carga al
+arrancar y se completa en cada subida, así un GET de imagen no consulta la
+BD. respuesta_imagen agrega ETag fuerte, Cache-Control immutable y 304 con
+If-None-Match; los Range/If-Range los resuelve FileResponse. El ETag es el
+nombre del blob (hash + versión); para las rutas viejas, mtime y tamaño.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Response, UploadFile # type: ignore
+from fastapi.responses import FileResponse, JSONResponse # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+from starlette.concurrency import run_in_threadpool # type: ignore
+
+import catalogo
+import models
+
+MAX_BYTES = int(os.getenv("IMAGENES_MAX_BYTES", str(10 * 1024 * 1024)))
+BLOQUE = 256 * 1024
+MARGEN_MULTIPART = 64 * 1024   # encabezados y separadores del multipart, además del archivo
+MAX_LOTE = int(os.getenv("IMAGENES_MAX_LOTE", "20"))   # archivos por POST /imagenes/lote
+
+FIRMAS = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+)
+SINONIMOS = {".jpeg": ".jpg", ".jpe": ".jpg"}
+BLOB = re.compile(r"[0-9a-f]{64}\.")
+
+INMUTABLE = "public, max-age=31536000, immutable"
+
+
+class ArchivoDemasiadoGrande(ValueError):
+    pass
+
+
+def extension(inicio: bytes, nombre: Optional[str]) -> str:
+    for firma, ext in FIRMAS:
+        if inicio.startswith(firma):
+            return ext
+    if inicio[:4] == b"RIFF" and inicio[8:12] == b"WEBP":
+        return ".webp"
+    ext = os.path.splitext(nombre or "")[1].lower()
+    ext = SINONIMOS.get(ext, ext)
+    return ext if ext[1:].isalnum() and len(ext) <= 6 else ""
+
+def ruta_blob(directorio: str, digest: str, ext: str) -> str:
+    return os.path.join(directorio, digest[:2], digest[2:4], digest + ext)
+
+
+class Escritura:
+    """Un blob en camino: hash, tamaño y temporal. escribir() y terminar() son bloqueantes."""
+
+    def __init__(self, directorio: str, max_bytes: int = MAX_BYTES):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.tamano = 0
+        self._hash = hashlib.sha256()
+        self._inicio = b""
+        os.makedirs(directorio, exist_ok=True)
+        self._temporal = tempfile.NamedTemporaryFile(dir=directorio, prefix=".subida-", delete=False)
+
+    def escribir(self, bloque: bytes):
+        self.tamano += len(bloque)
+        if self.tamano > self.max_bytes:
+            self.descartar()
+            raise ArchivoDemasiadoGrande(f"El archivo supera el máximo de {self.max_bytes} bytes")
+        if len(self._inicio) < 16:
+            self._inicio += bloque[:16]
+        self._hash.update(bloque)
+        self._temporal.write(bloque)
+
+    def terminar(self, nombre: Optional[str]) -> Tuple[str, bool]:
+        """(ruta del blob, True si es nuevo)."""
+        self._temporal.close()
+        ruta = ruta_blob(self.directorio, self._hash.hexdigest(), extension(self._inicio, nombre))
+        if os.path.exists(ruta):
+            os.remove(self._temporal.name)
+            return ruta, False
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        os.replace(self._temporal.name, ruta)   # atómico: nadie ve un blob a medias
+        return ruta, True
+
+    def descartar(self):
+        self._temporal.close()
+        try:
+            os.remove(self._temporal.name)
+        except OSError:
+            pass
+
+
+async def guardar_subida(archivo: UploadFile, directorio: str, max_bytes: int = MAX_BYTES) -> str:
+    """Guarda una subida por bloques y devuelve la ruta de su blob. ArchivoDemasiadoGrande si se pasa."""
+    escritura = await run_in_threadpool(Escritura, directorio, max_bytes)
+    try:
+        while bloque := await archivo.read(BLOQUE):
+            await run_in_threadpool(escritura.escribir, bloque)
+        ruta, _ = await run_in_threadpool(escritura.terminar, archivo.filename)
+    except BaseException:
+        await run_in_threadpool(escritura.descartar)
+        raise
+    return ruta
+
+def guardar_archivo(origen: BinaryIO, nombre: Optional[str], directorio: str, max_bytes: int = MAX_BYTES) -> str:
+    """Como guardar_subida, bloqueante (p. ej. las fotos de un zip de importacion)."""
+    escritura = Escritura(directorio, max_bytes)
+    try:
+        while bloque := origen.read(BLOQUE):
+            escritura.escribir(bloque)
+        ruta, _ = escritura.terminar(nombre)
+    except BaseException:
+        escritura.descartar()
+        raise
+    return ruta
+
+
+class LimiteCuerpo:
+    """
+    Middleware ASGI: 413 para los POST a estas rutas cuyo cuerpo pasa su
+    límite en bytes. Con Content-Length se corta antes de leer nada; si no,
+    al pasarse mientras llega (la HTTPException atraviesa el parseo del
+    formulario de FastAPI).
+    """
+
+    def __init__(self, app, limites: Dict[str, int]):
+        self.app = app
+        self.limites = limites
+
+    async def __call__(self, scope, receive, send):
+        limite = self.limites.get(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if limite is None:
+            return await self.app(scope, receive, send)
+
+        detalle = f"El cuerpo supera el máximo de {limite} bytes"
+        largo = dict(scope["headers"]).get(b"content-length")
+        if largo is not None and largo.isdigit() and int(largo) > limite:
+            return await JSONResponse({"detail": detalle}, status_code=413)(scope, receive, send)
+
+        recibidos = 0
+        async def recibir():
+            nonlocal recibidos
+            mensaje = await receive()
+            if mensaje["type"] == "http.request":
+                recibidos += len(mensaje.get("body", b""))
+                if recibidos > limite:
+                    raise HTTPException(status_code=413, detail=detalle)
+            return mensaje
+        await self.app(scope, recibir, send)
+
+
+# ---------- servir ----------
+
+class RutasImagenes:
+    """
+    id -> ruta de una tabla de imágenes (Imagen o ImagenPerfil). Una fila no
+    cambia nunca de ruta, así que lo cargado no se invalida. Un id que no está
+    (lo subió otro worker) se busca en la BD una vez.
+    """
+
+    def __init__(self, modelo):
+        self.modelo = modelo
+        self._lock = threading.Lock()
+        self._rutas: Dict[int, str] = {}
+
+    def cargar(self, db: Session):
+        filas = db.query(self.modelo.id, self.modelo.ruta).all()
+        with self._lock:
+            self._rutas.update(filas)
+
+    def agregar(self, imagen_id: int, ruta: str):
+        """Después del commit: antes, un rollback dejaría un id que la BD puede volver a usar."""
+        with self._lock:
+            self._rutas[imagen_id] = ruta
+
+    def ruta(self, db: Session, imagen_id: int) -> Optional[str]:
+        ruta = self._rutas.get(imagen_id)
+        if ruta is None:
+            ruta = db.query(self.modelo.ruta).filter(self.modelo.id == imagen_id).scalar()
+            if ruta is not None:
+                self.agregar(imagen_id, ruta)
+        return ruta
+
+
+imagenes = RutasImagenes(models.Imagen)
+perfiles = RutasImagenes(models.ImagenPerfil)
+
+
+def etag_archivo(ruta: str, st: os.stat_result) -> str:
+    nombre = os.path.basename(ruta)
+    if BLOB.match(nombre):
+        return f'"{nombre}"'
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+def respuesta_imagen(
+    ruta: str,
+    if_none_match: Optional[str] = None,
+    media_type: Optional[str] = None,
+    inmutable: bool = True,
+    vary: Optional[str] = None,
+) -> Response:
+    """
+    FileResponse con ETag y Cache-Control (immutable, o no-cache si la
+    respuesta puede cambiar para la misma URL), o 304. 404 si falta el archivo.
+    """
+    try:
+        st = os.stat(ruta)
+    except (FileNotFoundError, NotADirectoryError):
+        raise HTTPException(status_code=404, detail="Archivo de imagen no encontrado")
+    cabeceras = {"ETag": etag_archivo(ruta, st), "Cache-Control": INMUTABLE if inmutable else "no-cache"}
+    if vary:
+        cabeceras["Vary"] = vary
+    if catalogo.coincide(if_none_match, cabeceras["ETag"]):
+        return Response(status_code=304, headers=cabeceras)
+    return FileResponse(ruta, media_type=media_type, headers=cabeceras, stat_result=st)
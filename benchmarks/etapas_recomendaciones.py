@@ -0,0 +1,269 @@
+"""
+Tiempos por etapa de /recomendaciones sobre catálogos sintéticos.
+
+    python benchmarks/etapas_recomendaciones.py --escalas 1000,10000,100000,1000000
+    python benchmarks/etapas_recomendaciones.py --bd sqlite:////tmp/bench.db --salida bench.json
+
+Para cada escala siembra una BD (SQLite en memoria por defecto) con mascotas
+y adoptantes de sinteticos.py y mide, dentro del proceso y sin HTTP:
+
+- "indice": la ruta actual. La construcción del índice se mide una vez
+  (carga_bd, parse_json, vectorizar) y luego cada petición
+  (carga_bd, ponderar, similitud, ordenar); el perfil del adoptante ya sale
+  decodificado de las tablas de etiquetado.py. "ponderar" arma el vector
+  del adoptante (Motor.perfil) y "similitud" lo recibe hecho, así las etapas
+  no se pisan.
+- "legado": el cálculo original por petición (consulta de todo el catálogo +
+  construir_matriz_tags + cosine_similarity), hasta --max-legado mascotas
+  porque arma una matriz densa.
+
+Cada etapa se reporta en ms (mediana y p95 de las peticiones). La salida es
+un JSON con un registro por (escala, ruta) para comparar entre versiones.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import numpy as np # type: ignore
+from sqlalchemy import create_engine # type: ignore
+from sqlalchemy.orm import sessionmaker # type: ignore
+from sqlalchemy.pool import StaticPool # type: ignore
+from sklearn.metrics.pairwise import cosine_similarity # type: ignore
+
+import etiquetado
+import models
+import motores
+import recomendaciones
+import sinteticos
+
+# Solo las tablas que toca el cálculo
+TABLAS = [models.Base.metadata.tables[t] for t in (
+    "imagenes_perfil", "adoptante", "albergue", "imagenes", "mascotas", "adopciones", "denegaciones", "matches",
+    "etiqueta", "mascota_etiqueta", "adoptante_etiqueta", "adoptante_peso",
+)]
+LOTE_INSERCION = 50_000
+
+
+class Cronometro:
+    def __init__(self):
+        self.tiempos = defaultdict(list)
+
+    @contextmanager
+    def etapa(self, nombre: str):
+        t0 = time.perf_counter()
+        yield
+        self.tiempos[nombre].append(1000 * (time.perf_counter() - t0))
+
+    def resumen(self):
+        return {
+            nombre: {"mediana_ms": round(float(np.median(v)), 3), "p95_ms": round(float(np.percentile(v, 95)), 3)}
+            for nombre, v in self.tiempos.items()
+        }
+
+
+def sembrar(engine, rng, n_mascotas: int, n_adoptantes: int, vocab, prob):
+    if engine.dialect.name == "sqlite":
+        # SQLite no acepta autoincrement en la PK compuesta de matches (aquí no se insertan matches)
+        models.Match.__table__.c.id.autoincrement = False
+    models.Base.metadata.drop_all(engine, tables=TABLAS)
+    models.Base.metadata.create_all(engine, tables=TABLAS)
+    mascotas = sinteticos.mascotas(rng, n_mascotas, vocab, prob)
+    perfiles = sinteticos.perfiles(rng, n_adoptantes, vocab, prob)
+    adoptadas = rng.random(n_mascotas) < 0.05
+    id_de = {nombre: i + 1 for i, nombre in enumerate(vocab)}
+    with engine.begin() as conn:
+        conn.execute(models.Etiqueta.__table__.insert(), [{"id": i, "nombre": n} for n, i in id_de.items()])
+        for inicio in range(0, n_mascotas, LOTE_INSERCION):
+            lote = mascotas[inicio:inicio + LOTE_INSERCION]
+            conn.execute(models.Mascota.__table__.insert(), [
+                sinteticos.fila_mascota(m, "Adoptado" if adoptadas[inicio + i] else "Disponible")
+                for i, m in enumerate(lote)
+            ])
+            conn.execute(models.MascotaEtiqueta.__table__.insert(), [
+                {"mascota_id": m["id"], "etiqueta_id": id_de[t], "posicion": j}
+                for m in lote for j, t in enumerate(m["tags"])
+            ])
+        conn.execute(models.Adoptante.__table__.insert(), [
+            sinteticos.fila_adoptante(i + 1, etiquetas, pesos) for i, (etiquetas, pesos) in enumerate(perfiles)
+        ])
+        conn.execute(models.AdoptanteEtiqueta.__table__.insert(), [
+            {"adoptante_id": i + 1, "posicion": j, "categoria": c, "etiqueta_id": id_de[t], "en_lista": True}
+            for i, (etiquetas, _) in enumerate(perfiles)
+            for j, (c, t) in enumerate((c, t) for c, ts in etiquetas.items() for t in ts)
+        ])
+        filas_pesos = [
+            {"adoptante_id": i + 1, "etiqueta_id": id_de[t], "peso": p}
+            for i, (_, pesos) in enumerate(perfiles) for t, p in pesos.items()
+        ]
+        if filas_pesos:
+            conn.execute(models.AdoptantePeso.__table__.insert(), filas_pesos)
+        denegaciones = [
+            {"adoptante_id": a, "mascota_id": int(m)}
+            for a in range(1, n_adoptantes + 1)
+            for m in rng.integers(1, n_mascotas + 1, size=int(rng.integers(0, 6)))
+        ]
+        if denegaciones:
+            conn.execute(models.Denegacion.__table__.insert(), denegaciones)
+
+
+def ruta_indice(db, adoptantes, k, motor=None):
+    construccion, peticiones = Cronometro(), Cronometro()
+    indice = recomendaciones.IndiceEtiquetas()
+
+    # lo mismo que IndiceEtiquetas.construir, separado por etapa; con las
+    # etiquetas normalizadas "parse_json" ya solo arma los dicts
+    with construccion.etapa("carga_bd"):
+        disponibles = recomendaciones.consulta_disponibles(db)
+        filas = disponibles.order_by(models.Mascota.id).all()
+        tags = etiquetado.de_mascotas(db, disponibles.with_entities(models.Mascota.id), vacunas=False)
+    with construccion.etapa("parse_json"):
+        datos = [
+            recomendaciones.datos_mascota(m, tags.get(m.id, etiquetado.VACIO)["etiquetas"]) for m in filas
+        ]
+    with construccion.etapa("vectorizar"):
+        indice.cargar(datos)
+    del filas, tags, datos
+    db.expunge_all()
+    puntuador = motores.motor(motor)
+
+    for adoptante_id in adoptantes:
+        with peticiones.etapa("carga_bd"):
+            db.get(models.Adoptante, adoptante_id)
+            denegadas = recomendaciones.excluidas(db, adoptante_id)
+            etiquetas, pesos = etiquetado.de_adoptante(db, adoptante_id)
+        with peticiones.etapa("ponderar"):
+            # el vector del adoptante; "similitud" lo recibe hecho y no lo vuelve a armar
+            perfil = puntuador.perfil(
+                indice.vocabulario, len(indice.etiquetas), indice.estadisticas(), etiquetas, pesos
+            )
+        with peticiones.etapa("similitud"):
+            ids, sims, _ = indice.puntuar(etiquetas, pesos, excluir=denegadas, motor=motor, perfil=perfil)
+        with peticiones.etapa("ordenar"):
+            sims = np.round(sims, 4)
+            pagina, _ = recomendaciones.seleccionar(ids, sims, k)
+            [(int(ids[i]), float(sims[i])) for i in pagina]
+        db.expunge_all()
+
+    return {"construccion": construccion.resumen(), "peticion": peticiones.resumen()}
+
+
+def ruta_legado(db, adoptantes, k):
+    """Copia por etapas del obtener_recomendaciones original."""
+    peticiones = Cronometro()
+    for adoptante_id in adoptantes:
+        with peticiones.etapa("carga_bd"):
+            adoptante = db.get(models.Adoptante, adoptante_id)
+            denegadas = {m for (m,) in db.query(models.Denegacion.mascota_id)
+                                         .filter(models.Denegacion.adoptante_id == adoptante_id)}
+            filas = (
+                db.query(models.Mascota)
+                  .filter(~models.Mascota.id.in_(denegadas))
+                  .filter(models.Mascota.estado != "Adoptado")
+                  .all()
+            )
+        with peticiones.etapa("parse_json"):
+            etiquetas = etiquetado.parse_dict(adoptante.etiquetas)
+            pesos = etiquetado.parse_dict(adoptante.pesos)
+            mascotas = [recomendaciones.datos_mascota(m, etiquetado.parse_lista(m.etiquetas)) for m in filas]
+        with peticiones.etapa("vectorizar"):
+            vocab, vec_adopt, vecs_masc = recomendaciones.construir_matriz_tags(etiquetas, mascotas)
+        with peticiones.etapa("ponderar"):
+            pesos_array = np.ones(len(vocab), dtype=float)
+            for etiqueta, peso in pesos.items():
+                if etiqueta in vocab:
+                    pesos_array[vocab.index(etiqueta)] = float(peso)
+            vec_adopt_pond = vec_adopt * pesos_array
+            vecs_masc_pond = vecs_masc * pesos_array
+        with peticiones.etapa("similitud"):
+            sims = cosine_similarity([vec_adopt_pond], vecs_masc_pond)[0]
+        with peticiones.etapa("ordenar"):
+            for i, mascota in enumerate(mascotas):
+                mascota["similitud"] = round(float(sims[i]), 4)
+            mascotas.sort(key=lambda x: x["similitud"], reverse=True)
+            mascotas = mascotas[:k]
+        del filas, mascotas, vecs_masc, vecs_masc_pond
+        db.expunge_all()
+    return {"peticion": peticiones.resumen()}
+
+
+def version_codigo():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--escalas", default="1000,10000,100000,1000000",
+                        help="tamaños de catálogo separados por coma")
+    parser.add_argument("--adoptantes", type=int, default=50, help="peticiones medidas por escala")
+    parser.add_argument("--adoptantes-legado", type=int, default=5)
+    parser.add_argument("--max-legado", type=int, default=100_000,
+                        help="escala máxima para la ruta legado (matriz densa)")
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--motor", choices=sorted(motores.MOTORES), default=motores.MOTOR,
+                        help="motor de puntuación de la ruta indice (ver motores.py)")
+    parser.add_argument("--etiquetas", type=int, default=500, help="tamaño del vocabulario")
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--bd", default="sqlite://", help="URL de SQLAlchemy; por defecto SQLite en memoria")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="archivo JSON (por defecto stdout)")
+    args = parser.parse_args()
+
+    if args.bd == "sqlite://":
+        engine = create_engine(args.bd, poolclass=StaticPool, connect_args={"check_same_thread": False})
+    else:
+        engine = create_engine(args.bd)
+    Sesion = sessionmaker(bind=engine, autoflush=False)
+    vocab, prob = sinteticos.vocabulario(args.etiquetas, args.zipf)
+
+    resultados = []
+    for escala in (int(e) for e in args.escalas.split(",")):
+        rng = np.random.default_rng(args.semilla)
+        t0 = time.perf_counter()
+        sembrar(engine, rng, escala, args.adoptantes, vocab, prob)
+        sembrado_s = round(time.perf_counter() - t0, 2)
+        adoptantes = list(range(1, args.adoptantes + 1))
+
+        with Sesion() as db:
+            resultados.append({"escala": escala, "ruta": "indice", "peticiones": len(adoptantes),
+                               "sembrado_s": sembrado_s, **ruta_indice(db, adoptantes, args.k, args.motor)})
+            print(f"✅ {escala} mascotas: indice", file=sys.stderr)
+            if escala <= args.max_legado:
+                legado = adoptantes[:args.adoptantes_legado]
+                resultados.append({"escala": escala, "ruta": "legado", "peticiones": len(legado),
+                                   "sembrado_s": sembrado_s, **ruta_legado(db, legado, args.k)})
+                print(f"✅ {escala} mascotas: legado", file=sys.stderr)
+
+    salida = json.dumps({
+        "version": version_codigo(),
+        "python": platform.python_version(),
+        "bd": engine.dialect.name,
+        "etiquetas": args.etiquetas,
+        "zipf": args.zipf,
+        "k": args.k,
+        "motor": args.motor,
+        "resultados": resultados,
+    }, indent=2)
+    if args.salida:
+        with open(args.salida, "w") as f:
+            f.write(salida + "\n")
+    else:
+        print(salida)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Escalado de la puntuación en varios procesos (paralelo.py) de 1 a N núcleos.
+
+    python benchmarks/paralelo_recomendaciones.py --mascotas 1000000 --procesos 1,2,4,8
+    python benchmarks/paralelo_recomendaciones.py --motor bm25 --salida paralelo.json
+
+Arma el índice en memoria con mascotas de sinteticos.py (sin BD) y, primero
+dentro del proceso y luego con el pool para cada cantidad de procesos, mide:
+
+- "peticion": una petición de /recomendaciones (puntuar + top-k), mediana y
+  p95 en ms.
+- "lote": adoptantes por segundo de puntuar_lote, como el refresco de
+  recomendaciones_precalculadas.
+
+La publicación en memoria compartida y el arranque del pool se miden aparte
+(publicar_ms) y no entran en lo demás. Para que los números digan algo, correr
+en una máquina con al menos tantos núcleos libres como el máximo de --procesos.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import numpy as np # type: ignore
+
+import motores
+import paralelo
+import recomendaciones
+import sinteticos
+from etapas_recomendaciones import version_codigo
+
+
+def resumen(tiempos):
+    return {"mediana_ms": round(float(np.median(tiempos)), 3), "p95_ms": round(float(np.percentile(tiempos, 95)), 3)}
+
+def medir_en_proceso(indice, perfiles, excluir, k, motor, lote):
+    tiempos = []
+    for (etiquetas, pesos), fuera in zip(perfiles, excluir):
+        t0 = time.perf_counter()
+        ids, sims, _ = indice.puntuar(etiquetas, pesos, excluir=fuera, motor=motor)
+        sims = np.round(sims, 4)
+        recomendaciones.seleccionar(ids, sims, k)
+        tiempos.append(1000 * (time.perf_counter() - t0))
+    t0 = time.perf_counter()
+    for _ in indice.puntuar_lote(lote[0], lote[1], k, motor=motor):
+        pass
+    segundos = time.perf_counter() - t0
+    return {"peticion": resumen(tiempos), "lote_adoptantes_s": round(len(lote[0]) / segundos, 1)}
+
+def medir_pool(puntuador, indice, perfiles, excluir, k, motor, lote):
+    t0 = time.perf_counter()
+    puntuador.top(indice, *perfiles[0], excluir[0], k, motor=motor)   # arranca el pool y publica
+    publicar_ms = 1000 * (time.perf_counter() - t0)
+
+    tiempos = []
+    for (etiquetas, pesos), fuera in zip(perfiles, excluir):
+        t0 = time.perf_counter()
+        puntuador.top(indice, etiquetas, pesos, fuera, k, motor=motor)
+        tiempos.append(1000 * (time.perf_counter() - t0))
+    t0 = time.perf_counter()
+    for _ in puntuador.puntuar_lote(indice, lote[0], lote[1], k, motor=motor):
+        pass
+    segundos = time.perf_counter() - t0
+    return {
+        "publicar_ms": round(publicar_ms, 1),
+        "peticion": resumen(tiempos),
+        "lote_adoptantes_s": round(len(lote[0]) / segundos, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mascotas", type=int, default=1_000_000)
+    parser.add_argument("--procesos", default=",".join(str(2 ** i) for i in range(8) if 2 ** i <= (os.cpu_count() or 1)),
+                        help="cantidades de procesos separadas por coma (por defecto potencias de 2 hasta los núcleos)")
+    parser.add_argument("--peticiones", type=int, default=30)
+    parser.add_argument("--lote", type=int, default=1000, help="adoptantes del lote")
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--motor", choices=sorted(motores.MOTORES), default=motores.MOTOR)
+    parser.add_argument("--etiquetas", type=int, default=500, help="tamaño del vocabulario")
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="archivo JSON (por defecto stdout)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.semilla)
+    vocab, prob = sinteticos.vocabulario(args.etiquetas, args.zipf)
+    indice = recomendaciones.IndiceEtiquetas()
+    indice.cargar(sinteticos.mascotas(rng, args.mascotas, vocab, prob))
+    perfiles = sinteticos.perfiles(rng, max(args.peticiones, args.lote), vocab, prob)
+    excluir = [set(rng.integers(1, args.mascotas + 1, size=int(rng.integers(0, 6))).tolist()) for _ in perfiles]
+    lote = (perfiles[:args.lote], excluir[:args.lote])
+    perfiles, excluir = perfiles[:args.peticiones], excluir[:args.peticiones]
+    print(f"✅ índice de {args.mascotas} mascotas", file=sys.stderr)
+
+    resultados = [{"procesos": 0, **medir_en_proceso(indice, perfiles, excluir, args.k, args.motor, lote)}]
+    print("✅ en el proceso", file=sys.stderr)
+    for n in (int(p) for p in args.procesos.split(",")):
+        puntuador = paralelo.PuntuadorParalelo(procesos=n, min_mascotas=0)
+        try:
+            resultados.append({"procesos": n, **medir_pool(puntuador, indice, perfiles, excluir, args.k, args.motor, lote)})
+        finally:
+            puntuador.cerrar()
+        print(f"✅ {n} procesos", file=sys.stderr)
+
+    salida = json.dumps({
+        "version": version_codigo(),
+        "python": platform.python_version(),
+        "nucleos": os.cpu_count(),
+        "mascotas": args.mascotas,
+        "motor": args.motor,
+        "k": args.k,
+        "resultados": resultados,   # procesos = 0: sin pool
+    }, indent=2)
+    if args.salida:
+        with open(args.salida, "w") as f:
+            f.write(salida + "\n")
+    else:
+        print(salida)
+
+
+if __name__ == "__main__":
+    main()
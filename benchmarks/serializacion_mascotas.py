@@ -0,0 +1,148 @@
+"""
+Filas por segundo de GET /mascotas: serialización con MascotaResponse contra
+el camino rápido de serializacion.py.
+
+    python benchmarks/serializacion_mascotas.py --escalas 1000,10000,100000
+
+Siembra mascotas de sinteticos.py (SQLite en memoria por defecto) y arma el
+cuerpo de la respuesta de las dos formas, sin HTTP:
+
+- "modelos": lo que hacía el endpoint (filas ORM + un MascotaResponse por
+  fila) más lo que FastAPI hace con response_model al devolverlo (volcar los
+  modelos, validarlos contra list[MascotaResponse], serializar y JSONResponse).
+- "rapido": tuplas Core de serializacion.COLUMNAS_MASCOTA, dicts y
+  RespuestaJSON (orjson si está instalado).
+
+Reporta la mediana de --repeticiones en ms por etapa (consulta, armar,
+codificar) y filas/s del total. Los dos cuerpos se comparan como JSON antes
+de medir.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+from typing import List
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import numpy as np # type: ignore
+from fastapi.responses import JSONResponse # type: ignore
+from pydantic import TypeAdapter # type: ignore
+from sqlalchemy import create_engine # type: ignore
+from sqlalchemy.orm import sessionmaker # type: ignore
+from sqlalchemy.pool import StaticPool # type: ignore
+
+import crud
+import etiquetado
+import models
+import schemas
+import serializacion
+import sinteticos
+from etapas_recomendaciones import Cronometro, sembrar, version_codigo
+
+ADAPTADOR = TypeAdapter(List[schemas.MascotaResponse])
+
+
+def ruta_modelos(db, crono: Cronometro) -> bytes:
+    with crono.etapa("consulta"):
+        filas = db.query(models.Mascota).filter(models.Mascota.estado != "Adoptado").all()
+        tags = etiquetado.de_mascotas(
+            db, db.query(models.Mascota.id).filter(models.Mascota.estado != "Adoptado")
+        )
+    with crono.etapa("armar"):
+        resultado = []
+        for m in filas:
+            guardadas = tags.get(m.id, etiquetado.VACIO)
+            created_at_str = m.created_at.isoformat() if isinstance(m.created_at, datetime) else str(m.created_at)
+            resultado.append(schemas.MascotaResponse(
+                id=m.id, nombre=m.nombre, edad_valor=m.edad_valor, edad_unidad=m.edad_unidad,
+                especie=m.especie, genero=m.genero, descripcion=m.descripcion,
+                albergue_id=m.albergue_id, imagen_id=m.imagen_id,
+                etiquetas=guardadas["etiquetas"], vacunas=guardadas["vacunas"],
+                estado=m.estado, created_at=created_at_str,
+            ))
+    with crono.etapa("codificar"):
+        # response_model: volcar, validar de nuevo y serializar
+        validados = ADAPTADOR.validate_python([m.model_dump() for m in resultado])
+        cuerpo = JSONResponse(ADAPTADOR.dump_python(validados, mode="json")).body
+    db.expunge_all()
+    return cuerpo
+
+def ruta_rapida(db, crono: Cronometro) -> bytes:
+    with crono.etapa("consulta"):
+        filas, tags, _ = crud.listar_mascotas(
+            db,
+            db.query(*serializacion.COLUMNAS_MASCOTA).filter(models.Mascota.estado != "Adoptado"),
+            schemas.FiltrosMascotas(),
+        )
+    with crono.etapa("armar"):
+        contenido = serializacion.mascotas(filas, tags)
+    with crono.etapa("codificar"):
+        cuerpo = serializacion.RespuestaJSON(contenido).body
+    return cuerpo
+
+
+def medir(db, ruta, repeticiones: int, n_filas: int):
+    crono = Cronometro()
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        ruta(db, crono)
+        crono.tiempos["total"].append(1000 * (time.perf_counter() - t0))
+    resumen = crono.resumen()
+    return {"etapas": resumen, "filas_s": round(n_filas / (resumen["total"]["mediana_ms"] / 1000), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--escalas", default="1000,10000,100000", help="mascotas separadas por coma")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--etiquetas", type=int, default=500, help="tamaño del vocabulario")
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--bd", default="sqlite://", help="URL de SQLAlchemy; por defecto SQLite en memoria")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="archivo JSON (por defecto stdout)")
+    args = parser.parse_args()
+
+    if args.bd == "sqlite://":
+        engine = create_engine(args.bd, poolclass=StaticPool, connect_args={"check_same_thread": False})
+    else:
+        engine = create_engine(args.bd)
+    Sesion = sessionmaker(bind=engine, autoflush=False)
+    vocab, prob = sinteticos.vocabulario(args.etiquetas, args.zipf)
+
+    resultados = []
+    for escala in (int(e) for e in args.escalas.split(",")):
+        sembrar(engine, np.random.default_rng(args.semilla), escala, 1, vocab, prob)
+        # sembrar no crea vacunas; los listados igual consultan la tabla (vacía)
+        models.MascotaVacuna.__table__.drop(engine, checkfirst=True)
+        models.MascotaVacuna.__table__.create(engine)
+        with Sesion() as db:
+            n_filas = db.query(models.Mascota).filter(models.Mascota.estado != "Adoptado").count()
+            if json.loads(ruta_modelos(db, Cronometro())) != json.loads(ruta_rapida(db, Cronometro())):
+                raise SystemExit(f"❌ {escala} mascotas: los cuerpos no coinciden")
+            for nombre, ruta in (("modelos", ruta_modelos), ("rapido", ruta_rapida)):
+                resultados.append({"escala": escala, "filas": n_filas, "ruta": nombre,
+                                   **medir(db, ruta, args.repeticiones, n_filas)})
+        print(f"✅ {escala} mascotas", file=sys.stderr)
+
+    salida = json.dumps({
+        "version": version_codigo(),
+        "python": platform.python_version(),
+        "bd": engine.dialect.name,
+        "orjson": serializacion.orjson is not None,
+        "resultados": resultados,
+    }, indent=2)
+    if args.salida:
+        with open(args.salida, "w") as f:
+            f.write(salida + "\n")
+    else:
+        print(salida)
+
+
+if __name__ == "__main__":
+    main()
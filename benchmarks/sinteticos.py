@@ -0,0 +1,65 @@
+"""
+Datos sintéticos para los benchmarks de recomendaciones.
+
+Las etiquetas salen de un vocabulario con frecuencias Zipf (unas pocas como
+"juguetón" o "vacunado" aparecen en casi todas las mascotas y la mayoría son
+raras), que es como se ve el catálogo real. Todo es vectorizado para poder
+generar millones de filas en segundos.
+"""
+import json
+from typing import Any, Dict, List, Tuple
+
+import numpy as np # type: ignore
+
+CLAVES_ADOPTANTE = ["preferencias", "estilo_vida", "experiencia"]
+ESPECIES = ["perro", "gato"]
+
+
+def vocabulario(n_etiquetas: int = 500, zipf: float = 1.1) -> Tuple[List[str], np.ndarray]:
+    """Nombres de las etiquetas y su probabilidad (Zipf con exponente `zipf`)."""
+    prob = 1.0 / np.arange(1, n_etiquetas + 1) ** zipf
+    return [f"etiqueta_{i}" for i in range(n_etiquetas)], prob / prob.sum()
+
+def listas_etiquetas(rng, n: int, vocab: List[str], prob: np.ndarray, minimo: int, maximo: int) -> List[List[str]]:
+    """n listas de entre minimo y maximo etiquetas distintas."""
+    tamanos = rng.integers(minimo, maximo + 1, size=n)
+    planas = rng.choice(len(vocab), size=int(tamanos.sum()), p=prob)
+    # las repetidas dentro de una misma lista se descartan (quedan algo más cortas)
+    return [
+        [vocab[i] for i in dict.fromkeys(trozo.tolist())]
+        for trozo in np.split(planas, np.cumsum(tamanos)[:-1])
+    ]
+
+def mascotas(rng, n: int, vocab: List[str], prob: np.ndarray, n_albergues: int = 50) -> List[Dict[str, Any]]:
+    """Dicts como los de recomendaciones.datos_mascota (ids desde 1)."""
+    albergues = rng.integers(1, n_albergues + 1, size=n).tolist()
+    return [
+        {"id": i + 1, "nombre": f"mascota_{i + 1}", "especie": ESPECIES[i % 2], "edad_valor": 1 + i % 15,
+         "edad_unidad": "meses", "descripcion": None, "albergue_id": albergues[i], "imagen_id": 1, "tags": tags}
+        for i, tags in enumerate(listas_etiquetas(rng, n, vocab, prob, 1, 8))
+    ]
+
+def perfiles(rng, n: int, vocab: List[str], prob: np.ndarray) -> List[Tuple[Dict[str, Any], Dict[str, float]]]:
+    """(etiquetas, pesos) de n adoptantes: etiquetas repartidas en varias claves y pesos en algunas."""
+    resultado = []
+    for tags in listas_etiquetas(rng, n, vocab, prob, 3, 8):
+        etiquetas = {clave: tags[i::len(CLAVES_ADOPTANTE)] for i, clave in enumerate(CLAVES_ADOPTANTE)}
+        pesos = {t: round(float(rng.uniform(0.5, 3.0)), 2) for t in tags[:int(rng.integers(0, 4))]}
+        resultado.append((etiquetas, pesos))
+    return resultado
+
+def fila_mascota(datos: Dict[str, Any], estado: str = "Disponible") -> Dict[str, Any]:
+    """Fila de la tabla mascotas para un dict de mascotas()."""
+    return {
+        "id": datos["id"], "nombre": datos["nombre"], "especie": datos["especie"],
+        "edad_valor": datos["edad_valor"], "edad_unidad": datos["edad_unidad"],
+        "albergue_id": datos["albergue_id"], "imagen_id": datos["imagen_id"],
+        "etiquetas": json.dumps(datos["tags"]), "genero": "macho", "estado": estado,
+    }
+
+def fila_adoptante(adoptante_id: int, etiquetas: Dict[str, Any], pesos: Dict[str, float]) -> Dict[str, Any]:
+    return {
+        "id": adoptante_id, "nombre": f"adoptante_{adoptante_id}", "apellido": "bench",
+        "dni": str(10_000_000 + adoptante_id), "correo": f"adoptante_{adoptante_id}@bench.local",
+        "contrasena": "x", "etiquetas": json.dumps(etiquetas), "pesos": json.dumps(pesos),
+    }
@@ -0,0 +1,280 @@
+"""
+Búsqueda de texto en nombre y descripción de las mascotas (GET /mascotas/texto).
+
+Todos los términos de la consulta tienen que aparecer como prefijo de alguna
+palabra (autocompletar: "lab" encuentra "labrador"); además entra cualquier
+mascota cuyo nombre se parezca a la consulta por trigramas (tolera errores de
+tipeo: "firulias" encuentra "Firulais"). El puntaje suma la relevancia del
+texto (el nombre pesa más que la descripción) y la similitud del nombre, se
+redondea a 4 decimales y pagina con el mismo cursor (puntaje, id) que
+/recomendaciones. Solo busca mascotas disponibles, con la misma regla que
+/recomendaciones (recomendaciones.sin_adoptar): sin estado "Adoptado" y sin
+fila en adopciones.
+
+Dos implementaciones:
+- Postgres: tsvector con la configuración "spanish" y pg_trgm, cada uno con
+  su índice GIN (preparar() los crea al arrancar).
+- Memoria (SQLite, pruebas o BUSQUEDA_TEXTO=memoria): IndiceTexto, un índice
+  invertido por proceso que se parchea en crear/editar/adoptar como
+  recomendaciones.indice. Sin stemming: los prefijos cubren plurales y
+  variantes cortas. Los puntajes no son iguales a los de Postgres, solo el
+  criterio.
+"""
+import bisect
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np # type: ignore
+from sqlalchemy import Float, Numeric, cast, func, literal_column, or_, and_, text # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+
+import etiquetado
+import models
+import recomendaciones
+import serializacion
+
+MOTOR = os.getenv("BUSQUEDA_TEXTO", "auto")   # "auto" (Postgres si la BD lo es) o "memoria"
+UMBRAL_TRIGRAMAS = 0.3   # el de pg_trgm.similarity_threshold por defecto
+PESO_NOMBRE, PESO_DESCRIPCION = 1.0, 0.4   # pesos A y B de ts_rank
+
+M = models.Mascota
+
+# El índice y las consultas usan exactamente esta expresión
+DOCUMENTO = (
+    "setweight(to_tsvector('spanish', coalesce(nombre, '')), 'A') || "
+    "setweight(to_tsvector('spanish', coalesce(descripcion, '')), 'B')"
+)
+DDL_POSTGRES = (
+    f"CREATE INDEX IF NOT EXISTS ix_mascotas_texto ON mascotas USING gin (({DOCUMENTO}))",
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_mascotas_nombre_trgm ON mascotas USING gin (lower(nombre) gin_trgm_ops)",
+)
+trigramas_postgres = False   # pg_trgm instalado (lo averigua preparar)
+
+VACIAS = frozenset(
+    "a al con de del el en es la las lo los me mi muy o para por que se sin su sus un una unos unas y".split()
+)
+
+
+def en_postgres(db: Session) -> bool:
+    return MOTOR != "memoria" and db.get_bind().dialect.name == "postgresql"
+
+def preparar(db: Session):
+    """En el arranque: índices GIN en Postgres, o el índice en memoria."""
+    global trigramas_postgres
+    if not en_postgres(db):
+        indice.construir(db)
+        return
+    for sentencia in DDL_POSTGRES:
+        try:
+            db.execute(text(sentencia))
+            db.commit()
+        except Exception as e:   # p. ej. sin permiso para CREATE EXTENSION
+            db.rollback()
+            print(f"⚠️ Búsqueda de texto: no se pudo ejecutar «{sentencia[:40]}...»: {e}")
+    trigramas_postgres = bool(db.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar())
+
+
+# ---------- texto ----------
+
+def normalizar(texto: str) -> str:
+    """Minúsculas y sin tildes."""
+    descompuesto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in descompuesto if not unicodedata.combining(c))
+
+def terminos(texto: Optional[str]) -> List[str]:
+    return [t for t in re.findall(r"\w+", normalizar(texto or "")) if t not in VACIAS]
+
+def trigramas(texto: Optional[str]) -> Set[str]:
+    """Los de pg_trgm: cada palabra con dos espacios delante y uno detrás."""
+    resultado = set()
+    for palabra in re.findall(r"[^\W_]+", normalizar(texto or "")):
+        relleno = f"  {palabra} "
+        resultado.update(relleno[i:i + 3] for i in range(len(relleno) - 2))
+    return resultado
+
+
+# ---------- índice en memoria ----------
+
+class IndiceTexto:
+    """
+    Índice invertido de nombre + descripción de las mascotas disponibles.
+
+    Por término guarda {mascota_id: peso} (peso del campo x (1 + ln tf)) y una
+    lista ordenada del vocabulario para expandir prefijos con bisect; por
+    trigrama del nombre, las mascotas que lo tienen. Como IndiceEtiquetas, vive
+    en el proceso y se parchea en crear/editar/adoptar.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.construido = False
+        self._reset()
+
+    def _reset(self):
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._vocabulario: List[str] = []               # ordenado, para prefijos
+        self._terminos_de: Dict[int, List[str]] = {}
+        self._trigramas: Dict[str, Set[int]] = defaultdict(set)
+        self._trigramas_de: Dict[int, Set[str]] = {}
+
+    def construir(self, db: Session):
+        filas = db.query(M.id, M.nombre, M.descripcion).filter(recomendaciones.sin_adoptar()).all()
+        with self._lock:
+            self._reset()
+            for mascota_id, nombre, descripcion in filas:
+                self._agregar(mascota_id, nombre, descripcion)
+            self.construido = True
+
+    def asegurar(self, db: Session):
+        if not self.construido:
+            self.construir(db)
+
+    # ---------- parches ----------
+
+    def actualizar(self, mascota):
+        """Refleja el estado actual de una mascota ya guardada."""
+        with self._lock:
+            if not self.construido:
+                return
+            self._quitar(mascota.id)
+            if recomendaciones.disponible(mascota):
+                self._agregar(mascota.id, mascota.nombre, mascota.descripcion)
+
+    def quitar(self, mascota_id: int):
+        with self._lock:
+            if self.construido:
+                self._quitar(mascota_id)
+
+    def _agregar(self, mascota_id: int, nombre: Optional[str], descripcion: Optional[str]):
+        pesos: Dict[str, float] = {}
+        for campo, peso in ((nombre, PESO_NOMBRE), (descripcion, PESO_DESCRIPCION)):
+            for termino, tf in Counter(terminos(campo)).items():
+                pesos[termino] = max(pesos.get(termino, 0.0), peso * (1 + math.log(tf)))
+        for termino, peso in pesos.items():
+            posting = self._postings.get(termino)
+            if posting is None:
+                posting = self._postings[termino] = {}
+                bisect.insort(self._vocabulario, termino)
+            posting[mascota_id] = peso
+        self._terminos_de[mascota_id] = list(pesos)
+        tris = trigramas(nombre)
+        for tri in tris:
+            self._trigramas[tri].add(mascota_id)
+        self._trigramas_de[mascota_id] = tris
+
+    def _quitar(self, mascota_id: int):
+        for termino in self._terminos_de.pop(mascota_id, ()):
+            posting = self._postings[termino]
+            del posting[mascota_id]
+            if not posting:
+                del self._postings[termino]
+                del self._vocabulario[bisect.bisect_left(self._vocabulario, termino)]
+        for tri in self._trigramas_de.pop(mascota_id, ()):
+            self._trigramas[tri].discard(mascota_id)
+            if not self._trigramas[tri]:
+                del self._trigramas[tri]
+
+    # ---------- consulta ----------
+
+    def _expandir(self, prefijo: str) -> List[str]:
+        inicio = bisect.bisect_left(self._vocabulario, prefijo)
+        fin = bisect.bisect_left(self._vocabulario, prefijo + "\uffff")
+        return self._vocabulario[inicio:fin]
+
+    def puntuar(self, consulta: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, puntajes redondeados) de las mascotas que coinciden, sin orden."""
+        with self._lock:
+            n = len(self._terminos_de)
+            texto: Optional[Dict[int, float]] = None
+            for termino in terminos(consulta):
+                # Cada término vale por su mejor expansión en la mascota, con idf
+                mejor: Dict[int, float] = {}
+                idf_max = 0.0
+                for expansion in self._expandir(termino):
+                    posting = self._postings[expansion]
+                    idf = math.log(1 + n / len(posting))
+                    idf_max = max(idf_max, idf)
+                    for mascota_id, peso in posting.items():
+                        if peso * idf > mejor.get(mascota_id, 0.0):
+                            mejor[mascota_id] = peso * idf
+                if texto is None:
+                    texto = {i: v / idf_max for i, v in mejor.items()} if mejor else {}
+                else:
+                    texto = {i: v + mejor[i] / idf_max for i, v in texto.items() if i in mejor}
+                if not texto:
+                    break
+            texto = texto or {}
+
+            nombre: Dict[int, float] = {}
+            tris = trigramas(consulta)
+            if tris:
+                comunes = Counter(i for tri in tris for i in self._trigramas.get(tri, ()))
+                for mascota_id, c in comunes.items():
+                    similitud = c / (len(tris) + len(self._trigramas_de[mascota_id]) - c)
+                    if similitud >= UMBRAL_TRIGRAMAS:
+                        nombre[mascota_id] = similitud
+
+        ids = np.fromiter(texto.keys() | nombre.keys(), dtype=np.int64)
+        puntajes = np.array([texto.get(i, 0.0) + nombre.get(i, 0.0) for i in ids.tolist()], dtype=np.float64)
+        return ids, np.round(puntajes, 4)
+
+
+indice = IndiceTexto()
+
+
+# ---------- búsqueda ----------
+
+def buscar(
+    db: Session,
+    consulta: str,
+    k: int,
+    despues: Optional[Tuple[float, int]] = None,
+) -> Tuple[List[Any], Dict[int, Dict[str, List[str]]], Optional[Tuple[float, int]]]:
+    """
+    (filas de serializacion.COLUMNAS_MASCOTA en orden, etiquetas, cursor de la
+    siguiente página o None) para la página de k resultados después de `despues`.
+    """
+    if en_postgres(db):
+        filas, siguiente = _buscar_postgres(db, consulta, k, despues)
+    else:
+        filas, siguiente = _buscar_memoria(db, consulta, k, despues)
+    ids = [f[0] for f in filas]
+    return filas, etiquetado.de_mascotas(db, ids) if ids else {}, siguiente
+
+def _buscar_postgres(db: Session, consulta: str, k: int, despues):
+    documento = literal_column(f"({DOCUMENTO})")
+    # Sin quitar tildes: el tsvector las conserva. La configuración descarta las palabras vacías
+    consulta_ts = " & ".join(f"{t}:*" for t in re.findall(r"[^\W_]+", consulta.lower()))
+    tsquery = func.to_tsquery(literal_column("'spanish'"), consulta_ts)
+    coincide = documento.op("@@")(tsquery)
+    rango = func.ts_rank_cd(documento, tsquery)
+    if trigramas_postgres:
+        nombre = func.lower(M.nombre)
+        coincide = or_(coincide, nombre.op("%")(consulta.lower()))
+        rango = rango + func.similarity(nombre, consulta.lower())
+    puntaje = cast(func.round(cast(rango, Numeric), 4), Float)
+
+    q = db.query(*serializacion.COLUMNAS_MASCOTA, puntaje.label("puntaje")).filter(recomendaciones.sin_adoptar(), coincide)
+    if despues is not None:
+        q = q.filter(or_(puntaje < despues[0], and_(puntaje == despues[0], M.id > despues[1])))
+    filas = q.order_by(puntaje.desc(), M.id).limit(k + 1).all()
+    siguiente = (filas[k - 1].puntaje, filas[k - 1].id) if len(filas) > k else None
+    return [tuple(f)[:-1] for f in filas[:k]], siguiente
+
+def _buscar_memoria(db: Session, consulta: str, k: int, despues):
+    indice.asegurar(db)
+    ids, puntajes = indice.puntuar(consulta)
+    posiciones, hay_mas = recomendaciones.seleccionar(ids, puntajes, k, despues)
+    pagina = ids[posiciones].tolist()
+    if not pagina:
+        return [], None
+    por_id = {f.id: f for f in db.query(*serializacion.COLUMNAS_MASCOTA).filter(M.id.in_(pagina))}
+    filas = [por_id[i] for i in pagina if i in por_id]
+    ultimo = posiciones[-1]
+    return filas, (float(puntajes[ultimo]), int(ids[ultimo])) if hay_mas else None
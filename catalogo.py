@@ -0,0 +1,81 @@
+"""
+Versión del catálogo de mascotas para ETag / If-None-Match.
+
+La tabla catalogo_version guarda un contador global (mascota_id = 0) y uno por
+mascota. crear_mascota, editar_mascota y marcar_como_adoptado llaman a
+cambio() dentro de su transacción (la importación masiva, a cambio_lote()):
+sube el global y la mascota toma ese valor, así que los dos son monotónicos
+y se ven recién con el commit. Viven en la BD
+(no en memoria como IndiceEtiquetas.version) para que todos los workers
+respondan el mismo ETag y sobrevivan a un reinicio.
+
+Los endpoints leen la versión ANTES de consultar mascotas: si alguien escribe
+en el medio, la respuesta sale con el ETag viejo y la próxima consulta trae
+un 200 de nuevo (nunca al revés).
+"""
+from typing import Optional
+
+from fastapi import Response # type: ignore
+from sqlalchemy import delete, insert, select, update # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+
+import models
+
+CV = models.CatalogoVersion
+GLOBAL = 0
+
+
+def asegurar(db: Session):
+    """Crea la fila del contador global si falta (en el arranque)."""
+    if db.get(CV, GLOBAL) is None:
+        db.add(CV(mascota_id=GLOBAL, version=0))
+        db.commit()
+
+def version(db: Session, mascota_id: int = GLOBAL) -> int:
+    return db.execute(select(CV.version).where(CV.mascota_id == mascota_id)).scalar() or 0
+
+def _subir_global(db: Session) -> int:
+    nueva = db.execute(
+        update(CV).where(CV.mascota_id == GLOBAL).values(version=CV.version + 1).returning(CV.version)
+    ).scalar()
+    if nueva is None:   # sin asegurar()
+        nueva = 1
+        db.execute(insert(CV).values(mascota_id=GLOBAL, version=nueva))
+    return nueva
+
+def cambio(db: Session, mascota_id: int) -> int:
+    """Sube la versión global y la de la mascota; no hace commit. El UPDATE deja tomada la fila global hasta el commit."""
+    nueva = _subir_global(db)
+    if db.execute(update(CV).where(CV.mascota_id == mascota_id).values(version=nueva)).rowcount == 0:
+        db.execute(insert(CV).values(mascota_id=mascota_id, version=nueva))
+    return nueva
+
+def cambio_lote(db: Session, mascota_ids) -> int:
+    """Como cambio() para mascotas recién creadas: el global sube una vez y todas toman ese valor."""
+    nueva = _subir_global(db)
+    if mascota_ids:
+        db.execute(delete(CV).where(CV.mascota_id.in_(mascota_ids)))
+        db.execute(insert(CV), [{"mascota_id": i, "version": nueva} for i in mascota_ids])
+    return nueva
+
+
+def etag_catalogo(v: int) -> str:
+    return f'"c{v}"'
+
+def etag_mascota(mascota_id: int, v: int) -> str:
+    return f'"m{mascota_id}-{v}"'
+
+def coincide(if_none_match: Optional[str], etag: str) -> bool:
+    """Comparación débil de If-None-Match (RFC 9110): lista separada por comas, W/ o *."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(e.strip().removeprefix("W/") == etag for e in if_none_match.split(","))
+
+def no_modificado(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+def cabeceras(etag: str) -> dict:
+    # no-cache: el cliente puede guardarla pero revalida siempre con If-None-Match
+    return {"ETag": etag, "Cache-Control": "no-cache"}
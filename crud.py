@@ -1,20 +1,20 @@
+from sqlalchemy import insert, tuple_ # type: ignore
 from sqlalchemy.orm import Session # type: ignore
 import models
 import schemas
+import etiquetado
 from passlib.hash import bcrypt # type: ignore
-import json
 from pytz import timezone
 
 import pytz # type: ignore
 from datetime import datetime 
+from typing import List
 from models import Mascota, Calendario, CitaVisita, CitaEvento, Match, Adopcion, Denegacion
 
 # === ADOPTANTE ===
 def create_adoptante(db: Session, adoptante: schemas.AdoptanteRegister):
     hashed_pw = bcrypt.hash(adoptante.contrasena)
-    etiquetas = json.dumps(adoptante.etiquetas) if adoptante.etiquetas is not None else None
-    pesos     = json.dumps(adoptante.pesos)     if adoptante.pesos     is not None else None
-    
+
     db_adoptante = models.Adoptante(
         nombre=adoptante.nombre,
         apellido=adoptante.apellido,
@@ -22,11 +22,11 @@ def create_adoptante(db: Session, adoptante: schemas.AdoptanteRegister):
         correo=adoptante.correo,
         telefono=getattr(adoptante, "telefono", None),
         contrasena=hashed_pw,
-        etiquetas=etiquetas,      
         imagen_perfil_id=adoptante.imagen_perfil_id,
-        pesos=pesos,    
     )
     db.add(db_adoptante)
+    db.flush()
+    etiquetado.guardar_adoptante(db, db_adoptante.id, adoptante.etiquetas, adoptante.pesos)
     db.commit()
     db.refresh(db_adoptante)
     return db_adoptante
@@ -69,11 +69,8 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.verify(plain_password, hashed_password)
 
 
-def create_mascota(db: Session, mascota: schemas.MascotaCreate, albergue_id: int):
-    lima_tz = pytz.timezone("America/Lima")
-    ahora_lima = datetime.now(lima_tz)
-
-    nueva = models.Mascota(
+def valores_mascota(mascota: schemas.MascotaCreate, albergue_id: int, ahora: datetime) -> dict:
+    return dict(
         nombre=mascota.nombre,
         edad_valor=mascota.edad_valor or 0,  # 👈 default 0
         edad_unidad=mascota.edad_unidad or "meses",  # 👈 default "meses"
@@ -81,19 +78,120 @@ def create_mascota(db: Session, mascota: schemas.MascotaCreate, albergue_id: int
         genero=mascota.genero,  
         descripcion=mascota.descripcion,
         imagen_id=mascota.imagen_id,
-        etiquetas=json.dumps(mascota.etiquetas),
-        vacunas=json.dumps(mascota.vacunas),  # 👈 Agregado aquí
         estado=mascota.estado or "En adopción",
         albergue_id=albergue_id,
-        created_at=ahora_lima, 
+        created_at=ahora, 
     )
-    db.add(nueva)
-    db.commit()
-    db.refresh(nueva)
-    return nueva
 
+def create_mascota(db: Session, mascota: schemas.MascotaCreate, albergue_id: int):
+    """
+    Inserta la mascota con sus etiquetas, sin commit: quien llama sube la
+    versión del catálogo en la misma transacción y hace el commit.
+    """
+    lima_tz = pytz.timezone("America/Lima")
+    ahora_lima = datetime.now(lima_tz)
 
+    nueva = models.Mascota(**valores_mascota(mascota, albergue_id, ahora_lima))
+    db.add(nueva)
+    db.flush()
+    etiquetado.guardar_mascota(db, nueva.id, mascota.etiquetas, mascota.vacunas)
+    return nueva
 
+def create_mascotas(db: Session, mascotas: List[schemas.MascotaCreate], albergue_id: int) -> List[int]:
+    """
+    Como create_mascota para un lote, sin commit: un INSERT de varias filas
+    con RETURNING para las mascotas y otro por tabla puente. Devuelve los ids
+    en el orden de `mascotas`. No toca la versión del catálogo: quien llama
+    hace catalogo.cambio_lote una vez, justo antes del commit (subir el global
+    bloquea su fila hasta el commit).
+    """
+    if not mascotas:
+        return []
+    ahora_lima = datetime.now(pytz.timezone("America/Lima"))
+    ids = db.execute(
+        insert(models.Mascota).returning(models.Mascota.id, sort_by_parameter_order=True),
+        [valores_mascota(m, albergue_id, ahora_lima) for m in mascotas],
+    ).scalars().all()
+    etiquetado.guardar_mascotas_nuevas(db, [(i, m.etiquetas, m.vacunas) for i, m in zip(ids, mascotas)])
+    return list(ids)
+
+def create_imagenes(db: Session, modelo, rutas: List[str]) -> List[int]:
+    """Filas de Imagen o ImagenPerfil en un INSERT, sin commit; ids en el orden de `rutas`."""
+    if not rutas:
+        return []
+    return list(db.execute(
+        insert(modelo).returning(modelo.id, sort_by_parameter_order=True),
+        [{"ruta": r} for r in rutas],
+    ).scalars().all())
+
+
+
+
+# === LISTADOS DE MASCOTAS (keyset) ===
+LIMITE_PAGINA_MAX = 500
+
+def filtrar_mascotas(query, filtros: schemas.FiltrosMascotas):
+    M = models.Mascota
+    for columna, valor in (
+        (M.especie, filtros.especie),
+        (M.genero, filtros.genero),
+        (M.estado, filtros.estado),
+        (M.albergue_id, filtros.albergue_id),
+    ):
+        if valor is not None:
+            query = query.filter(columna == valor)
+    if filtros.edad_min_meses is not None:
+        query = query.filter(models.EDAD_MESES >= filtros.edad_min_meses)
+    if filtros.edad_max_meses is not None:
+        query = query.filter(models.EDAD_MESES <= filtros.edad_max_meses)
+    return query
+
+def paginar_mascotas(query, filtros: schemas.FiltrosMascotas):
+    """
+    Orden + "después de" como rango sobre los índices (..., id) / (created_at, id),
+    así cada página es un recorrido acotado del índice y no un OFFSET.
+    ValueError si los after_* no corresponden al orden.
+    """
+    M = models.Mascota
+    if filtros.orden == "recientes":
+        if (filtros.after_id is None) != (filtros.after_created_at is None):
+            raise ValueError("Con orden=recientes after_id y after_created_at van juntos")
+        if filtros.after_id is not None:
+            query = query.filter(tuple_(M.created_at, M.id) < tuple_(filtros.after_created_at, filtros.after_id))
+        query = query.order_by(M.created_at.desc(), M.id.desc())
+    else:
+        if filtros.after_created_at is not None:
+            raise ValueError("after_created_at solo va con orden=recientes")
+        if filtros.after_id is not None:
+            query = query.filter(M.id > filtros.after_id)
+        query = query.order_by(M.id)
+    if filtros.limit is not None:
+        query = query.limit(min(filtros.limit, LIMITE_PAGINA_MAX) + 1)   # +1: saber si hay otra página
+    return query
+
+def listar_mascotas(db: Session, query, filtros: schemas.FiltrosMascotas, etiquetas: bool = True, vacunas: bool = True):
+    """
+    (mascotas, etiquetas de etiquetado.de_mascotas, after_* de la siguiente página o None)
+    para una consulta base de Mascota, aplicando filtros y página. La consulta
+    tiene que traer id (y created_at con orden=recientes). Sin etiquetas ni
+    vacunas no se consulta etiquetado.
+    """
+    filtrada = filtrar_mascotas(query, filtros)
+    mascotas = paginar_mascotas(filtrada, filtros).all()
+    siguiente = None
+    if filtros.limit is not None:
+        limite = min(filtros.limit, LIMITE_PAGINA_MAX)
+        if len(mascotas) > limite:
+            mascotas = mascotas[:limite]
+            ultima = mascotas[-1]
+            siguiente = {"after_id": ultima.id}
+            if filtros.orden == "recientes":
+                siguiente["after_created_at"] = ultima.created_at.isoformat()
+        ids = [m.id for m in mascotas]
+    else:
+        ids = filtrada.with_entities(models.Mascota.id)
+    tags = etiquetado.de_mascotas(db, ids, vacunas=vacunas, etiquetas=etiquetas) if etiquetas or vacunas else {}
+    return mascotas, tags, siguiente
 
 def get_all_mascotas(db: Session):
     return db.query(models.Mascota).all()
@@ -182,7 +280,8 @@ def get_adopcion_por_mascota(db: Session, mascota_id: int):
 
 def denegar_match(db: Session, adoptante_id: int, mascota_id: int):
     """
-    Registra la denegación y luego borra el match.
+    Registra la denegación y luego borra el match, sin commit: quien llama
+    invalida el top precalculado del adoptante en la misma transacción.
     """
     # 1) Crear registro de Denegacion
     neg = Denegacion(
@@ -200,6 +299,4 @@ def denegar_match(db: Session, adoptante_id: int, mascota_id: int):
         db.rollback()
         raise Exception("No se encontró match para denegar")
 
-    db.commit()
-    db.refresh(neg)
     return neg
\ No newline at end of file
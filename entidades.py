@@ -0,0 +1,196 @@
+"""
+Caché de lectura de mascotas, albergues y adoptantes por id.
+
+GET /mascotas/{id}, /usuario/mascotas/{id}, /albergue/{id}, /adoptante/{id}
+y los contactos de /mensajes/contactos piden una y otra vez las mismas filas.
+Acá se guarda la respuesta ya armada (dicts listos para JSON) con LRU + TTL:
+si no está, se carga de la BD y se guarda (read-through). Las escrituras
+avisan con mascota_cambio / adoptante_cambio / albergue_cambio después del
+commit; el TTL acota lo que pueda quedar viejo si una lectura en curso
+guarda el valor anterior justo después de invalidar.
+
+El almacén es enchufable: por defecto un dict por proceso (AlmacenMemoria);
+con ENTIDADES_CACHE_URL=redis://localhost:6379/0 todos los workers comparten
+un Redis local (AlmacenRedis, necesita `pip install redis`; el tope de
+tamaño lo pone maxmemory + allkeys-lru del servidor). Cualquier objeto con
+obtener/guardar/borrar/tamano sirve.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy.orm import Session # type: ignore
+
+import catalogo
+import etiquetado
+import models
+import schemas
+import serializacion
+
+MAX_ENTRADAS = int(os.getenv("ENTIDADES_CACHE_MAX", "10000"))
+TTL_SEGUNDOS = float(os.getenv("ENTIDADES_CACHE_TTL_SEGUNDOS", "60"))
+URL = os.getenv("ENTIDADES_CACHE_URL", "")   # vacío = en memoria por proceso
+
+
+class AlmacenMemoria:
+    """LRU con vencimiento por entrada, en el proceso."""
+    nombre = "memoria"
+
+    def __init__(self, max_entradas: int = MAX_ENTRADAS, ttl: float = TTL_SEGUNDOS):
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[str, tuple]" = OrderedDict()   # clave -> (vence, valor)
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+
+    def obtener(self, clave: str) -> Optional[Any]:
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            if entrada[0] < time.monotonic():
+                del self._entradas[clave]
+                return None
+            self._entradas.move_to_end(clave)
+            return entrada[1]
+
+    def guardar(self, clave: str, valor: Any):
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + self.ttl, valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def borrar(self, clave: str):
+        with self._lock:
+            self._entradas.pop(clave, None)
+
+    def tamano(self) -> int:
+        return len(self._entradas)
+
+class AlmacenRedis:
+    """Redis compartido entre workers; los valores van como JSON con SETEX."""
+    nombre = "redis"
+
+    def __init__(self, url: str, ttl: float = TTL_SEGUNDOS, prefijo: str = "doggo:entidad:"):
+        import redis # type: ignore
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = max(1, int(ttl))
+        self.prefijo = prefijo
+
+    def obtener(self, clave: str) -> Optional[Any]:
+        crudo = self._redis.get(self.prefijo + clave)
+        return json.loads(crudo) if crudo is not None else None
+
+    def guardar(self, clave: str, valor: Any):
+        self._redis.setex(self.prefijo + clave, self.ttl, json.dumps(valor))
+
+    def borrar(self, clave: str):
+        self._redis.delete(self.prefijo + clave)
+
+    def tamano(self) -> int:
+        return int(self._redis.dbsize())   # todas las claves de la BD de Redis
+
+
+class CacheEntidades:
+    def __init__(self, almacen):
+        self.almacen = almacen
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(
+        self,
+        clave: str,
+        cargar: Callable[[], Optional[Dict[str, Any]]],
+        vigente: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        El valor cacheado (si vigente() lo acepta) o cargar(), que se guarda si
+        no es None: los 404 no se cachean.
+        """
+        valor = self.almacen.obtener(clave)
+        if valor is not None and (vigente is None or vigente(valor)):
+            self.aciertos += 1
+            return valor
+        self.fallos += 1
+        valor = cargar()
+        if valor is not None:
+            self.almacen.guardar(clave, valor)
+        return valor
+
+    def invalidar(self, *claves: str):
+        for clave in claves:
+            self.almacen.borrar(clave)
+
+    def estadisticas(self) -> Dict[str, Any]:
+        total = self.aciertos + self.fallos
+        return {
+            "almacen": self.almacen.nombre,
+            "aciertos": self.aciertos,   # de este proceso
+            "fallos": self.fallos,
+            "ratio_aciertos": round(self.aciertos / total, 4) if total else 0.0,
+            "entradas": self.almacen.tamano(),
+            "ttl_segundos": self.almacen.ttl,
+        }
+
+
+cache = CacheEntidades(AlmacenRedis(URL) if URL else AlmacenMemoria())
+
+
+# ---------- lecturas ----------
+
+def mascota(db: Session, mascota_id: int, version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Como schemas.MascotaResponse. Se guarda con la versión de catalogo leída
+    antes de cargarla; si quien llama ya leyó la versión (para el ETag), solo
+    sirve una entrada de esa versión: así entre el commit de un cambio y su
+    invalidación nunca sale la mascota vieja con el ETag nuevo.
+    """
+    def cargar():
+        v = catalogo.version(db, mascota_id) if version is None else version
+        fila = db.query(*serializacion.COLUMNAS_MASCOTA).filter(models.Mascota.id == mascota_id).first()
+        if fila is None:
+            return None
+        guardadas = etiquetado.de_mascotas(db, [mascota_id]).get(mascota_id, etiquetado.VACIO)
+        return {"version": v, "datos": serializacion.mascota(fila, guardadas)}
+    vigente = None if version is None else (lambda valor: valor["version"] == version)
+    valor = cache.obtener(f"mascota:{mascota_id}", cargar, vigente)
+    return valor["datos"] if valor is not None else None
+
+def adoptante(db: Session, adoptante_id: int) -> Optional[Dict[str, Any]]:
+    """Como schemas.AdoptanteOut."""
+    def cargar():
+        obj = db.query(models.Adoptante).filter(models.Adoptante.id == adoptante_id).first()
+        if obj is None:
+            return None
+        return schemas.AdoptanteOut.from_orm_with_etiquetas(obj, *etiquetado.de_adoptante(db, adoptante_id)).model_dump(mode="json")
+    return cache.obtener(f"adoptante:{adoptante_id}", cargar)
+
+def albergue(db: Session, albergue_id: int) -> Optional[Dict[str, Any]]:
+    """Como schemas.AlbergueOut."""
+    def cargar():
+        obj = db.query(models.Albergue).filter(models.Albergue.id == albergue_id).first()
+        return schemas.AlbergueOut.model_validate(obj).model_dump(mode="json") if obj is not None else None
+    return cache.obtener(f"albergue:{albergue_id}", cargar)
+
+def contacto(db: Session, tipo: str, contacto_id: int) -> Optional[Dict[str, Any]]:
+    """{"id", "nombre"} de un adoptante o albergue, lo que usan los contactos del chat."""
+    modelo = models.Adoptante if tipo == "adoptante" else models.Albergue
+    def cargar():
+        fila = db.query(modelo.id, modelo.nombre).filter(modelo.id == contacto_id).first()
+        return {"id": fila.id, "nombre": fila.nombre} if fila is not None else None
+    return cache.obtener(f"contacto:{'adoptante' if tipo == 'adoptante' else 'albergue'}:{contacto_id}", cargar)
+
+
+# ---------- invalidación (después del commit) ----------
+
+def mascota_cambio(mascota_id: int):
+    cache.invalidar(f"mascota:{mascota_id}")
+
+def adoptante_cambio(adoptante_id: int):
+    cache.invalidar(f"adoptante:{adoptante_id}", f"contacto:adoptante:{adoptante_id}")
+
+def albergue_cambio(albergue_id: int):
+    cache.invalidar(f"albergue:{albergue_id}", f"contacto:albergue:{albergue_id}")
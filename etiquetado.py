@@ -0,0 +1,294 @@
+"""
+Etiquetas normalizadas con ids enteros.
+
+Cada nombre de etiqueta o vacuna se guarda una vez en la tabla `etiqueta` y
+las mascotas/adoptantes apuntan a él desde las tablas puente
+(mascota_etiqueta, mascota_vacuna, adoptante_etiqueta, adoptante_peso), así
+la BD puede filtrar por etiqueta y nadie tiene que re-parsear JSON fila por
+fila. Las lecturas y escrituras salen de acá; las columnas JSON viejas ya
+no se escriben (quedan con lo que tenían antes de las tablas) y migrar() pasa
+a las tablas lo que solo estaba en ellas, una sola vez.
+"""
+import json
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import exists, false, insert, or_, select # type: ignore
+from sqlalchemy.exc import IntegrityError # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+
+import models
+
+E = models.Etiqueta
+ME = models.MascotaEtiqueta
+MV = models.MascotaVacuna
+AE = models.AdoptanteEtiqueta
+AP = models.AdoptantePeso
+
+
+def parse_lista(valor: Optional[str]) -> List[str]:
+    try:
+        lista = json.loads(valor) if valor else []
+    except Exception:
+        return []
+    return lista if isinstance(lista, list) else []
+
+def parse_dict(valor: Optional[str]) -> Dict[str, Any]:
+    try:
+        d = json.loads(valor) if valor else {}
+    except Exception:
+        return {}
+    return d if isinstance(d, dict) else {}
+
+
+class Vocabulario:
+    """
+    nombre -> id de la tabla etiqueta, con caché en el proceso. Un id nunca
+    cambia de nombre, así que lo cacheado no se invalida; solo se cachea lo
+    que ya se leyó de la BD (una inserción que termine en rollback no deja
+    ids fantasma).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids: Dict[str, int] = {}
+
+    def ids(self, db: Session, nombres: Iterable[str]) -> Dict[str, int]:
+        """Ids de estos nombres, creando los que falten (sin commit)."""
+        nombres = {n for n in nombres if isinstance(n, str)}
+        with self._lock:
+            resultado = {n: self._ids[n] for n in nombres if n in self._ids}
+        faltan = nombres - resultado.keys()
+        if faltan:
+            resultado.update(self._leer(db, faltan))
+            for nombre in faltan - resultado.keys():
+                try:
+                    with db.begin_nested():
+                        db.add(E(nombre=nombre))
+                except IntegrityError:
+                    pass   # otra petición la creó a la vez
+            resultado.update(self._leer(db, faltan - resultado.keys()))
+        return resultado
+
+    def conocidos(self, db: Session, nombres: Iterable[str]) -> Dict[str, int]:
+        """Ids de los nombres que ya existen, sin crear nada (para búsquedas)."""
+        nombres = {n for n in nombres if isinstance(n, str)}
+        with self._lock:
+            resultado = {n: self._ids[n] for n in nombres if n in self._ids}
+        resultado.update(self._leer(db, nombres - resultado.keys()))
+        return resultado
+
+    def _leer(self, db: Session, nombres) -> Dict[str, int]:
+        if not nombres:
+            return {}
+        encontrados = dict(db.query(E.nombre, E.id).filter(E.nombre.in_(nombres)))
+        with self._lock:
+            self._ids.update(encontrados)
+        return encontrados
+
+
+vocabulario = Vocabulario()
+
+
+# ---------- búsqueda ----------
+
+def con_todas(db: Session, query, etiquetas: Iterable[str] = (), vacunas: Iterable[str] = ()):
+    """
+    Filtra query (sobre models.Mascota) a las mascotas que tienen TODAS estas
+    etiquetas y vacunas. Cada una es un `id IN (SELECT mascota_id ... WHERE
+    etiqueta_id = ?)` que la BD resuelve con los índices (etiqueta_id,
+    mascota_id) de las tablas puente; un nombre que no existe no puede estar.
+    """
+    M = models.Mascota
+    for tabla, nombres in ((ME, etiquetas), (MV, vacunas)):
+        nombres = _sin_repetir(nombres)
+        if not nombres:
+            continue
+        ids = vocabulario.conocidos(db, nombres)
+        if len(ids) < len(nombres):
+            return query.filter(false())
+        for etiqueta_id in ids.values():
+            query = query.filter(M.id.in_(select(tabla.mascota_id).where(tabla.etiqueta_id == etiqueta_id)))
+    return query
+
+
+# ---------- escritura (sin commit: la hace quien llama) ----------
+
+def _sin_repetir(valores) -> List[str]:
+    return list(dict.fromkeys(v for v in (valores or []) if isinstance(v, str)))
+
+def guardar_mascota(
+    db: Session,
+    mascota_id: int,
+    etiquetas: Optional[List[str]] = None,
+    vacunas: Optional[List[str]] = None,
+):
+    """Reemplaza las etiquetas y/o vacunas de la mascota (None = no tocar)."""
+    for tabla, valores in ((ME, etiquetas), (MV, vacunas)):
+        if valores is None:
+            continue
+        valores = _sin_repetir(valores)
+        ids = vocabulario.ids(db, valores)
+        db.query(tabla).filter(tabla.mascota_id == mascota_id).delete(synchronize_session=False)
+        db.add_all(
+            tabla(mascota_id=mascota_id, etiqueta_id=ids[v], posicion=i)
+            for i, v in enumerate(valores)
+        )
+
+def guardar_mascotas_nuevas(db: Session, filas: Iterable[Tuple[int, List[str], List[str]]]):
+    """
+    (mascota_id, etiquetas, vacunas) de mascotas recién creadas, que todavía
+    no tienen filas: un INSERT de varias filas por tabla en vez de uno por
+    etiqueta.
+    """
+    filas = [(mascota_id, _sin_repetir(e), _sin_repetir(v)) for mascota_id, e, v in filas]
+    ids = vocabulario.ids(db, (n for _, e, v in filas for n in e + v))
+    for tabla, k in ((ME, 1), (MV, 2)):
+        valores = [
+            {"mascota_id": f[0], "etiqueta_id": ids[n], "posicion": i}
+            for f in filas for i, n in enumerate(f[k])
+        ]
+        if valores:
+            db.execute(insert(tabla), valores)
+
+def guardar_adoptante(
+    db: Session,
+    adoptante_id: int,
+    etiquetas: Optional[Dict[str, Any]] = None,
+    pesos: Optional[Dict[str, Any]] = None,
+):
+    """Reemplaza las etiquetas y/o pesos del adoptante (None = no tocar)."""
+    if etiquetas is not None:
+        filas: List[Tuple[str, str, bool]] = []
+        for categoria, valor in etiquetas.items():
+            if isinstance(valor, str):
+                filas.append((categoria, valor, False))
+            elif isinstance(valor, list):
+                filas.extend((categoria, v, True) for v in valor if isinstance(v, str))
+        ids = vocabulario.ids(db, (v for _, v, _ in filas))
+        db.query(AE).filter(AE.adoptante_id == adoptante_id).delete(synchronize_session=False)
+        db.add_all(
+            AE(adoptante_id=adoptante_id, posicion=i, categoria=str(c), etiqueta_id=ids[v], en_lista=en_lista)
+            for i, (c, v, en_lista) in enumerate(filas)
+        )
+    if pesos is not None:
+        validos = {}
+        for nombre, peso in pesos.items():
+            try:
+                validos[nombre] = float(peso)
+            except (TypeError, ValueError):
+                continue
+        ids = vocabulario.ids(db, validos)
+        db.query(AP).filter(AP.adoptante_id == adoptante_id).delete(synchronize_session=False)
+        db.add_all(AP(adoptante_id=adoptante_id, etiqueta_id=ids[n], peso=p) for n, p in validos.items())
+
+
+# ---------- lectura ----------
+
+def de_mascotas(db: Session, mascota_ids=None, vacunas: bool = True, etiquetas: bool = True) -> Dict[int, Dict[str, List[str]]]:
+    """
+    {mascota_id: {"etiquetas": [...], "vacunas": [...]}} en el orden original.
+    `mascota_ids` puede ser una lista o una subconsulta de ids; None = todas.
+    Las mascotas sin filas no aparecen (usar .get(id, VACIO)). Con
+    etiquetas/vacunas=False esa tabla no se consulta y la lista queda vacía.
+    """
+    resultado: Dict[int, Dict[str, List[str]]] = defaultdict(lambda: {"etiquetas": [], "vacunas": []})
+    tablas = ([(ME, "etiquetas")] if etiquetas else []) + ([(MV, "vacunas")] if vacunas else [])
+    for tabla, campo in tablas:
+        query = db.query(tabla.mascota_id, E.nombre).join(E, E.id == tabla.etiqueta_id)
+        if mascota_ids is not None:
+            query = query.filter(tabla.mascota_id.in_(mascota_ids))
+        for mascota_id, nombre in query.order_by(tabla.mascota_id, tabla.posicion):
+            resultado[mascota_id][campo].append(nombre)
+    return dict(resultado)
+
+VACIO: Dict[str, List[str]] = {"etiquetas": [], "vacunas": []}
+
+def de_adoptantes(db: Session, adoptante_ids=None) -> Dict[int, Tuple[Dict[str, Any], Dict[str, float]]]:
+    """{adoptante_id: (etiquetas, pesos)} con la misma forma que las columnas JSON; None = todos."""
+    etiquetas: Dict[int, Dict[str, Any]] = defaultdict(dict)
+    pesos: Dict[int, Dict[str, float]] = defaultdict(dict)
+
+    query = db.query(AE.adoptante_id, AE.categoria, AE.en_lista, E.nombre).join(E, E.id == AE.etiqueta_id)
+    if adoptante_ids is not None:
+        query = query.filter(AE.adoptante_id.in_(adoptante_ids))
+    for adoptante_id, categoria, en_lista, nombre in query.order_by(AE.adoptante_id, AE.posicion):
+        if en_lista:
+            etiquetas[adoptante_id].setdefault(categoria, []).append(nombre)
+        else:
+            etiquetas[adoptante_id][categoria] = nombre
+
+    query = db.query(AP.adoptante_id, E.nombre, AP.peso).join(E, E.id == AP.etiqueta_id)
+    if adoptante_ids is not None:
+        query = query.filter(AP.adoptante_id.in_(adoptante_ids))
+    for adoptante_id, nombre, peso in query:
+        pesos[adoptante_id][nombre] = peso
+
+    return {a: (etiquetas.get(a, {}), pesos.get(a, {})) for a in set(etiquetas) | set(pesos)}
+
+def de_adoptante(db: Session, adoptante_id: int) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    return de_adoptantes(db, [adoptante_id]).get(adoptante_id, ({}, {}))
+
+
+# ---------- migración desde las columnas JSON ----------
+
+# JSON que no tiene nada que migrar (NULL ya queda fuera del NOT IN)
+VACIOS_JSON = ("", "[]", "{}", "null")
+MIGRACION = "etiquetas_normalizadas"
+
+def migrar(db: Session, lote: int = 1000) -> Tuple[int, int]:
+    """
+    Copia a las tablas las etiquetas de mascotas/adoptantes que todavía no
+    tienen ninguna fila normalizada pero sí algo en sus columnas JSON. Se
+    llama en cada arranque pero recorre las tablas una sola vez: al terminar
+    deja la fila MIGRACION en models.Migracion y de ahí en más solo la lee.
+    Va por lotes con commit; si se corta, el siguiente arranque sigue (las
+    ya copiadas no vuelven a entrar).
+    """
+    if db.get(models.Migracion, MIGRACION) is not None:
+        return 0, 0
+    M, A = models.Mascota, models.Adoptante
+    n_mascotas = n_adoptantes = 0
+
+    pendientes = (
+        db.query(M.id, M.etiquetas, M.vacunas)
+          .filter(or_(M.etiquetas.notin_(VACIOS_JSON), M.vacunas.notin_(VACIOS_JSON)))
+          .filter(~exists().where(ME.mascota_id == M.id))
+          .filter(~exists().where(MV.mascota_id == M.id))
+    )
+    ultimo = 0
+    while True:
+        filas = pendientes.filter(M.id > ultimo).order_by(M.id).limit(lote).all()
+        if not filas:
+            break
+        for m in filas:
+            guardar_mascota(db, m.id, parse_lista(m.etiquetas), parse_lista(m.vacunas))
+        db.commit()
+        n_mascotas += len(filas)
+        ultimo = filas[-1].id
+
+    pendientes = (
+        db.query(A.id, A.etiquetas, A.pesos)
+          .filter(or_(A.etiquetas.notin_(VACIOS_JSON), A.pesos.notin_(VACIOS_JSON)))
+          .filter(~exists().where(AE.adoptante_id == A.id))
+          .filter(~exists().where(AP.adoptante_id == A.id))
+    )
+    ultimo = 0
+    while True:
+        filas = pendientes.filter(A.id > ultimo).order_by(A.id).limit(lote).all()
+        if not filas:
+            break
+        for a in filas:
+            guardar_adoptante(db, a.id, parse_dict(a.etiquetas), parse_dict(a.pesos))
+        db.commit()
+        n_adoptantes += len(filas)
+        ultimo = filas[-1].id
+
+    try:
+        with db.begin_nested():
+            db.add(models.Migracion(nombre=MIGRACION))
+    except IntegrityError:
+        pass   # otro worker terminó a la vez
+    db.commit()
+    return n_mascotas, n_adoptantes
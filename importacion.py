@@ -0,0 +1,266 @@
+"""
+Importación masiva de mascotas para dar de alta un albergue (POST /mascotas/importar).
+
+Acepta NDJSON (un objeto por línea), CSV con encabezado, o un zip con uno de
+esos archivos más las fotos. Cada fila se valida con schemas.MascotaCreate a
+medida que se lee. Las válidas se juntan en lotes de LOTE e entran con
+crud.create_mascotas (un INSERT de varias filas por tabla). Todo va en una
+sola transacción, con un commit al final. Las filas con errores se reportan
+con su número y no frenan al resto, salvo con todo_o_nada.
+
+En CSV, etiquetas/vacunas van separadas por "|" (o como lista JSON) y una
+celda vacía es None. Dentro de un zip, la columna `imagen` nombra la foto
+dentro del archivo: se guarda en imagenes/ como cualquier subida
+(archivos.guardar_archivo) y reemplaza a imagen_id.
+"""
+import csv
+import io
+import json
+import os
+import zipfile
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+
+import archivos
+import busqueda
+import catalogo
+import crud
+import etiquetado
+import models
+import recomendaciones
+import schemas
+import serializacion
+import variantes
+
+LOTE = int(os.getenv("IMPORTACION_LOTE", "500"))   # filas por INSERT
+MAX_BYTES = int(os.getenv("IMPORTACION_MAX_BYTES", str(200 * 1024 * 1024)))   # cuerpo completo (archivos.LimiteCuerpo)
+MAX_ERRORES = 100   # los que se devuelven; total_errores los cuenta todos
+
+EXTENSIONES = {".ndjson": "ndjson", ".jsonl": "ndjson", ".json": "ndjson", ".csv": "csv", ".zip": "zip"}
+CAMPOS_LISTA = ("etiquetas", "vacunas")
+
+# (número de fila, datos, error): datos es None si la fila ni siquiera se pudo leer
+Fila = Tuple[int, Optional[Dict[str, Any]], Optional[str]]
+
+
+def detectar_formato(nombre: Optional[str], content_type: Optional[str], pedido: Optional[str] = None) -> str:
+    """ndjson, csv o zip: el pedido, si no la extensión, si no el content-type. ValueError si no se reconoce."""
+    if pedido:
+        if pedido not in ("ndjson", "csv", "zip"):
+            raise ValueError(f"Formato desconocido: {pedido} (ndjson, csv o zip)")
+        return pedido
+    extension = os.path.splitext(nombre or "")[1].lower()
+    if extension in EXTENSIONES:
+        return EXTENSIONES[extension]
+    for parte, formato in (("zip", "zip"), ("csv", "csv")):
+        if parte in (content_type or ""):
+            return formato
+    return "ndjson"
+
+
+# ---------- lectura ----------
+
+def filas_ndjson(texto: io.TextIOBase) -> Iterator[Fila]:
+    for numero, linea in enumerate(texto, 1):
+        if not linea.strip():
+            continue
+        try:
+            datos = json.loads(linea)
+        except ValueError as e:
+            yield numero, None, f"JSON inválido: {e}"
+            continue
+        if not isinstance(datos, dict):
+            yield numero, None, "La fila no es un objeto JSON"
+            continue
+        yield numero, datos, None
+
+def lista_csv(valor: str) -> Any:
+    valor = valor.strip()
+    if valor.startswith("["):
+        return json.loads(valor)
+    return [v.strip() for v in valor.split("|") if v.strip()]
+
+def filas_csv(texto: io.TextIOBase) -> Iterator[Fila]:
+    for numero, fila in enumerate(csv.DictReader(texto), 1):
+        if None in fila:
+            yield numero, None, "La fila tiene más columnas que el encabezado"
+            continue
+        datos = {}
+        try:
+            for campo, valor in fila.items():
+                campo = campo.strip()
+                if valor is None or not valor.strip():
+                    datos[campo] = [] if campo in CAMPOS_LISTA else None
+                elif campo in CAMPOS_LISTA:
+                    datos[campo] = lista_csv(valor)
+                else:
+                    datos[campo] = valor.strip()
+        except ValueError as e:
+            yield numero, None, f"{campo}: lista JSON inválida: {e}"
+            continue
+        yield numero, datos, None
+
+
+# ---------- importación ----------
+
+class Importacion:
+    """Valida fila por fila y guarda por lotes, sin commit."""
+
+    def __init__(self, db: Session, albergue_id: int, directorio: str, archivo_zip: Optional[zipfile.ZipFile] = None):
+        self.db = db
+        self.albergue_id = albergue_id
+        self.directorio = directorio
+        self.zip = archivo_zip
+        self.filas = 0
+        self.ids: List[int] = []
+        self.errores: List[Dict[str, Any]] = []
+        self.total_errores = 0
+        self._pendientes: List[Tuple[int, schemas.MascotaCreate]] = []
+        self._imagenes: Dict[str, int] = {}   # nombre en el zip -> Imagen.id
+        self.rutas_nuevas: Dict[int, str] = {}   # Imagen.id -> ruta, para archivos.imagenes tras el commit
+
+    def error(self, numero: int, mensaje: str):
+        self.total_errores += 1
+        if len(self.errores) < MAX_ERRORES:
+            self.errores.append({"fila": numero, "error": mensaje})
+
+    def agregar(self, numero: int, datos: Optional[Dict[str, Any]], error: Optional[str] = None):
+        self.filas += 1
+        if error is not None:
+            self.error(numero, error)
+            return
+        foto = datos.pop("imagen", None)
+        if foto:
+            if self.zip is None:
+                self.error(numero, "imagen: solo se puede usar dentro de un zip; si no, imagen_id")
+                return
+            datos["imagen_id"] = 0   # se completa después de validar
+        try:
+            mascota = schemas.MascotaCreate.model_validate(datos)
+        except ValidationError as e:
+            self.error(numero, "; ".join(f"{'.'.join(map(str, d['loc']))}: {d['msg']}" for d in e.errors()))
+            return
+        if foto:
+            try:
+                mascota.imagen_id = self.imagen(foto)
+            except KeyError:
+                self.error(numero, f"imagen: «{foto}» no está en el zip")
+                return
+            except archivos.ArchivoDemasiadoGrande as e:
+                self.error(numero, f"imagen: {e}")
+                return
+        self._pendientes.append((numero, mascota))
+        if len(self._pendientes) >= LOTE:
+            self.vaciar()
+
+    def imagen(self, nombre: str) -> int:
+        """
+        Guarda una foto del zip (una vez por nombre) y devuelve su Imagen.id.
+        KeyError si no está; ArchivoDemasiadoGrande si pasa IMAGENES_MAX_BYTES.
+        """
+        if nombre in self._imagenes:
+            return self._imagenes[nombre]
+        with self.zip.open(self.zip.getinfo(nombre)) as origen:
+            ruta = archivos.guardar_archivo(origen, nombre, self.directorio)
+        variantes.generador.encolar(ruta)
+        imagen = models.Imagen(ruta=ruta)
+        self.db.add(imagen)
+        self.db.flush()
+        self._imagenes[nombre] = imagen.id
+        self.rutas_nuevas[imagen.id] = ruta
+        return imagen.id
+
+    def vaciar(self):
+        """Inserta el lote pendiente; las filas con un imagen_id que no existe quedan como error."""
+        if not self._pendientes:
+            return
+        pedidas = {m.imagen_id for _, m in self._pendientes}
+        existentes = {i for (i,) in self.db.query(models.Imagen.id).filter(models.Imagen.id.in_(pedidas))}
+        validas = []
+        for numero, mascota in self._pendientes:
+            if mascota.imagen_id in existentes:
+                validas.append(mascota)
+            else:
+                self.error(numero, "imagen_id: Imagen no encontrada")
+        self._pendientes = []
+        self.ids.extend(crud.create_mascotas(self.db, validas, self.albergue_id))
+
+    def deshacer(self):
+        # Las fotos ya guardadas quedan: otro blob igual puede estar en uso y una subida futura las reusa
+        self.db.rollback()
+        self.ids = []
+
+    def reporte(self) -> Dict[str, Any]:
+        return {
+            "filas": self.filas,
+            "creadas": len(self.ids),
+            "ids": self.ids,
+            "total_errores": self.total_errores,
+            "errores": sorted(self.errores, key=lambda e: e["fila"]),
+        }
+
+
+def importar(
+    db: Session,
+    archivo: BinaryIO,
+    albergue_id: int,
+    directorio: str,
+    formato: str = "ndjson",
+    todo_o_nada: bool = False,
+) -> Dict[str, Any]:
+    """
+    Importa `archivo` y hace commit. Con todo_o_nada, si alguna fila falla no
+    se guarda nada (reporte con creadas = 0). ValueError si el archivo en sí
+    no se puede leer.
+    """
+    archivo_zip = None
+    if formato == "zip":
+        try:
+            archivo_zip = zipfile.ZipFile(archivo)
+        except zipfile.BadZipFile:
+            raise ValueError("El zip no es válido")
+        datos = next(
+            (n for n in archivo_zip.namelist()
+             if EXTENSIONES.get(os.path.splitext(n)[1].lower()) in ("ndjson", "csv") and not n.startswith("__MACOSX/")),
+            None,
+        )
+        if datos is None:
+            raise ValueError("El zip no tiene un archivo .ndjson, .jsonl, .json o .csv con las mascotas")
+        formato = EXTENSIONES[os.path.splitext(datos)[1].lower()]
+        archivo = archivo_zip.open(datos)
+
+    texto = io.TextIOWrapper(archivo, encoding="utf-8-sig", newline="")
+    importacion = Importacion(db, albergue_id, directorio, archivo_zip)
+    try:
+        for numero, datos, error in (filas_csv(texto) if formato == "csv" else filas_ndjson(texto)):
+            importacion.agregar(numero, datos, error)
+        importacion.vaciar()
+        if todo_o_nada and importacion.total_errores:
+            importacion.deshacer()
+        else:
+            # Al final: la fila global de la versión queda bloqueada solo para el commit,
+            # no durante toda la importación (frenaría las altas y ediciones de todos)
+            if importacion.ids:
+                catalogo.cambio_lote(db, importacion.ids)
+            db.commit()
+            for imagen_id, ruta in importacion.rutas_nuevas.items():
+                archivos.imagenes.agregar(imagen_id, ruta)
+    except (UnicodeDecodeError, csv.Error) as e:
+        importacion.deshacer()
+        raise ValueError(f"No se pudo leer el archivo: {e}")
+    except Exception:
+        importacion.deshacer()
+        raise
+    return importacion.reporte()
+
+def indexar(db: Session, mascota_ids: List[int]):
+    """Después del commit: agrega las mascotas importadas a los índices en memoria, por lotes."""
+    M = models.Mascota
+    for inicio in range(0, len(mascota_ids), LOTE):
+        lote = mascota_ids[inicio:inicio + LOTE]
+        tags = etiquetado.de_mascotas(db, lote, vacunas=False)
+        for fila in db.query(*serializacion.COLUMNAS_MASCOTA).filter(M.id.in_(lote)):
+            recomendaciones.indice.agregar(fila, tags.get(fila.id, etiquetado.VACIO)["etiquetas"])
+            busqueda.indice.actualizar(fila)
@@ -1,16 +1,17 @@
-import shutil, os, json
+import os, json, asyncio
 import numpy as np # type: ignore
-from typing import List, Dict, Any, Tuple
+from typing import List, Optional, Literal
 from datetime import datetime
-import models, schemas, crud, auth
+from urllib.parse import urlencode
+import models, schemas, crud, auth, recomendaciones, precalculo, ubicacion, etiquetado, motores, paralelo, serializacion, catalogo, busqueda, entidades, importacion, archivos, variantes, mensajeria
 from sqlalchemy.orm import Session # type: ignore
+from sqlalchemy.schema import CreateIndex # type: ignore
 from database import SessionLocal, engine
-from fastapi.responses import FileResponse # type: ignore
+from fastapi.responses import StreamingResponse # type: ignore
+from starlette.concurrency import run_in_threadpool # type: ignore
 from fastapi.security import OAuth2PasswordBearer # type: ignore
 from fastapi.middleware.cors import CORSMiddleware # type: ignore
-from sklearn.preprocessing import MultiLabelBinarizer # type: ignore
-from sklearn.metrics.pairwise import cosine_similarity # type: ignore
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, APIRouter, WebSocket, Body # type: ignore
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, APIRouter, WebSocket, Body, Response, Header, Query # type: ignore
 from models import Adoptante, Albergue, Mascota, Imagen
 from sqlalchemy.orm import Session
 from schemas import MessageIn, MessageOut, MascotaResponse, AdoptanteUpdate, MatchTotalSimpleOut, MatchTotalCreate
@@ -21,6 +22,12 @@ from models import Denegacion, MatchTotal
 
 router = APIRouter()
 models.Base.metadata.create_all(bind=engine)
+# create_all no agrega índices nuevos a tablas que ya existían (IF NOT EXISTS y no
+# checkfirst: la reflexión no ve los índices de expresiones como el de edad)
+with engine.begin() as conexion:
+    for tabla in (models.Adopcion.__table__, models.Denegacion.__table__, models.Mascota.__table__, models.MascotaVacuna.__table__):
+        for indice_bd in tabla.indexes:
+            conexion.execute(CreateIndex(indice_bd, if_not_exists=True))
 
 app = FastAPI()
 #origins = [
@@ -30,6 +37,14 @@ origins = [
     "*"
 ]
 
+# Antes que CORS, para que los 413 también lleven sus cabeceras
+app.add_middleware(archivos.LimiteCuerpo, limites={
+    "/imagenes": archivos.MAX_BYTES + archivos.MARGEN_MULTIPART,
+    "/imagenesProfile": archivos.MAX_BYTES + archivos.MARGEN_MULTIPART,
+    "/imagenes/lote": archivos.MAX_LOTE * (archivos.MAX_BYTES + archivos.MARGEN_MULTIPART),
+    "/imagenesProfile/lote": archivos.MAX_LOTE * (archivos.MAX_BYTES + archivos.MARGEN_MULTIPART),
+    "/mascotas/importar": importacion.MAX_BYTES,
+})
 
 app.add_middleware(
     CORSMiddleware,
@@ -37,6 +52,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],          
     allow_headers=["*"],          
+    expose_headers=["X-Siguiente-Cursor", "X-Siguiente-Pagina", "ETag"],
 )
 
 def get_db():
@@ -56,6 +72,26 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
     return payload
 
 
+@app.on_event("startup")
+def construir_indice_recomendaciones():
+    # Índice de etiquetas para /recomendaciones (se parchea en crear/editar/adoptar)
+    # y, si RECOMENDACIONES_REFRESCO_SEGUNDOS > 0, el refresco de la tabla precalculada
+    db = SessionLocal()
+    try:
+        # Etiquetas que solo estaban en las columnas JSON -> tablas normalizadas
+        n_mascotas, n_adoptantes = etiquetado.migrar(db)
+        if n_mascotas or n_adoptantes:
+            print(f"✅ Etiquetas migradas: {n_mascotas} mascotas, {n_adoptantes} adoptantes")
+        catalogo.asegurar(db)
+        recomendaciones.indice.construir(db)
+        ubicacion.indice_albergues.construir(db)
+        busqueda.preparar(db)
+        archivos.imagenes.cargar(db)
+        archivos.perfiles.cargar(db)
+    finally:
+        db.close()
+    precalculo.iniciar_refresco()
+
 
 # ------------------------------------------------
 # Sección: Root
@@ -126,25 +162,17 @@ def login_adoptante(user: schemas.AdoptanteLogin, db: Session = Depends(get_db))
 
 @app.get("/adoptante/me", response_model=schemas.AdoptanteOut, summary="Obtener datos del adoptante autenticado", tags=["Adoptante"])
 def get_adoptante_me(user=Depends(get_current_user), db: Session = Depends(get_db)):
-    adoptante_id = int(user["sub"])
-    adoptante_obj = db.query(models.Adoptante).filter(models.Adoptante.id == adoptante_id).first()
-    if not adoptante_obj:
+    adoptante = entidades.adoptante(db, int(user["sub"]))
+    if not adoptante:
         raise HTTPException(status_code=404, detail="Adoptante no encontrado")
-    return schemas.AdoptanteOut.from_orm_with_etiquetas(adoptante_obj)
+    return adoptante
 
 @app.get("/adoptante/{adoptante_id}", response_model=schemas.AdoptanteOut, summary="Obtener adoptante por ID", tags=["Adoptante"])
 def get_adoptante_by_id(adoptante_id: int, db: Session = Depends(get_db)):
-    adoptante = (
-        db.query(models.Adoptante)
-        .options(joinedload(models.Adoptante.imagen_perfil))  # Asegura que imagen_perfil esté cargado
-        .filter(models.Adoptante.id == adoptante_id)
-        .first()
-    )
-    
+    adoptante = entidades.adoptante(db, adoptante_id)
     if not adoptante:
         raise HTTPException(status_code=404, detail="Adoptante no encontrado")
-    
-    return schemas.AdoptanteOut.from_orm_with_etiquetas(adoptante)
+    return adoptante
 
 @app.put(
     "/adoptante/{adoptante_id}",
@@ -185,9 +213,10 @@ def update_adoptante(
     # 5) Guardamos los cambios
     db.commit()
     db.refresh(adoptante)
+    entidades.adoptante_cambio(adoptante_id)
 
     # 6) Devolvemos el adoptante actualizado (incluyendo etiquetas/pesos si los tienes)
-    return schemas.AdoptanteOut.from_orm_with_etiquetas(adoptante)
+    return schemas.AdoptanteOut.from_orm_with_etiquetas(adoptante, *etiquetado.de_adoptante(db, adoptante_id))
 
 @app.patch(
     "/adoptante/{adoptante_id}",
@@ -208,15 +237,19 @@ def patch_etiquetas_pesos(
     if not adoptante:
         raise HTTPException(404, "Adoptante no encontrado")
 
-    # sólo aplicamos los dos campos que interesan
-    if "etiquetas" in data:
-        adoptante.etiquetas = json.dumps(data["etiquetas"])
-    if "pesos" in data:
-        adoptante.pesos = json.dumps(data["pesos"])
+    # sólo aplicamos los dos campos que interesan (tablas de etiquetado)
+    etiquetado.guardar_adoptante(
+        db, adoptante_id,
+        (data["etiquetas"] or {}) if "etiquetas" in data else None,
+        (data["pesos"] or {}) if "pesos" in data else None,
+    )
+    precalculo.invalidar(db, adoptante_id)
 
     db.commit()
     db.refresh(adoptante)
-    return schemas.AdoptanteOut.from_orm_with_etiquetas(adoptante)
+    recomendaciones.cache.perfil_cambiado(adoptante_id)
+    entidades.adoptante_cambio(adoptante_id)
+    return schemas.AdoptanteOut.from_orm_with_etiquetas(adoptante, *etiquetado.de_adoptante(db, adoptante_id))
 
 # ------------------------------------------------
 # Sección: Albergue
@@ -228,6 +261,7 @@ def register_albergue(user: schemas.AlbergueCreate, db: Session = Depends(get_db
         raise HTTPException(status_code=400, detail="El correo ya está registrado")
 
     new_albergue = crud.create_albergue(db, user)
+    ubicacion.indice_albergues.actualizar(new_albergue)
     return {"mensaje": "Albergue registrado con éxito", "id": new_albergue.id}
 
 @app.post("/login/albergue", tags=["Albergue"])
@@ -260,58 +294,41 @@ def get_albergue_me(user=Depends(get_current_user), db: Session = Depends(get_db
 # Sección: Mascotas
 # ------------------------------------------------
 
+def listado_mascotas(db: Session, filtros: schemas.FiltrosMascotas, if_none_match: Optional[str], *condiciones, etiquetas=(), vacunas=()):
+    """Cuerpo común de los listados: ETag/304, filtros, páginas (crud.listar_mascotas), ?fields= y serialización rápida."""
+    # Versión antes que las filas: si no cambió nada, 304 sin tocar mascotas
+    etag = catalogo.etag_catalogo(catalogo.version(db))
+    if catalogo.coincide(if_none_match, etag):
+        return catalogo.no_modificado(etag)
+    try:
+        # ?fields=: el SELECT y las consultas de etiquetas llevan solo lo pedido
+        campos = serializacion.elegir(serializacion.CAMPOS_MASCOTA, filtros.fields)
+        columnas = serializacion.columnas_mascota(campos, extra=("created_at",) if filtros.orden == "recientes" else ())
+        consulta = etiquetado.con_todas(db, db.query(*columnas).filter(*condiciones), etiquetas, vacunas)
+        con_etiquetas, con_vacunas = serializacion.con_etiquetas(campos)
+        filas, tags, siguiente = crud.listar_mascotas(db, consulta, filtros, etiquetas=con_etiquetas, vacunas=con_vacunas)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Tuplas Core -> dicts -> JSON directo, sin MascotaResponse por fila (ver serializacion.py)
+    cabeceras = catalogo.cabeceras(etag)
+    if siguiente:
+        cabeceras["X-Siguiente-Pagina"] = urlencode(siguiente)
+    return serializacion.RespuestaJSON(serializacion.mascotas(filas, tags, campos), headers=cabeceras)
+
 @app.get("/mascotas/albergue/{albergue_id}", response_model=list[schemas.MascotaResponse], tags=["Mascotas"])
 def obtener_mascotas_por_albergue(
     albergue_id: int,
+    filtros: schemas.FiltrosMascotas = Depends(),
     db: Session = Depends(get_db),
     user = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
 ):
+    """Mascotas del albergue, con los mismos filtros y páginas que GET /mascotas."""
     # Solo el albergue dueño puede ver su lista
     if user["rol"] != "albergue" or int(user["sub"]) != albergue_id:
         raise HTTPException(status_code=403, detail="Acceso denegado.")
 
-    db_mascotas = (
-        db.query(models.Mascota)
-        .filter(models.Mascota.albergue_id == albergue_id)
-        .all()
-    )
-
-    resultado = []
-    for m in db_mascotas:
-        lista_etqs = []
-        if m.etiquetas:
-            try:
-                lista_etqs = json.loads(m.etiquetas)
-            except Exception:
-                lista_etqs = []
-
-        lista_vacunas = []
-        if m.vacunas:
-            try:
-                lista_vacunas = json.loads(m.vacunas)
-            except Exception:
-                lista_vacunas = []
-
-        created_at_str = m.created_at.isoformat() if isinstance(m.created_at, datetime) else str(m.created_at)
-
-        resultado.append(
-            schemas.MascotaResponse(
-                id=m.id,
-                nombre=m.nombre,
-                edad_valor=m.edad_valor,
-                edad_unidad=m.edad_unidad,
-                especie=m.especie,
-                genero=m.genero,
-                descripcion=m.descripcion,
-                albergue_id=m.albergue_id,
-                imagen_id=m.imagen_id,
-                etiquetas=lista_etqs,
-                vacunas=lista_vacunas,
-                estado= m.estado,
-                created_at=created_at_str,
-            )
-        )
-    return resultado
+    return listado_mascotas(db, filtros, if_none_match, models.Mascota.albergue_id == albergue_id)
 
 @app.post("/mascotas", response_model=schemas.MascotaResponse, tags=["Mascotas"])
 def crear_mascota(
@@ -328,20 +345,12 @@ def crear_mascota(
         raise HTTPException(status_code=404, detail="Imagen no encontrada")
 
     nueva = crud.create_mascota(db, mascota, albergue_id)
-
-    lista_etqs = []
-    if nueva.etiquetas:
-        try:
-            lista_etqs = json.loads(nueva.etiquetas)
-        except Exception:
-            lista_etqs = []
-
-    lista_vacunas = []
-    if nueva.vacunas:
-        try:
-            lista_vacunas = json.loads(nueva.vacunas)
-        except Exception:
-            lista_vacunas = []
+    catalogo.cambio(db, nueva.id)
+    db.commit()
+    db.refresh(nueva)
+    guardadas = etiquetado.de_mascotas(db, [nueva.id]).get(nueva.id, etiquetado.VACIO)
+    recomendaciones.indice.agregar(nueva, guardadas["etiquetas"])
+    busqueda.indice.actualizar(nueva)
 
     return schemas.MascotaResponse(
         id=nueva.id,
@@ -353,12 +362,46 @@ def crear_mascota(
         descripcion=nueva.descripcion,
         albergue_id=nueva.albergue_id,
         imagen_id=nueva.imagen_id,
-        etiquetas=lista_etqs,
-        vacunas=lista_vacunas,
+        etiquetas=guardadas["etiquetas"],
+        vacunas=guardadas["vacunas"],
         estado= nueva.estado,
         created_at=nueva.created_at.isoformat(),
     )
 
+@app.post("/mascotas/importar", tags=["Mascotas"])
+def importar_mascotas(
+    archivo: UploadFile = File(...),
+    formato: Optional[str] = Query(None, description="ndjson, csv o zip (por defecto según la extensión)"),
+    todo_o_nada: bool = False,
+    db: Session = Depends(get_db),
+    user = Depends(get_current_user)
+):
+    """
+    Alta masiva de mascotas del albergue: NDJSON, CSV o un zip con uno de
+    ellos y las fotos (columna `imagen`). Cada fila se valida como en POST
+    /mascotas; las inválidas se reportan con su número. Con todo_o_nada=true
+    no se guarda nada si alguna falla (422 con el reporte).
+    """
+    if user["rol"] != "albergue":
+        raise HTTPException(status_code=403, detail="Solo los albergues pueden registrar mascotas")
+
+    try:
+        reporte = importacion.importar(
+            db,
+            archivo.file,
+            int(user["albergue_id"]),
+            UPLOAD_DIR,
+            importacion.detectar_formato(archivo.filename, archivo.content_type, formato),
+            todo_o_nada,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if todo_o_nada and reporte["total_errores"]:
+        raise HTTPException(status_code=422, detail=reporte)
+
+    importacion.indexar(db, reporte["ids"])
+    return reporte
+
 @app.put("/mascotas/{mascota_id}", response_model=schemas.MascotaResponse, tags=["Mascotas"])
 def editar_mascota(
     mascota_id: int,
@@ -382,11 +425,17 @@ def editar_mascota(
     db_mascota.edad_unidad = mascota.edad_unidad if mascota.edad_unidad is not None else db_mascota.edad_unidad
     db_mascota.especie = mascota.especie if mascota.especie else db_mascota.especie
     db_mascota.descripcion = mascota.descripcion if mascota.descripcion else db_mascota.descripcion
-    db_mascota.etiquetas = json.dumps(mascota.etiquetas) if mascota.etiquetas else db_mascota.etiquetas
-    db_mascota.vacunas = json.dumps(mascota.vacunas) if mascota.vacunas else db_mascota.vacunas
+    etiquetado.guardar_mascota(
+        db, mascota_id, mascota.etiquetas or None, mascota.vacunas or None
+    )
+    catalogo.cambio(db, mascota_id)
 
     db.commit()
     db.refresh(db_mascota)
+    entidades.mascota_cambio(mascota_id)
+    guardadas = etiquetado.de_mascotas(db, [mascota_id]).get(mascota_id, etiquetado.VACIO)
+    recomendaciones.indice.actualizar(db_mascota, guardadas["etiquetas"])
+    busqueda.indice.actualizar(db_mascota)
 
     return schemas.MascotaResponse(
         id=db_mascota.id,
@@ -399,94 +448,88 @@ def editar_mascota(
         descripcion=db_mascota.descripcion,
         albergue_id=db_mascota.albergue_id,
         imagen_id=db_mascota.imagen_id,
-        etiquetas=json.loads(db_mascota.etiquetas) if db_mascota.etiquetas else [],
-        vacunas=json.loads(db_mascota.vacunas) if db_mascota.vacunas else [],
+        etiquetas=guardadas["etiquetas"],
+        vacunas=guardadas["vacunas"],
         created_at=db_mascota.created_at.isoformat(),
     )
 
 @app.get("/mascotas", response_model=list[schemas.MascotaResponse], summary="Listar todas las mascotas de todos los albergues", tags=["Mascotas"])
-def listar_todas_las_mascotas(db: Session = Depends(get_db)):
+def listar_todas_las_mascotas(
+    filtros: schemas.FiltrosMascotas = Depends(),
+    db: Session = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Mascotas no adoptadas, filtrables por especie, genero, estado, albergue_id y
+    edad en meses. Con `limit` se pagina por keyset (orden `id` o `recientes`):
+    si quedan más, X-Siguiente-Pagina trae los after_id/after_created_at a usar.
+    Lleva ETag de la versión del catálogo; con If-None-Match responde 304.
+    """
+    return listado_mascotas(db, filtros, if_none_match, models.Mascota.estado != "Adoptado")
 
-    db_mascotas = db.query(models.Mascota)\
-                    .filter(models.Mascota.estado != "Adoptado")\
-                    .all()
-    resultado = []
-    for m in db_mascotas:
-        lista_etqs = []
-        if m.etiquetas:
-            try:
-                lista_etqs = json.loads(m.etiquetas)
-            except Exception:
-                lista_etqs = []
+@app.get("/mascotas/buscar", response_model=list[schemas.MascotaResponse], summary="Buscar mascotas por etiquetas y vacunas", tags=["Mascotas"])
+def buscar_mascotas(
+    etiquetas: List[str] = Query([]),
+    vacunas: List[str] = Query([]),
+    filtros: schemas.FiltrosMascotas = Depends(),
+    db: Session = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Mascotas no adoptadas que tienen TODAS las `etiquetas` y `vacunas` pedidas
+    (`?etiquetas=juguetón&etiquetas=pequeño&vacunas=rabia`). Se resuelve en la
+    BD con las tablas de etiquetado; acepta los mismos filtros, páginas y ETag
+    que GET /mascotas.
+    """
+    return listado_mascotas(
+        db, filtros, if_none_match, models.Mascota.estado != "Adoptado", etiquetas=etiquetas, vacunas=vacunas
+    )
 
-        lista_vacunas = []
-        if m.vacunas:
-            try:
-                lista_vacunas = json.loads(m.vacunas)
-            except Exception:
-                lista_vacunas = []
-
-        created_at_str = m.created_at.isoformat() if isinstance(m.created_at, datetime) else str(m.created_at)
-
-        resultado.append(
-            schemas.MascotaResponse(
-                id=m.id,
-                nombre=m.nombre,
-                edad_valor=m.edad_valor,
-                edad_unidad=m.edad_unidad,
-                especie=m.especie,
-                genero=m.genero,
-                descripcion=m.descripcion,
-                albergue_id=m.albergue_id,
-                imagen_id=m.imagen_id,
-                etiquetas=lista_etqs,
-                vacunas=lista_vacunas,
-                estado= m.estado,
-                created_at=created_at_str,
-            )
-        )
-    return resultado
+@app.get("/mascotas/texto", response_model=list[schemas.MascotaResponse], summary="Buscar mascotas por nombre y descripción", tags=["Mascotas"])
+def buscar_mascotas_texto(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=crud.LIMITE_PAGINA_MAX),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Búsqueda de texto en nombre y descripción de las mascotas no adoptadas
+    (ver busqueda.py): cada palabra vale como prefijo y los nombres parecidos
+    también entran. Ordenada por relevancia; si hay más, X-Siguiente-Cursor
+    trae el cursor para `?cursor=`. Lleva ETag de la versión del catálogo.
+    """
+    etag = catalogo.etag_catalogo(catalogo.version(db))
+    if catalogo.coincide(if_none_match, etag):
+        return catalogo.no_modificado(etag)
+    try:
+        despues = recomendaciones.decodificar_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filas, tags, siguiente = busqueda.buscar(db, q, limit, despues)
+    cabeceras = catalogo.cabeceras(etag)
+    if siguiente:
+        cabeceras["X-Siguiente-Cursor"] = recomendaciones.codificar_cursor(*siguiente)
+    return serializacion.RespuestaJSON(serializacion.mascotas(filas, tags), headers=cabeceras)
 
 @app.get("/mascotas/{mascota_id}",response_model=schemas.MascotaResponse,summary="Obtener datos de una mascota por su ID", tags=["Mascotas"])
 def obtener_mascota(
     mascota_id: int,
     db: Session = Depends(get_db),
     user=Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
 ):
     # Opcional: aquí podrías chequear permisos si quieres
-    m = db.query(models.Mascota).filter(models.Mascota.id == mascota_id).first()
-    if not m:
+    version = catalogo.version(db, mascota_id)
+    # Primero si existe (casi siempre de la caché): una mascota desconocida
+    # también tiene versión 0 y no puede contestar 304 a "m{id}-0"
+    datos = entidades.mascota(db, mascota_id, version)
+    if datos is None:
         raise HTTPException(status_code=404, detail="Mascota no encontrada")
-
-    etiquetas = []
-    if m.etiquetas:
-        try:
-            etiquetas = json.loads(m.etiquetas)
-        except:
-            etiquetas = []
-
-    # Convertir created_at a string ISO (si lo usas en frontend)
-    created_at_str = (
-        m.created_at.isoformat()
-        if isinstance(m.created_at, datetime)
-        else str(m.created_at)
-    )
-
-    return schemas.MascotaResponse(
-        id=m.id,
-        nombre=m.nombre,
-        edad_valor=m.edad_valor,
-        edad_unidad=m.edad_unidad,
-        especie=m.especie,
-        descripcion=m.descripcion,
-        albergue_id=m.albergue_id,
-        imagen_id=m.imagen_id,
-        etiquetas=etiquetas,
-        created_at=created_at_str,
-        genero=m.genero,
-        estado= m.estado,
-        vacunas=json.loads(m.vacunas) if m.vacunas else [],
-    )
+    etag = catalogo.etag_mascota(mascota_id, version)
+    if catalogo.coincide(if_none_match, etag):
+        return catalogo.no_modificado(etag)
+    return serializacion.RespuestaJSON(datos, headers=catalogo.cabeceras(etag))
 
 # ------------------------------------------------
 # Sección: Imágenes
@@ -497,159 +540,289 @@ UPLOAD_DIR_PERFILES2 = "imagenes_perfil"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(UPLOAD_DIR_PERFILES2, exist_ok=True)
 
-@app.post("/imagenesProfile", response_model=dict, tags=["Imágenes"])
-def subir_imagen_profile(image: UploadFile = File(...), db: Session = Depends(get_db)):
-    file_path = os.path.join(UPLOAD_DIR_PERFILES2, image.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(image.file, buffer)
+async def guardar_imagen(image: UploadFile, directorio: str) -> str:
+    """Blob direccionado por contenido (archivos.py); 413 si pasa IMAGENES_MAX_BYTES."""
+    try:
+        return await archivos.guardar_subida(image, directorio)
+    except archivos.ArchivoDemasiadoGrande as e:
+        raise HTTPException(status_code=413, detail=str(e))
 
-    nueva_imagen = models.ImagenPerfil(ruta=file_path)
+def registrar_imagen(db: Session, rutas: archivos.RutasImagenes, ruta: str) -> dict:
+    nueva_imagen = rutas.modelo(ruta=ruta)
     db.add(nueva_imagen)
     db.commit()
     db.refresh(nueva_imagen)
+    rutas.agregar(nueva_imagen.id, ruta)
+    variantes.generador.encolar(ruta)   # thumb/medium/full en segundo plano
     return {"id": nueva_imagen.id, "ruta": nueva_imagen.ruta}
 
-@app.get("/imagenesProfile/{imagen_id}", tags=["Imágenes"])
-def obtener_imagen(imagen_id: int, db: Session = Depends(get_db)):
-    imagen = db.query(models.ImagenPerfil).filter(models.ImagenPerfil.id == imagen_id).first()
-    if not imagen:
-        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+async def guardar_imagenes(images: List[UploadFile], directorio: str) -> List[str]:
+    """
+    Todas a la vez, en el orden recibido. Se espera a que terminen todas
+    aunque una falle, para no seguir leyendo subidas ya cerradas.
+    """
+    if not images:
+        raise HTTPException(status_code=400, detail="No se recibió ninguna imagen")
+    if len(images) > archivos.MAX_LOTE:
+        raise HTTPException(status_code=400, detail=f"Se pueden subir hasta {archivos.MAX_LOTE} imágenes por lote")
+    resultados = await asyncio.gather(*(guardar_imagen(i, directorio) for i in images), return_exceptions=True)
+    for resultado in resultados:
+        if isinstance(resultado, BaseException):
+            raise resultado
+    return resultados
+
+def registrar_imagenes(db: Session, rutas: archivos.RutasImagenes, lista: List[str]) -> List[dict]:
+    """Como registrar_imagen para un lote: un INSERT de varias filas y un commit."""
+    ids = crud.create_imagenes(db, rutas.modelo, lista)
+    db.commit()
+    for imagen_id, ruta in zip(ids, lista):
+        rutas.agregar(imagen_id, ruta)
+    for ruta in dict.fromkeys(lista):
+        variantes.generador.encolar(ruta)
+    return [{"id": imagen_id, "ruta": ruta} for imagen_id, ruta in zip(ids, lista)]
 
-    file_path = imagen.ruta
+TamanoImagen = Literal["thumb", "medium", "full"]
 
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="Archivo de imagen no encontrado")
+def responder_imagen(ruta: str, size: Optional[str], accept: Optional[str], if_none_match: Optional[str]):
+    """
+    El original, o con size la versión ya generada (variantes.py). Mientras
+    no esté se sirve el original con no-cache, para que el cliente no se
+    quede con él como si fuera la versión.
+    """
+    if size is None:
+        return archivos.respuesta_imagen(ruta, if_none_match)
+    formato = variantes.elegir_formato(accept)
+    variante = variantes.generador.servir(ruta, size, formato)
+    if variante is None:
+        return archivos.respuesta_imagen(ruta, if_none_match, inmutable=False, vary="Accept")
+    return archivos.respuesta_imagen(variante, if_none_match, variantes.TIPOS[formato], vary="Accept")
 
-    return FileResponse(file_path)
+@app.post("/imagenesProfile", response_model=dict, tags=["Imágenes"])
+async def subir_imagen_profile(image: UploadFile = File(...), db: Session = Depends(get_db)):
+    ruta = await guardar_imagen(image, UPLOAD_DIR_PERFILES2)
+    return await run_in_threadpool(registrar_imagen, db, archivos.perfiles, ruta)
+
+@app.post("/imagenesProfile/lote", response_model=List[dict], tags=["Imágenes"])
+async def subir_imagenes_profile(images: List[UploadFile] = File(...), db: Session = Depends(get_db)):
+    """Varias imágenes de perfil en una petición; los ids vuelven en el orden de `images`."""
+    lista = await guardar_imagenes(images, UPLOAD_DIR_PERFILES2)
+    return await run_in_threadpool(registrar_imagenes, db, archivos.perfiles, lista)
+
+@app.get("/imagenesProfile/{imagen_id}", tags=["Imágenes"])
+def obtener_imagen(
+    imagen_id: int,
+    size: Optional[TamanoImagen] = None,
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    # Desde el mapa en memoria: la sesión solo se usa si el id no está
+    ruta = archivos.perfiles.ruta(db, imagen_id)
+    if ruta is None:
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+
+    return responder_imagen(ruta, size, accept, if_none_match)
 
 @app.post("/imagenes", response_model=dict, tags=["Imágenes"])
-def subir_imagen(image: UploadFile = File(...), db: Session = Depends(get_db)):
-    file_path = os.path.join(UPLOAD_DIR, image.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(image.file, buffer)
+async def subir_imagen(image: UploadFile = File(...), db: Session = Depends(get_db)):
+    ruta = await guardar_imagen(image, UPLOAD_DIR)
+    return await run_in_threadpool(registrar_imagen, db, archivos.imagenes, ruta)
 
-    nueva_imagen = models.Imagen(ruta=file_path)
-    db.add(nueva_imagen)
-    db.commit()
-    db.refresh(nueva_imagen)
-    return {"id": nueva_imagen.id, "ruta": nueva_imagen.ruta}
+@app.post("/imagenes/lote", response_model=List[dict], tags=["Imágenes"])
+async def subir_imagenes(images: List[UploadFile] = File(...), db: Session = Depends(get_db)):
+    """
+    Varias imágenes en una petición (la galería de una mascota nueva): se
+    escriben en paralelo y entran con un solo INSERT. Los ids vuelven en el
+    orden de `images`; si una falla (413) no se registra ninguna.
+    """
+    lista = await guardar_imagenes(images, UPLOAD_DIR)
+    return await run_in_threadpool(registrar_imagenes, db, archivos.imagenes, lista)
 
 @app.get("/imagenes/{imagen_id}", tags=["Imágenes"])
-def obtener_imagen(imagen_id: int, db: Session = Depends(get_db)):
-    imagen = db.query(models.Imagen).filter(models.Imagen.id == imagen_id).first()
-    if not imagen:
+def obtener_imagen(
+    imagen_id: int,
+    size: Optional[TamanoImagen] = None,
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    # Desde el mapa en memoria: la sesión solo se usa si el id no está
+    ruta = archivos.imagenes.ruta(db, imagen_id)
+    if ruta is None:
         raise HTTPException(status_code=404, detail="Imagen no encontrada")
 
-    file_path = imagen.ruta
-
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="Archivo de imagen no encontrado")
-
-    return FileResponse(file_path)
+    return responder_imagen(ruta, size, accept, if_none_match)
 
 # ------------------------------------------------
 # Sección: Recomendaciones
 # ------------------------------------------------
 
-def parse_etiquetas_dict(etiquetas_json: str) -> Dict[str, Any]:
-    try:
-        return json.loads(etiquetas_json) if etiquetas_json else {}
-    except:
-        return {}
-
-def construir_matriz_tags(
-    adoptante_tag_dict: Dict[str, Any],
-    mascotas: List[Dict[str, Any]],
-) -> Tuple[List[str], np.ndarray, np.ndarray]:
-    adoptante_tags = []
-    for v in adoptante_tag_dict.values():
-        if isinstance(v, list):
-            adoptante_tags.extend(v)
-        elif isinstance(v, str):
-            adoptante_tags.append(v)
-
-    lista_tags_mascotas = [m["tags"] for m in mascotas]
-
-    conjuntos = [adoptante_tags] + lista_tags_mascotas
-
-    mlb = MultiLabelBinarizer()
-    mlb.fit(conjuntos)
-
-    vector_adoptante = mlb.transform([adoptante_tags])[0]
-    vectores_mascotas = mlb.transform(lista_tags_mascotas)
-
-    return mlb.classes_.tolist(), vector_adoptante, vectores_mascotas
-
 @app.get("/recomendaciones/{adoptante_id}", tags=["Recomendaciones"])
 def obtener_recomendaciones(
     adoptante_id: int,
+    response: Response,
     top_n: int = 0,
+    cursor: Optional[str] = None,
+    modo: Literal["vivo", "precalculado"] = "vivo",
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lon: Optional[float] = Query(None, ge=-180, le=180),
+    radio_km: Optional[float] = Query(None, gt=0, allow_inf_nan=False),
+    busqueda: Literal["exacta", "aproximada"] = recomendaciones.BUSQUEDA,
+    motor: Literal["coseno", "tfidf", "bm25"] = motores.MOTOR,
     db: Session = Depends(get_db),
 ):
-    # 1) Verificar adoptante
+    """
+    Mascotas ordenadas por similitud con el adoptante. `top_n` es el tamaño de
+    página (0 = todas); si quedan más, la cabecera X-Siguiente-Cursor trae el
+    cursor para pedir la siguiente página con `?cursor=`.
+    Con `modo=precalculado` (y top_n > 0) se lee la tabla recomendaciones_precalculadas;
+    si no alcanza para la página (filas viejas o fin del top guardado) se calcula en vivo.
+    Con `lat`/`lon` la similitud se multiplica por exp(-distancia/escala) al albergue
+    y cada mascota trae `distancia_km`; `radio_km` descarta antes de puntuar a las
+    mascotas de albergues más lejanos (o sin coordenadas).
+    `busqueda=aproximada` solo puntúa las candidatas del índice MinHash/LSH:
+    mucho menos trabajo en catálogos grandes a cambio de perder algunas mascotas.
+    `motor` elige cómo se puntúa (coseno, tfidf o bm25; ver motores.py); por
+    defecto el de RECOMENDACIONES_MOTOR, que es con el que se llena la tabla precalculada.
+    """
+    geo = lat is not None or lon is not None or radio_km is not None
+    if geo and (lat is None or lon is None):
+        raise HTTPException(status_code=400, detail="lat y lon van juntos")
+    despues = None
+    if cursor:
+        try:
+            despues = recomendaciones.decodificar_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # 1) Verificar adoptante, antes de cualquier caché: uno borrado no puede seguir
+    #    recibiendo la página guardada (las bajas no pasan por esta app)
     adoptante = db.query(models.Adoptante).get(adoptante_id)
     if not adoptante:
         raise HTTPException(status_code=404, detail="Adoptante no encontrado")
 
-    # 2) IDs de mascotas denegadas por este adoptante
-    denegadas = db.query(Denegacion.mascota_id)\
-                  .filter(Denegacion.adoptante_id == adoptante_id)\
-                  .all()
-    denied_ids = {m[0] for m in denegadas}
+    indice = recomendaciones.indice
+    indice.asegurar(db)
+
+    # 1b) Tabla precalculada: el top guardado por índice y sus etiquetas
+    if modo == "precalculado" and top_n > 0 and not geo and motor == motores.MOTOR:
+        # Página incompleta = el top guardado se acabó o no está vigente: sigue en vivo
+        # (el cursor es el mismo en los dos modos)
+        lista_mascotas = precalculo.leer(db, adoptante_id, top_n, despues)
+        if len(lista_mascotas) == top_n:
+            ultima = lista_mascotas[-1]
+            response.headers["X-Siguiente-Cursor"] = recomendaciones.codificar_cursor(
+                ultima["similitud"], ultima["id"]
+            )
+            return lista_mascotas
+
+    # 1c) Caché: si nada cambió desde la última vez, ni más consultas ni numpy
+    cache = recomendaciones.cache
+    albergues = ubicacion.indice_albergues
+    if geo:
+        albergues.asegurar(db)
+    clave = cache.clave(
+        adoptante_id, top_n, cursor, busqueda, motor, lat, lon, radio_km, albergues.version if geo else None
+    )
+    guardado = cache.obtener(clave)
+    if guardado is not None:
+        lista_mascotas, siguiente = guardado
+        if siguiente:
+            response.headers["X-Siguiente-Cursor"] = siguiente
+        return lista_mascotas
+
+    # 2) Mascotas denegadas o con match ya hecho (solo índices, sin leer mascotas)
+    denied_ids = recomendaciones.excluidas(db, adoptante_id)
 
     # 3) Preparar datos de etiquetas y pesos
-    etiquetas_dict = parse_etiquetas_dict(adoptante.etiquetas)
-    pesos_dict     = parse_etiquetas_dict(adoptante.pesos)
-
-    # 4) Traer mascotas que NO han sido denegadas
-    mascotas_db = db.query(models.Mascota)\
-                .filter(~models.Mascota.id.in_(denied_ids))\
-                .filter(models.Mascota.estado != "Adoptado")\
-                .all()
-    if not mascotas_db:
-        return []
-
-    # 5) Construir lista para cálculos
-    lista_mascotas = []
-    for m in mascotas_db:
-        try:
-            tags = json.loads(m.etiquetas) if m.etiquetas else []
-        except:
-            tags = []
-        lista_mascotas.append({
-            "id": m.id,
-            "nombre": m.nombre,
-            "especie": m.especie,
-            "edad_valor": m.edad_valor,
-            "edad_unidad": m.edad_unidad,
-            "descripcion": m.descripcion,
-            "albergue_id": m.albergue_id,
-            "imagen_id": m.imagen_id,
-            "tags": tags,
-        })
-
-    # 6) Vectorizar y ponderar
-    feature_names, vec_adopt, vecs_masc = construir_matriz_tags(etiquetas_dict, lista_mascotas)
-    pesos_array = np.ones(len(feature_names), dtype=float)
-    for etiqueta, peso in pesos_dict.items():
-        if etiqueta in feature_names:
-            idx = feature_names.index(etiqueta)
-            pesos_array[idx] = float(peso)
-    vec_adopt_pond = vec_adopt * pesos_array
-    vecs_masc_pond = vecs_masc * pesos_array
-
-    # 7) Calcular similitudes y ordenar
-    sims = cosine_similarity([vec_adopt_pond], vecs_masc_pond)[0]
-    for i, mascota in enumerate(lista_mascotas):
-        mascota["similitud"] = round(float(sims[i]), 4)
-    lista_mascotas.sort(key=lambda x: x["similitud"], reverse=True)
-
-    # 8) Recortar a top_n si lo piden
-    if top_n and top_n > 0:
-        lista_mascotas = lista_mascotas[:top_n]
+    etiquetas_dict, pesos_dict = etiquetado.de_adoptante(db, adoptante_id)
 
+    # 4-5) Catálogo enorme: cada proceso del pool puntúa un tramo de la matriz
+    #      compartida y devuelve su top-k; llega ya ordenado (ver paralelo.py)
+    if not geo and busqueda == "exacta" and paralelo.puntuador.activo(indice):
+        ids, sims, hay_mas = paralelo.puntuador.top(
+            indice, etiquetas_dict, pesos_dict, denied_ids, max(top_n, 0), despues, motor
+        )
+        pagina = np.arange(len(ids))
+    else:
+        # 4) Similitud contra el índice en memoria (ya vectorizado, sin releer mascotas);
+        #    con radio, solo las mascotas de albergues dentro del círculo
+        cercanos = albergues.cercanos(lat, lon, radio_km) if geo else None
+        ids, sims, albergue_ids = indice.puntuar(
+            etiquetas_dict, pesos_dict, excluir=denied_ids,
+            albergues=cercanos if radio_km is not None else None,
+            aproximada=busqueda == "aproximada",
+            motor=motor,
+        )
+        if len(ids) == 0:
+            cache.guardar(clave, ([], None))
+            return []
+        if geo:
+            distancias = ubicacion.distancias_por_fila(albergue_ids, cercanos)
+            sims = sims * ubicacion.decaimiento(distancias)
+
+        # 5) Top-k (empates por id) a partir del cursor; solo se arman dicts para la página
+        sims = np.round(sims, 4)
+        pagina, hay_mas = recomendaciones.seleccionar(ids, sims, max(top_n, 0), despues)
+    lista_mascotas = []
+    for i in pagina:
+        datos = indice.datos.get(int(ids[i]))
+        if datos is None:
+            continue
+        mascota = {**datos, "similitud": float(sims[i])}
+        if geo:
+            mascota["distancia_km"] = None if np.isnan(distancias[i]) else round(float(distancias[i]), 2)
+        lista_mascotas.append(mascota)
+
+    # 6) Cursor para la siguiente página
+    siguiente = None
+    if hay_mas and len(pagina):
+        ultimo = pagina[-1]
+        siguiente = recomendaciones.codificar_cursor(float(sims[ultimo]), int(ids[ultimo]))
+        response.headers["X-Siguiente-Cursor"] = siguiente
+
+    cache.guardar(clave, (lista_mascotas, siguiente))
     return lista_mascotas
 
+@app.get("/entidades/cache/estadisticas", tags=["Root"])
+def estadisticas_cache_entidades():
+    return entidades.cache.estadisticas()
+
+@app.get("/recomendaciones/cache/estadisticas", tags=["Recomendaciones"])
+def estadisticas_cache_recomendaciones():
+    return recomendaciones.cache.estadisticas()
+
+@app.post("/recomendaciones/lote", tags=["Recomendaciones"])
+def obtener_recomendaciones_lote(
+    data: schemas.RecomendacionesLote,
+    db: Session = Depends(get_db),
+):
+    """
+    Recomendaciones de muchos adoptantes (o "todos") en una sola pasada sobre
+    el catálogo, para precalcular feeds. Responde NDJSON, una línea
+    {"adoptante_id", "recomendaciones"} por adoptante, a medida que se calculan.
+    """
+    # 1) Perfiles y denegaciones de todos los adoptantes en dos consultas
+    ids_adoptantes, perfiles, excluir = recomendaciones.cargar_perfiles(
+        db, None if data.adoptante_ids == "todos" else data.adoptante_ids
+    )
+
+    # 2) Todas las similitudes con productos de matrices; ya no se toca la BD
+    indice = recomendaciones.indice
+    indice.asegurar(db)
+
+    def generar():
+        lote = paralelo.puntuador.puntuar_lote(indice, perfiles, excluir, max(data.top_n, 0), motor=data.motor)
+        for j, ids, sims in lote:
+            lista = [
+                {**indice.datos[int(i)], "similitud": float(s)}
+                for i, s in zip(ids, sims)
+                if int(i) in indice.datos
+            ]
+            yield json.dumps({"adoptante_id": ids_adoptantes[j], "recomendaciones": lista}) + "\n"
+
+    return StreamingResponse(generar(), media_type="application/x-ndjson")
+
 @app.get("/matches", tags=["Recomendaciones"])
 def obtener_matches_usuario(db: Session = Depends(get_db), user=Depends(get_current_user)):
     from crud import obtener_matches
@@ -739,7 +912,7 @@ from sqlalchemy.orm import joinedload
 
 @app.get("/albergue/{albergue_id}", response_model=schemas.AlbergueOut, summary="Obtener albergue por ID")
 def get_albergue_by_id(albergue_id: int, db: Session = Depends(get_db)):
-    albergue = db.query(models.Albergue).filter(models.Albergue.id == albergue_id).first()
+    albergue = entidades.albergue(db, albergue_id)
     if not albergue:
         raise HTTPException(status_code=404, detail="Albergue no encontrado")
     return albergue
@@ -767,17 +940,14 @@ def obtener_contactos_conversados(emisor_id: int, emisor_tipo: str, db: Session
 
     resultado = []
     for (id_contacto, tipo_contacto) in contactos:
-        if tipo_contacto == "adoptante":
-            user = db.query(Adoptante).filter_by(id=id_contacto).first()
-        else:
-            user = db.query(Albergue).filter_by(id=id_contacto).first()
+        user = entidades.contacto(db, tipo_contacto, id_contacto)
 
         if user:
             resultado.append({
-                "userId": user.id,
+                "userId": user["id"],
                 "userType": tipo_contacto,
-                "name": getattr(user, "nombre", "Sin nombre"),
-                "avatar": getattr(user, "avatar_url", "https://i.pravatar.cc/150")
+                "name": user["nombre"],
+                "avatar": "https://i.pravatar.cc/150"
             })
 
     return resultado
@@ -806,18 +976,15 @@ def obtener_contactos_conversados(emisor_id: int, emisor_tipo: str, db: Session
         if key not in contactos:
             contactos.add(key)
 
-            if contacto_tipo == "adoptante":
-                user = db.query(Adoptante).filter_by(id=contacto_id).first()
-            else:
-                user = db.query(Albergue).filter_by(id=contacto_id).first()
+            user = entidades.contacto(db, contacto_tipo, contacto_id)
 
             if user:
                 resultado.append({
-                    "userId": user.id,
+                    "userId": user["id"],
                     "userType": contacto_tipo,
                     "mascota_id": msg.mascota_id,  # 👈 Incluye mascota
-                    "name": getattr(user, "nombre", "Sin nombre"),
-                    "avatar": getattr(user, "avatar_url", "https://i.pravatar.cc/150")
+                    "name": user["nombre"],
+                    "avatar": "https://i.pravatar.cc/150"
                 })
 
     return resultado
@@ -831,10 +998,8 @@ from models import Mensaje
 from schemas import MessageIn, MessageOut
 from datetime import datetime
 
-active_connections = {}
-
 def get_user_key(user_id: int, user_type: str):
-    return f"{user_type}:{user_id}"
+    return mensajeria.clave(user_type, user_id)
 
 @app.websocket("/ws/chat/{emisor_tipo}/{emisor_id}")
 async def websocket_chat(
@@ -844,9 +1009,13 @@ async def websocket_chat(
     db: Session = Depends(get_db)
 ):
     await websocket.accept()
+    if emisor_tipo not in mensajeria.TIPOS:
+        await websocket.close(code=1008)
+        return
 
+    # Solo las conexiones de este worker; lo demás llega por el broker (mensajeria.py)
     key = get_user_key(emisor_id, emisor_tipo)
-    active_connections[key] = websocket
+    await mensajeria.central.conectar(key, websocket)
 
     try:
         while True:
@@ -878,22 +1047,29 @@ async def websocket_chat(
                 "mascota_id": msg_in.mascota_id
             }
 
-            # Enviar al receptor si está conectado
-            receptor_key = get_user_key(msg_in.receptor_id, msg_in.receptor_tipo)
-            receptor_ws = active_connections.get(receptor_key)
-            if receptor_ws:
-                await receptor_ws.send_json(message_out)
+            # Al receptor, por el broker: lo entrega el worker que tenga su conexión
+            if msg_in.receptor_tipo in mensajeria.TIPOS:
+                await mensajeria.central.enviar(get_user_key(msg_in.receptor_id, msg_in.receptor_tipo), message_out)
 
             # También al emisor (echo)
             await websocket.send_json(message_out)
 
     except WebSocketDisconnect:
         print(f"🔌 WebSocket desconectado: {key}")
-        active_connections.pop(key, None)  # ✅ Eliminación segura
 
     except Exception as e:
         print(f"⚠️ Error inesperado en WebSocket ({key}): {e}")
-        active_connections.pop(key, None)  # ✅ Asegura que la conexión se remueva si falla
+
+    finally:
+        await mensajeria.central.desconectar(key, websocket)  # ✅ y se desuscribe si era la última
+
+@app.get("/chat/estadisticas", tags=["Chat"])
+def estadisticas_chat():
+    return mensajeria.central.estadisticas()
+
+@app.on_event("shutdown")
+async def cerrar_chat():
+    await mensajeria.central.cerrar()
 
 
 
@@ -978,8 +1154,11 @@ def crear_match(match: MatchCreate, db: Session = Depends(get_db)):
             mascota_id=match.mascota_id
         )
         db.add(nuevo_match)
+        precalculo.invalidar(db, match.adoptante_id)
         db.commit()
         db.refresh(nuevo_match)
+        # la mascota deja de recomendársele a este adoptante
+        recomendaciones.cache.excluidas_cambiaron(match.adoptante_id)
         return {"mensaje": "Match guardado", "match": nuevo_match}
     
     except IntegrityError:
@@ -1022,63 +1201,49 @@ def listar_matches_adoptante(adoptante_id: int, db: Session = Depends(get_db)):
 
 @app.get("/usuario/mascotas/{mascota_id}", response_model=MascotaResponse)
 def obtener_mascota_por_id(mascota_id: int, db: Session = Depends(get_db)):
-    mascota = db.query(models.Mascota).filter(models.Mascota.id == mascota_id).first()
-    if not mascota:
+    # Desde la caché de entidades (etiquetas y vacunas ya como listas)
+    datos = entidades.mascota(db, mascota_id)
+    if datos is None:
         raise HTTPException(status_code=404, detail="Mascota no encontrada")
-
-    # Convertir campos string a lista si es necesario
-    if isinstance(mascota.etiquetas, str):
-        mascota.etiquetas = json.loads(mascota.etiquetas)
-    if isinstance(mascota.vacunas, str):
-        mascota.vacunas = json.loads(mascota.vacunas)
-
-    # Convertir datetime a string ISO
-    mascota.created_at = mascota.created_at.isoformat()
-
-    return mascota
+    return serializacion.RespuestaJSON(datos)
 
 @app.get("/matches/albergue/{albergue_id}")
 def listar_matches_albergue(
     albergue_id: int,
+    fields: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
+    """
+    Matches de las mascotas del albergue. `fields` elige qué devolver
+    (`adoptante`, `mascota`, `fecha` o rutas como `mascota.nombre`); el SELECT
+    lleva solo esas columnas.
+    """
     if not db.query(models.Albergue).get(albergue_id):
         raise HTTPException(status_code=404, detail="Albergue no encontrado")
+    try:
+        rutas = serializacion.elegir(list(serializacion.CAMPOS_MATCH_ALBERGUE), fields) or tuple(serializacion.CAMPOS_MATCH_ALBERGUE)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     matches = (
-        db.query(models.Match)
-        .join(models.Mascota, models.Match.mascota)                     # une la mascota
-        .options(                                                       # carga relaciones útiles
-            joinedload(models.Match.adoptante),
-            joinedload(models.Match.mascota)
-        )
-        .filter(models.Mascota.albergue_id == albergue_id)             # filtro por tu albergue
-        .all()
+        db.query(*(serializacion.CAMPOS_MATCH_ALBERGUE[r] for r in rutas))
+        .select_from(models.Match)
+        .join(models.Mascota, models.Match.mascota_id == models.Mascota.id)   # une la mascota
+        .filter(models.Mascota.albergue_id == albergue_id)                     # filtro por tu albergue
     )
+    if any(r.startswith("adoptante.") for r in rutas):
+        matches = matches.outerjoin(models.Adoptante, models.Match.adoptante_id == models.Adoptante.id)
 
-    return [
-        {
-            "adoptante": {
-                "id": m.adoptante.id,
-                "nombre": m.adoptante.nombre,
-                "imagen_perfil_id": m.adoptante.imagen_perfil_id
-            },
-            "mascota": {
-                "id": m.mascota.id,
-                "nombre": m.mascota.nombre,
-                "imagen_id": m.mascota.imagen_id
-            },
-            "fecha": m.fecha.isoformat()
-        }
-        for m in matches
-    ]
+    return serializacion.RespuestaJSON(serializacion.anidar(matches.all(), rutas))
 
 @app.get("/adopciones/albergue/{albergue_id}", tags=["Adopciones"])
 def listar_adopciones_albergue(
     albergue_id: int,
+    fields: Optional[str] = None,
     db: Session = Depends(get_db),
     user=Depends(get_current_user),
 ):
+    """Adopciones de las mascotas del albergue; `fields` como en /matches/albergue/{id}."""
     # 1) Solo el albergue dueño puede consultar
     if user["rol"] != "albergue" or int(user["sub"]) != albergue_id:
         raise HTTPException(status_code=403, detail="Acceso denegado")
@@ -1087,29 +1252,21 @@ def listar_adopciones_albergue(
     if not db.query(models.Albergue).get(albergue_id):
         raise HTTPException(status_code=404, detail="Albergue no encontrado")
 
-    # 3) Hacemos JOIN de Adopcion → Mascota y filtramos por albergue
+    try:
+        rutas = serializacion.elegir(list(serializacion.CAMPOS_ADOPCION_ALBERGUE), fields) or tuple(serializacion.CAMPOS_ADOPCION_ALBERGUE)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # 3) JOIN de Adopcion → Mascota filtrando por albergue, solo con las columnas pedidas
     adopciones = (
-        db.query(models.Adopcion)
-          .join(models.Mascota, models.Adopcion.mascota)
-          .options(joinedload(models.Adopcion.mascota))
+        db.query(*(serializacion.CAMPOS_ADOPCION_ALBERGUE[r] for r in rutas))
+          .select_from(models.Adopcion)
+          .join(models.Mascota, models.Adopcion.mascota_id == models.Mascota.id)
           .filter(models.Mascota.albergue_id == albergue_id)
-          .all()
     )
 
-    # 4) Serializamos un JSON sencillo
-    return [
-        {
-            "id": a.id,
-            "mascota": {
-              "id": a.mascota.id,
-              "nombre": a.mascota.nombre,
-              "imagen_id": a.mascota.imagen_id
-            },
-            "adoptante_id": a.adoptante_id,
-            "fecha": a.fecha.isoformat()
-        }
-        for a in adopciones
-    ]
+    # 4) Filas -> JSON anidado
+    return serializacion.RespuestaJSON(serializacion.anidar(adopciones.all(), rutas))
 
 
 @app.post("/donar", tags=["Donaciones"])
@@ -1151,6 +1308,9 @@ def endpoint_completar_match(
         adop = crud.completar_match(db, adoptante_id, mascota_id)
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
+    # Adoptada: deja de recomendarse y de aparecer en la búsqueda de texto
+    recomendaciones.indice.quitar(mascota_id)
+    busqueda.indice.quitar(mascota_id)
     return {
         "mensaje": "Adopción confirmada",
         "adopcion": {
@@ -1196,6 +1356,11 @@ def endpoint_denegar_match(
         neg = crud.denegar_match(db, adoptante_id, mascota_id)
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
+    precalculo.invalidar(db, adoptante_id)
+    db.commit()
+    db.refresh(neg)
+    # la mascota deja de recomendársele a este adoptante
+    recomendaciones.cache.excluidas_cambiaron(adoptante_id)
     return {
         "mensaje": "Denegación registrada",
         "denegacion": {
@@ -1244,8 +1409,12 @@ def marcar_como_adoptado(
         raise HTTPException(status_code=403, detail="No puedes modificar mascotas de otro albergue")
 
     mascota.estado = "Adoptado"
+    catalogo.cambio(db, mascota.id)
     db.commit()
     db.refresh(mascota)
+    entidades.mascota_cambio(mascota.id)
+    recomendaciones.indice.quitar(mascota.id)
+    busqueda.indice.quitar(mascota.id)
 
     return {"mensaje": f"La mascota '{mascota.nombre}' fue marcada como adoptada"}
 
@@ -1327,6 +1496,12 @@ def actualizar_albergue(
     db: Session = Depends(get_db),
     user = Depends(get_current_user)
 ):
+    """
+    Cambia `qr_imagen_id` y, para la recomendación por cercanía, `direccion`,
+    `latitud` y `longitud` (validadas; null las borra). Antes solo se podían
+    fijar al registrarse. Las coordenadas nuevas se reflejan en
+    ubicacion.indice_albergues en el momento.
+    """
     # ✅ Corrección aquí
     if user["rol"] != "albergue" or int(user["albergue_id"]) != int(albergue_id):
         raise HTTPException(status_code=403, detail="No autorizado para editar este albergue")
@@ -1337,9 +1512,22 @@ def actualizar_albergue(
 
     if "qr_imagen_id" in data:
         albergue.qr_imagen_id = data["qr_imagen_id"]
+    if "direccion" in data:
+        albergue.direccion = None if data["direccion"] is None else str(data["direccion"])
+    for campo, maximo in (("latitud", 90), ("longitud", 180)):
+        if campo in data:
+            if data[campo] is None:
+                setattr(albergue, campo, None)
+                continue
+            try:
+                setattr(albergue, campo, str(ubicacion.validar_coordenada(data[campo], maximo, campo)))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
 
     db.commit()
     db.refresh(albergue)
+    ubicacion.indice_albergues.actualizar(albergue)
+    entidades.albergue_cambio(albergue_id)
 
     return {"mensaje": "Albergue actualizado correctamente"}
 
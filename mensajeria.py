@@ -0,0 +1,429 @@
+"""
+Entrega de los mensajes del chat entre workers (/ws/chat/{tipo}/{id}).
+
+Cada worker guarda solo sus propios WebSockets (Central). Un mensaje no se
+escribe directo en el socket del receptor: se publica en el canal de su
+clave ("adoptante:7") y lo entrega el worker que tiene esa conexión, que es
+el único suscripto. Un worker se suscribe a una clave al abrirse su primer
+socket y se desuscribe al cerrarse el último, así cada uno recibe solo lo de
+sus conexiones y el chat crece agregando workers o máquinas.
+
+El broker se elige con CHAT_BROKER_URL:
+  - vacío: BrokerLocal, dentro del proceso (un solo worker).
+  - postgresql://...: BrokerPostgres, LISTEN/NOTIFY (psycopg2). NOTIFY admite
+    hasta ~8000 bytes: un mensaje más largo queda guardado en la BD pero no
+    se entrega en vivo.
+  - redis://[:clave@]host[:puerto]: BrokerRedis, SUBSCRIBE/PUBLISH con un
+    cliente RESP propio sobre asyncio (sin dependencias), así sirve cualquier
+    servidor que hable el protocolo (Redis, Valkey, KeyDB o uno de prueba:
+    tests/servidor_resp.py, que usa tests/test_mensajeria.py).
+
+Todos tienen iniciar(entregar)/suscribir/desuscribir/publicar/cerrar y se
+inician con la primera conexión, dentro del event loop del servidor. Si se
+corta la conexión al broker se reconecta y se vuelven a pedir las claves.
+"""
+import asyncio
+import json
+import os
+import re
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+from urllib.parse import unquote, urlsplit
+
+from starlette.concurrency import run_in_threadpool # type: ignore
+
+URL = os.getenv("CHAT_BROKER_URL", "")   # vacío = en el proceso
+TIPOS = ("adoptante", "albergue")
+LIMITE_NOTIFY = 7900   # bytes; Postgres corta en 8000 contando el canal
+
+Entregar = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+
+def clave(tipo: str, usuario_id: int) -> str:
+    return f"{tipo}:{usuario_id}"
+
+
+class BrokerLocal:
+    """Sin broker: publicar entrega en este mismo proceso."""
+    nombre = "local"
+
+    async def iniciar(self, entregar: Entregar):
+        self._entregar = entregar
+
+    async def suscribir(self, clave: str):
+        pass
+
+    async def desuscribir(self, clave: str):
+        pass
+
+    async def publicar(self, clave: str, mensaje: Dict[str, Any]):
+        await self._entregar(clave, mensaje)
+
+    async def cerrar(self):
+        pass
+
+
+# ---------- Redis (RESP) ----------
+
+class ErrorRESP(Exception):
+    pass
+
+def comando(*partes) -> bytes:
+    salida = [b"*%d\r\n" % len(partes)]
+    for parte in partes:
+        datos = parte.encode() if isinstance(parte, str) else parte
+        salida.append(b"$%d\r\n%s\r\n" % (len(datos), datos))
+    return b"".join(salida)
+
+async def leer(reader: asyncio.StreamReader) -> Any:
+    """Una respuesta RESP2: bytes, int, lista o None. ErrorRESP si el servidor contesta un error."""
+    linea = await reader.readuntil(b"\r\n")
+    tipo, resto = linea[:1], linea[1:-2]
+    if tipo == b"+":
+        return resto
+    if tipo == b"-":
+        raise ErrorRESP(resto.decode(errors="replace"))
+    if tipo == b":":
+        return int(resto)
+    if tipo == b"$":
+        largo = int(resto)
+        return None if largo < 0 else (await reader.readexactly(largo + 2))[:-2]
+    if tipo == b"*":
+        largo = int(resto)
+        return None if largo < 0 else [await leer(reader) for _ in range(largo)]
+    raise ValueError(f"Respuesta RESP desconocida: {linea!r}")
+
+
+class BrokerRedis:
+    """
+    Una conexión suscripta (SUBSCRIBE por clave, leída por una tarea) y otra
+    para PUBLISH. Los canales llevan `prefijo` para no chocar con otros usos.
+    """
+    nombre = "redis"
+    CORTES = (OSError, EOFError, ErrorRESP, ValueError)
+
+    def __init__(self, url: str, prefijo: str = "doggo:chat:"):
+        partes = urlsplit(url)
+        self.host = partes.hostname or "localhost"
+        self.puerto = partes.port or 6379
+        self.usuario = unquote(partes.username) if partes.username else None
+        self.clave = unquote(partes.password) if partes.password else None
+        self.prefijo = prefijo
+        self._claves: Set[str] = set()
+        self._sub: Optional[tuple] = None   # (reader, writer); None mientras se reconecta
+        self._pub: Optional[tuple] = None
+        self._pub_lock = asyncio.Lock()
+        self._tarea: Optional[asyncio.Task] = None
+
+    async def _abrir(self) -> tuple:
+        reader, writer = await asyncio.open_connection(self.host, self.puerto)
+        if self.clave:
+            writer.write(comando("AUTH", *([self.usuario] if self.usuario else []), self.clave))
+            await writer.drain()
+            await leer(reader)
+        return reader, writer
+
+    async def iniciar(self, entregar: Entregar):
+        self._entregar = entregar
+        self._sub = await self._abrir()
+        self._tarea = asyncio.create_task(self._escuchar())
+
+    async def _pedir(self, orden: str, *claves: str):
+        if self._sub is None or not claves:
+            return   # al reconectar, _escuchar vuelve a suscribir todo
+        writer = self._sub[1]
+        writer.write(comando(orden, *(self.prefijo + c for c in claves)))
+        try:
+            await writer.drain()
+        except OSError:
+            pass   # _escuchar ve el corte
+
+    async def suscribir(self, clave: str):
+        self._claves.add(clave)
+        await self._pedir("SUBSCRIBE", clave)
+
+    async def desuscribir(self, clave: str):
+        self._claves.discard(clave)
+        await self._pedir("UNSUBSCRIBE", clave)
+
+    async def _escuchar(self):
+        espera = 0.5
+        while True:
+            try:
+                reader = self._sub[0]
+                while True:
+                    respuesta = await leer(reader)
+                    espera = 0.5
+                    # ["message", canal, datos]; las confirmaciones de (un)subscribe se ignoran
+                    if isinstance(respuesta, list) and len(respuesta) == 3 and respuesta[0] == b"message":
+                        canal = respuesta[1].decode()
+                        await self._entregar(canal[len(self.prefijo):], json.loads(respuesta[2]))
+            except self.CORTES as e:
+                print(f"⚠️ Chat: se cortó la suscripción a Redis ({e!r}); reconectando")
+            self._sub[1].close()
+            self._sub = None
+            while self._sub is None:
+                await asyncio.sleep(espera)
+                espera = min(espera * 2, 10)
+                try:
+                    self._sub = await self._abrir()
+                except self.CORTES:
+                    pass
+            await self._pedir("SUBSCRIBE", *self._claves)
+
+    async def publicar(self, clave: str, mensaje: Dict[str, Any]):
+        datos = json.dumps(mensaje)
+        async with self._pub_lock:
+            for intento in (1, 2):   # una vez más con una conexión nueva si la anterior se cortó
+                try:
+                    if self._pub is None:
+                        self._pub = await self._abrir()
+                    reader, writer = self._pub
+                    writer.write(comando("PUBLISH", self.prefijo + clave, datos))
+                    await writer.drain()
+                    await leer(reader)
+                    return
+                except self.CORTES:
+                    if self._pub is not None:
+                        self._pub[1].close()
+                        self._pub = None
+                    if intento == 2:
+                        raise
+
+    async def cerrar(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+        for conexion in (self._sub, self._pub):
+            if conexion is not None:
+                conexion[1].close()
+        self._sub = self._pub = None
+
+
+# ---------- Postgres (LISTEN/NOTIFY) ----------
+
+class BrokerPostgres:
+    """
+    Una conexión en autocommit hace LISTEN por clave y el event loop la lee
+    con add_reader; los avisos pasan por una cola para entregarlos en orden.
+    LISTEN/UNLISTEN y NOTIFY (este por otra conexión) van en el threadpool.
+    """
+    nombre = "postgres"
+
+    def __init__(self, url: str, prefijo: str = "chat:"):
+        import psycopg2 # type: ignore
+        self._pg = psycopg2
+        self.url = re.sub(r"^postgres(ql)?(\+\w+)?://", "postgresql://", url)   # admite la URL de SQLAlchemy
+        self.prefijo = prefijo
+        self._claves: Set[str] = set()
+        self._escucha = None
+        self._escucha_lock = threading.Lock()   # un LISTEN/UNLISTEN o un poll() a la vez
+        self._pub = None
+        self._pub_lock = threading.Lock()
+        self._cola: Optional[asyncio.Queue] = None
+        self._tareas: list = []
+
+    def _conectar(self):
+        conexion = self._pg.connect(self.url)
+        conexion.autocommit = True
+        return conexion
+
+    async def iniciar(self, entregar: Entregar):
+        self._entregar = entregar
+        self._loop = asyncio.get_running_loop()
+        self._cola = asyncio.Queue()
+        self._tareas.append(asyncio.create_task(self._repartir()))
+        await self._abrir_escucha()
+
+    async def _abrir_escucha(self):
+        self._escucha = await run_in_threadpool(self._conectar)
+        self._loop.add_reader(self._escucha.fileno(), self._leer)
+        for clave in list(self._claves):
+            await self._ejecutar("LISTEN", clave)
+
+    async def _ejecutar(self, orden: str, clave: str):
+        """
+        LISTEN/UNLISTEN fuera del loop. psycopg2 lee del socket los avisos que
+        llegan mientras tanto y los deja en notifies sin que add_reader se
+        entere, así que al terminar se vacían acá.
+        """
+        from psycopg2 import sql # type: ignore
+        conexion = self._escucha
+        consulta = sql.SQL(orden + " {}").format(sql.Identifier(self.prefijo + clave))
+
+        def ejecutar():
+            with self._escucha_lock, conexion.cursor() as cursor:
+                cursor.execute(consulta)
+        await run_in_threadpool(ejecutar)
+        self._vaciar()
+
+    async def suscribir(self, clave: str):
+        self._claves.add(clave)
+        if self._escucha is not None:
+            try:
+                await self._ejecutar("LISTEN", clave)
+            except self._pg.Error as e:
+                self._cortada(e)
+
+    async def desuscribir(self, clave: str):
+        self._claves.discard(clave)
+        if self._escucha is not None:
+            try:
+                await self._ejecutar("UNLISTEN", clave)
+            except self._pg.Error as e:
+                self._cortada(e)
+
+    def _leer(self):
+        # Con un LISTEN en curso ese hilo lee el socket; _ejecutar vacía al terminar
+        if not self._escucha_lock.acquire(blocking=False):
+            return
+        try:
+            self._escucha.poll()
+        except self._pg.Error as e:
+            self._cortada(e)
+            return
+        finally:
+            self._escucha_lock.release()
+        self._vaciar()
+
+    def _vaciar(self):
+        """En el hilo del loop: pasa a la cola los avisos que psycopg2 ya leyó."""
+        if self._escucha is None:
+            return
+        while self._escucha.notifies:
+            aviso = self._escucha.notifies.pop(0)
+            self._cola.put_nowait((aviso.channel[len(self.prefijo):], aviso.payload))
+
+    async def _repartir(self):
+        while True:
+            clave, datos = await self._cola.get()
+            await self._entregar(clave, json.loads(datos))
+
+    def _cerrar_escucha(self):
+        if self._escucha is None:
+            return
+        try:
+            self._loop.remove_reader(self._escucha.fileno())
+            self._escucha.close()
+        except self._pg.Error:
+            pass
+        self._escucha = None
+
+    def _cortada(self, error: Exception):
+        if self._escucha is None:
+            return
+        print(f"⚠️ Chat: se cortó la conexión LISTEN a Postgres ({error!r}); reconectando")
+        self._cerrar_escucha()
+        self._tareas.append(asyncio.ensure_future(self._reconectar()))
+
+    async def _reconectar(self):
+        espera = 0.5
+        while self._escucha is None:
+            await asyncio.sleep(espera)
+            espera = min(espera * 2, 10)
+            try:
+                await self._abrir_escucha()
+            except self._pg.Error:
+                self._cerrar_escucha()
+
+    def _notificar(self, canal: str, datos: str):
+        with self._pub_lock:
+            for intento in (1, 2):
+                try:
+                    if self._pub is None or self._pub.closed:
+                        self._pub = self._conectar()
+                    with self._pub.cursor() as cursor:
+                        cursor.execute("SELECT pg_notify(%s, %s)", (canal, datos))
+                    return
+                except (self._pg.OperationalError, self._pg.InterfaceError):
+                    self._pub = None
+                    if intento == 2:
+                        raise
+
+    async def publicar(self, clave: str, mensaje: Dict[str, Any]):
+        datos = json.dumps(mensaje)
+        if len(datos.encode()) > LIMITE_NOTIFY:
+            print(f"⚠️ Chat: mensaje para {clave} demasiado largo para NOTIFY; queda solo en la BD")
+            return
+        await run_in_threadpool(self._notificar, self.prefijo + clave, datos)
+
+    async def cerrar(self):
+        for tarea in self._tareas:
+            tarea.cancel()
+        self._cerrar_escucha()
+        with self._pub_lock:
+            if self._pub is not None:
+                self._pub.close()
+                self._pub = None
+
+
+def crear_broker(url: str):
+    if not url:
+        return BrokerLocal()
+    esquema = urlsplit(url).scheme.split("+")[0]
+    if esquema in ("postgres", "postgresql"):
+        return BrokerPostgres(url)
+    if esquema == "redis":
+        return BrokerRedis(url)
+    raise ValueError(f"CHAT_BROKER_URL no soportada: {url} (postgresql:// o redis://)")
+
+
+# ---------- conexiones del worker ----------
+
+class Central:
+    """Los WebSockets de este worker por clave, y el broker que les trae los mensajes."""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self._conexiones: Dict[str, Set[Any]] = {}
+        self._lock = asyncio.Lock()
+        self._iniciada = False
+
+    async def conectar(self, clave: str, websocket):
+        async with self._lock:
+            if not self._iniciada:
+                await self.broker.iniciar(self._entregar)
+                self._iniciada = True
+            sockets = self._conexiones.setdefault(clave, set())
+            sockets.add(websocket)
+            if len(sockets) == 1:
+                await self.broker.suscribir(clave)
+
+    async def desconectar(self, clave: str, websocket):
+        async with self._lock:
+            sockets = self._conexiones.get(clave)
+            if sockets is None:
+                return
+            sockets.discard(websocket)
+            if not sockets:
+                del self._conexiones[clave]
+                await self.broker.desuscribir(clave)
+
+    async def enviar(self, clave: str, mensaje: Dict[str, Any]):
+        """Publica para `clave`; si el broker falla el mensaje ya está en la BD y no corta al emisor."""
+        try:
+            await self.broker.publicar(clave, mensaje)
+        except Exception as e:
+            print(f"⚠️ Chat: no se pudo publicar para {clave}: {e!r}")
+
+    async def _entregar(self, clave: str, mensaje: Dict[str, Any]):
+        for websocket in list(self._conexiones.get(clave, ())):
+            try:
+                await websocket.send_json(mensaje)
+            except Exception as e:   # el bucle de ese socket lo desconecta
+                print(f"⚠️ Chat: no se pudo entregar a {clave}: {e!r}")
+
+    async def cerrar(self):
+        if self._iniciada:
+            await self.broker.cerrar()
+            self._iniciada = False
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            "broker": self.broker.nombre,
+            "claves": len(self._conexiones),   # de este worker
+            "conexiones": sum(len(s) for s in self._conexiones.values()),
+        }
+
+
+# Central única del proceso
+central = Central(crear_broker(URL))
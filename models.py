@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, DateTime # type: ignore
+from sqlalchemy import Column, Integer, BigInteger, Boolean, Float, String, ForeignKey, Text, DateTime, Index, case # type: ignore
 from sqlalchemy.orm import relationship # type: ignore
 from database import Base
 from sqlalchemy.sql import func # type: ignore
+from sqlalchemy.sql.elements import Grouping # type: ignore
 from datetime import datetime
 
 
@@ -76,6 +77,25 @@ class Mascota(Base):
     adopcion   = relationship("Adopcion", back_populates="mascota",uselist=False, cascade="all, delete-orphan")
     denegaciones = relationship("Denegacion", back_populates="mascota", cascade="all, delete-orphan")
 
+    # Páginas de GET /mascotas y /mascotas/albergue/{id} (keyset por id o por created_at, id)
+    __table_args__ = (
+        Index("ix_mascotas_albergue_id", "albergue_id", "id"),
+        Index("ix_mascotas_especie_genero_id", "especie", "genero", "id"),
+        Index("ix_mascotas_estado_id", "estado", "id"),
+        Index("ix_mascotas_created_at_id", "created_at", "id"),
+    )
+
+# Edad en meses a partir de edad_valor/edad_unidad (texto libre: "meses" por defecto,
+# "años", "semanas", "días"); los filtros de edad van contra esta misma expresión
+# para que usen su índice
+EDAD_MESES = case(
+    (func.lower(Mascota.edad_unidad).like("a%"), Mascota.edad_valor * 12),
+    (func.lower(Mascota.edad_unidad).like("sem%"), Mascota.edad_valor // 4),
+    (func.lower(Mascota.edad_unidad).like("d%"), Mascota.edad_valor // 30),
+    else_=Mascota.edad_valor,
+)
+Index("ix_mascotas_edad_meses_id", Grouping(EDAD_MESES), Mascota.id)   # PostgreSQL pide la expresión entre paréntesis
+
 #=====IMAGEN=======
 class Imagen(Base):
     __tablename__ = "imagenes"
@@ -177,6 +197,10 @@ class Adopcion(Base):
 
     adoptante = relationship("Adoptante", back_populates="adopciones")
     mascota   = relationship("Mascota",   back_populates="adopcion")
+    __table_args__ = (
+        Index("ix_adopciones_adoptante_mascota", "adoptante_id", "mascota_id"),
+        Index("ix_adopciones_mascota", "mascota_id"),   # NOT EXISTS de recomendaciones.consulta_disponibles
+    )
 
 class Denegacion(Base):
     __tablename__ = "denegaciones"
@@ -187,3 +211,82 @@ class Denegacion(Base):
 
     adoptante = relationship("Adoptante", back_populates="denegaciones")
     mascota   = relationship("Mascota",   back_populates="denegaciones")
+    __table_args__ = (
+        Index("ix_denegaciones_adoptante_mascota", "adoptante_id", "mascota_id"),
+    )
+
+
+class RecomendacionPrecalculada(Base):
+    """Top de recomendaciones por adoptante, calculado en segundo plano (precalculo.py)."""
+    __tablename__ = "recomendaciones_precalculadas"
+    id              = Column(Integer, primary_key=True, index=True)
+    adoptante_id    = Column(Integer, ForeignKey("adoptante.id"), nullable=False)
+    mascota_id      = Column(Integer, ForeignKey("mascotas.id"), nullable=False)
+    similitud       = Column(Float, nullable=False)
+    rango           = Column(Integer, nullable=False)
+    calculado_en    = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    huella_catalogo = Column(BigInteger, nullable=False)  # IndiceEtiquetas.huella al calcular
+
+    __table_args__ = (
+        Index("ix_recomendaciones_precalculadas_lectura", "adoptante_id", "huella_catalogo", "rango"),
+    )
+
+
+# === ETIQUETAS NORMALIZADAS (etiquetado.py) ===
+# Reemplazan a las columnas JSON Mascota.etiquetas/vacunas y Adoptante.etiquetas/pesos,
+# que ya no se escriben: quedan solo como origen de etiquetado.migrar().
+class Etiqueta(Base):
+    """Vocabulario único de etiquetas y vacunas: cada nombre se guarda una vez."""
+    __tablename__ = "etiqueta"
+    id     = Column(Integer, primary_key=True, index=True)
+    nombre = Column(String, unique=True, nullable=False)
+
+class MascotaEtiqueta(Base):
+    __tablename__ = "mascota_etiqueta"
+    mascota_id  = Column(Integer, ForeignKey("mascotas.id", ondelete="CASCADE"), primary_key=True)
+    etiqueta_id = Column(Integer, ForeignKey("etiqueta.id"), primary_key=True)
+    posicion    = Column(Integer, nullable=False)   # orden en la lista original
+
+    __table_args__ = (
+        Index("ix_mascota_etiqueta_etiqueta", "etiqueta_id", "mascota_id"),   # filtrar mascotas por etiqueta
+    )
+
+class MascotaVacuna(Base):
+    __tablename__ = "mascota_vacuna"
+    mascota_id  = Column(Integer, ForeignKey("mascotas.id", ondelete="CASCADE"), primary_key=True)
+    etiqueta_id = Column(Integer, ForeignKey("etiqueta.id"), primary_key=True)
+    posicion    = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_mascota_vacuna_etiqueta", "etiqueta_id", "mascota_id"),   # mascotas vacunadas contra X
+    )
+
+class AdoptanteEtiqueta(Base):
+    """Adoptante.etiquetas ({categoria: etiqueta | [etiquetas]}) en filas."""
+    __tablename__ = "adoptante_etiqueta"
+    adoptante_id = Column(Integer, ForeignKey("adoptante.id", ondelete="CASCADE"), primary_key=True)
+    posicion     = Column(Integer, primary_key=True)   # orden dentro de todo el dict
+    categoria    = Column(String, nullable=False)
+    etiqueta_id  = Column(Integer, ForeignKey("etiqueta.id"), nullable=False)
+    en_lista     = Column(Boolean, nullable=False, default=True)   # False = la categoría era un string suelto
+
+class AdoptantePeso(Base):
+    __tablename__ = "adoptante_peso"
+    adoptante_id = Column(Integer, ForeignKey("adoptante.id", ondelete="CASCADE"), primary_key=True)
+    etiqueta_id  = Column(Integer, ForeignKey("etiqueta.id"), primary_key=True)
+    peso         = Column(Float, nullable=False)
+
+class Migracion(Base):
+    """Migraciones de datos que corren una sola vez (ver etiquetado.migrar)."""
+    __tablename__ = "migraciones"
+    nombre      = Column(String, primary_key=True)
+    aplicada_en = Column(DateTime(timezone=True), server_default=func.now())
+
+class CatalogoVersion(Base):
+    """
+    Contadores de versión del catálogo (ver catalogo.py). mascota_id = 0 es el
+    global; el de cada mascota toma el valor global del último cambio.
+    """
+    __tablename__ = "catalogo_version"
+    mascota_id = Column(Integer, primary_key=True, autoincrement=False)
+    version    = Column(BigInteger, nullable=False, default=0)
@@ -0,0 +1,311 @@
+"""
+Motores de puntuación de /recomendaciones.
+
+Todos puntúan la misma matriz CSR binaria mascota x etiqueta del índice
+(recomendaciones.IndiceEtiquetas) contra las etiquetas y pesos del adoptante;
+cambia cómo cuenta cada etiqueta:
+
+- "coseno": coseno ponderado por los pesos del adoptante (el cálculo original).
+- "tfidf": el mismo coseno con cada columna multiplicada además por su idf,
+  así una etiqueta rara ("hipoalergénico") pesa más que una que tienen casi
+  todas ("juguetón").
+- "bm25": Okapi BM25 con tf binario, normalizado a [0, 1].
+
+Las estadísticas del corpus (nº de mascotas, frecuencia de documento de cada
+columna y largo medio) las mantiene el índice al agregar y quitar filas; acá
+solo se leen, nunca se recorre el catálogo para calcularlas.
+"""
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np # type: ignore
+from scipy import sparse # type: ignore
+
+MOTOR = os.getenv("RECOMENDACIONES_MOTOR", "coseno")   # "coseno", "tfidf" o "bm25"
+BM25_K1 = float(os.getenv("RECOMENDACIONES_BM25_K1", "1.2"))
+BM25_B = float(os.getenv("RECOMENDACIONES_BM25_B", "0.75"))
+
+
+class Estadisticas(NamedTuple):
+    """Corpus de mascotas activas del índice."""
+    n_docs: int
+    df: np.ndarray           # columna -> nº de mascotas activas con esa etiqueta
+    longitud_media: float    # etiquetas por mascota activa
+
+
+def etiquetas_adoptante(etiquetas_dict: Dict[str, Any]) -> List[str]:
+    """Aplana el dict de etiquetas del adoptante igual que construir_matriz_tags."""
+    tags = []
+    for v in etiquetas_dict.values():
+        if isinstance(v, list):
+            tags.extend(v)
+        elif isinstance(v, str):
+            tags.append(v)
+    return tags
+
+
+def perfil_adoptante(
+    vocabulario: Dict[str, int],
+    n_cols: int,
+    etiquetas_dict: Dict[str, Any],
+    pesos_dict: Dict[str, Any],
+    factor: Optional[np.ndarray] = None,
+    factor_fuera: float = 1.0,
+) -> Tuple[Dict[int, float], Dict[int, float], float]:
+    """
+    Vector del adoptante en las columnas del índice, en forma dispersa:
+    (q, w2, norma) donde q[col] = a*w²*f de sus etiquetas, w2[col] = w² de las
+    columnas con peso distinto de 1 y norma = |a*w*√f|.
+    `factor` (f) es un peso extra por columna (idf² en tfidf; 1 si es None) y
+    `factor_fuera` el de las etiquetas que ninguna mascota tiene: esas no
+    suman al producto pero sí a la norma, igual que en el vocabulario de
+    MultiLabelBinarizer.
+    """
+    tags = set(etiquetas_adoptante(etiquetas_dict))
+
+    w2 = {}
+    for etiqueta, peso in pesos_dict.items():
+        col = vocabulario.get(etiqueta)
+        if col is not None and col < n_cols:
+            w2[col] = float(peso) ** 2
+
+    q = {}
+    norma2 = 0.0
+    for t in tags:
+        col = vocabulario.get(t)
+        dentro = col is not None and col < n_cols
+        f = (1.0 if factor is None else float(factor[col])) if dentro else factor_fuera
+        if dentro:
+            q[col] = w2.get(col, 1.0) * f
+        norma2 += float(pesos_dict.get(t, 1.0)) ** 2 * f
+    return q, w2, float(np.sqrt(norma2))
+
+def similitudes(
+    matriz: sparse.csr_matrix,
+    vocabulario: Dict[str, int],
+    etiquetas_dict: Dict[str, Any],
+    pesos_dict: Dict[str, Any],
+    factor: Optional[np.ndarray] = None,
+    factor_fuera: float = 1.0,
+    perfil: Optional[Tuple[Dict[int, float], Dict[int, float], float]] = None,
+) -> np.ndarray:
+    """
+    cos(a*w*√f, x*w*√f) = sum(a*x*w²*f) / (|a*w*√f| * |x*w*√f|), con a y x
+    binarios. `perfil` es el de perfil_adoptante si ya se calculó.
+    """
+    n_cols = matriz.shape[1]
+    if perfil is None:
+        perfil = perfil_adoptante(vocabulario, n_cols, etiquetas_dict, pesos_dict, factor, factor_fuera)
+    q_cols, w2_cols, norma_adoptante = perfil
+
+    q = np.zeros(n_cols, dtype=np.float64)
+    q[list(q_cols)] = list(q_cols.values())
+    g = np.ones(n_cols, dtype=np.float64) if factor is None else factor.astype(np.float64)
+    g[list(w2_cols)] *= list(w2_cols.values())
+
+    productos = matriz @ q
+    normas = np.sqrt(matriz @ g) * norma_adoptante
+    sims = np.zeros(matriz.shape[0], dtype=np.float64)
+    np.divide(productos, normas, out=sims, where=normas > 0)
+    return sims
+
+def similitudes_lote(
+    matriz: sparse.csr_matrix,
+    vocabulario: Dict[str, int],
+    perfiles: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+    factor: Optional[np.ndarray] = None,
+    factor_fuera: float = 1.0,
+) -> np.ndarray:
+    """
+    Lo mismo que `similitudes` para muchos adoptantes a la vez: arma las
+    matrices Q (a*w²*f) y (W² - 1)*f de todos los perfiles y resuelve todo con
+    dos productos matriz dispersa x matriz dispersa. Devuelve (mascotas x adoptantes).
+    """
+    n_cols = matriz.shape[1]
+    q_filas, q_cols, q_vals = [], [], []
+    w_filas, w_cols, w_vals = [], [], []
+    normas_adoptantes = np.zeros(len(perfiles), dtype=np.float64)
+    for j, (etiquetas_dict, pesos_dict) in enumerate(perfiles):
+        q, w2, normas_adoptantes[j] = perfil_adoptante(
+            vocabulario, n_cols, etiquetas_dict, pesos_dict, factor, factor_fuera
+        )
+        q_filas += [j] * len(q); q_cols += list(q); q_vals += list(q.values())
+        w_filas += [j] * len(w2); w_cols += list(w2)
+        w_vals += [(v - 1.0) * (1.0 if factor is None else float(factor[c])) for c, v in w2.items()]
+
+    forma = (len(perfiles), n_cols)
+    Q = sparse.csr_matrix((q_vals, (q_filas, q_cols)), shape=forma, dtype=np.float64)
+    W = sparse.csr_matrix((w_vals, (w_filas, w_cols)), shape=forma, dtype=np.float64)
+
+    # Dos matrices densas (mascotas x adoptantes) y el resto en el lugar: es lo
+    # que supone recomendaciones.bloque_lote
+    productos = (matriz @ Q.T).toarray()
+    # |x*w*√f|² = sum(x*f) + sum(x*f*(w² - 1)); sin factor el primero es el nº de etiquetas
+    base = np.diff(matriz.indptr).astype(np.float64) if factor is None else matriz @ factor
+    normas = (matriz @ W.T).toarray()
+    normas += base[:, None]
+    np.maximum(normas, 0.0, out=normas)
+    np.sqrt(normas, out=normas)
+    normas *= normas_adoptantes[None, :]
+    return _dividir(productos, normas)
+
+def _dividir(numerador: np.ndarray, denominador: np.ndarray) -> np.ndarray:
+    """numerador / denominador en el lugar, 0 donde el denominador no es > 0."""
+    validos = denominador > 0
+    np.divide(numerador, denominador, out=numerador, where=validos)
+    np.copyto(numerador, 0.0, where=~validos)
+    return numerador
+
+
+class Motor:
+    """
+    Interfaz de un motor: puntúa las filas de `matriz` (mascotas) contra uno o
+    varios adoptantes usando las estadísticas del corpus. Más similitud = mejor.
+    """
+    nombre = ""
+
+    def perfil(
+        self,
+        vocabulario: Dict[str, int],
+        n_cols: int,
+        estadisticas: Estadisticas,
+        etiquetas_dict: Dict[str, Any],
+        pesos_dict: Dict[str, Any],
+    ) -> Any:
+        """Lo que depende solo del adoptante; puntuar(perfil=...) lo usa en vez de armarlo."""
+        raise NotImplementedError
+
+    def puntuar(
+        self,
+        matriz: sparse.csr_matrix,
+        vocabulario: Dict[str, int],
+        estadisticas: Estadisticas,
+        etiquetas_dict: Dict[str, Any],
+        pesos_dict: Dict[str, Any],
+        perfil: Any = None,
+    ) -> np.ndarray:
+        raise NotImplementedError
+
+    def puntuar_lote(
+        self,
+        matriz: sparse.csr_matrix,
+        vocabulario: Dict[str, int],
+        estadisticas: Estadisticas,
+        perfiles: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+    ) -> np.ndarray:
+        """(mascotas x adoptantes); por defecto, un adoptante a la vez."""
+        columnas = [
+            self.puntuar(matriz, vocabulario, estadisticas, etiquetas, pesos) for etiquetas, pesos in perfiles
+        ]
+        if not columnas:
+            return np.zeros((matriz.shape[0], 0), dtype=np.float64)
+        return np.column_stack(columnas)
+
+
+class Coseno(Motor):
+    """Coseno ponderado: da los mismos valores que construir_matriz_tags + cosine_similarity."""
+    nombre = "coseno"
+
+    def factor(self, estadisticas: Estadisticas) -> Tuple[Optional[np.ndarray], float]:
+        """Peso extra por columna y el de una etiqueta fuera del índice."""
+        return None, 1.0
+
+    def perfil(self, vocabulario, n_cols, estadisticas, etiquetas_dict, pesos_dict):
+        factor, fuera = self.factor(estadisticas)
+        return perfil_adoptante(vocabulario, n_cols, etiquetas_dict, pesos_dict, factor, fuera)
+
+    def puntuar(self, matriz, vocabulario, estadisticas, etiquetas_dict, pesos_dict, perfil=None):
+        factor, fuera = self.factor(estadisticas)
+        return similitudes(matriz, vocabulario, etiquetas_dict, pesos_dict, factor, fuera, perfil)
+
+    def puntuar_lote(self, matriz, vocabulario, estadisticas, perfiles):
+        factor, fuera = self.factor(estadisticas)
+        return similitudes_lote(matriz, vocabulario, perfiles, factor, fuera)
+
+
+class TfIdfCoseno(Coseno):
+    """
+    Coseno sobre vectores tf-idf (tf binario): cada etiqueta vale w*idf en los
+    dos vectores, con idf = ln((1 + N) / (1 + df)) + 1 como el suavizado de
+    sklearn. Una etiqueta que ninguna mascota tiene usa df = 0.
+    """
+    nombre = "tfidf"
+
+    def factor(self, estadisticas):
+        n = estadisticas.n_docs
+        idf = np.log((1.0 + n) / (1.0 + estadisticas.df)) + 1.0
+        return idf ** 2, float(np.log(1.0 + n) + 1.0) ** 2
+
+
+class BM25(Motor):
+    """
+    Okapi BM25 con tf binario y los pesos del adoptante como peso de cada
+    término de la consulta:
+
+        sum(w * idf * (k1 + 1) / (1 + k1 * (1 - b + b * |x| / largo_medio)))
+
+    con idf = ln(1 + (N - df + 0.5) / (df + 0.5)). Se divide por el máximo
+    posible para ese adoptante (todas sus etiquetas en una mascota de largo
+    cero) para que quede en [0, 1] como las otras similitudes.
+    """
+    nombre = "bm25"
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+
+    def _consulta(self, vocabulario, n_cols, estadisticas, perfiles):
+        """Q (adoptantes x columnas) con w*idf y el máximo de cada adoptante."""
+        n = estadisticas.n_docs
+        df = estadisticas.df[:n_cols]
+        idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+        idf_fuera = float(np.log(1.0 + (n + 0.5) / 0.5))
+        tope = (self.k1 + 1.0) / (1.0 + self.k1 * (1.0 - self.b))
+
+        filas, cols, vals = [], [], []
+        maximos = np.zeros(len(perfiles), dtype=np.float64)
+        for j, (etiquetas_dict, pesos_dict) in enumerate(perfiles):
+            for t in set(etiquetas_adoptante(etiquetas_dict)):
+                w = float(pesos_dict.get(t, 1.0))
+                col = vocabulario.get(t)
+                if col is not None and col < n_cols:
+                    filas.append(j); cols.append(col); vals.append(w * idf[col])
+                    maximos[j] += w * idf[col] * tope
+                else:
+                    maximos[j] += w * idf_fuera * tope
+        Q = sparse.csr_matrix((vals, (filas, cols)), shape=(len(perfiles), n_cols), dtype=np.float64)
+        return Q, maximos
+
+    def _saturacion(self, matriz, estadisticas):
+        """El factor de cada mascota según su largo."""
+        largos = np.diff(matriz.indptr).astype(np.float64)
+        media = estadisticas.longitud_media or 1.0
+        return (self.k1 + 1.0) / (1.0 + self.k1 * (1.0 - self.b + self.b * largos / media))
+
+    def perfil(self, vocabulario, n_cols, estadisticas, etiquetas_dict, pesos_dict):
+        return self._consulta(vocabulario, n_cols, estadisticas, [(etiquetas_dict, pesos_dict)])
+
+    def puntuar(self, matriz, vocabulario, estadisticas, etiquetas_dict, pesos_dict, perfil=None):
+        if perfil is None:
+            perfil = self.perfil(vocabulario, matriz.shape[1], estadisticas, etiquetas_dict, pesos_dict)
+        return self._puntajes(matriz, estadisticas, *perfil)[:, 0]
+
+    def puntuar_lote(self, matriz, vocabulario, estadisticas, perfiles):
+        Q, maximos = self._consulta(vocabulario, matriz.shape[1], estadisticas, perfiles)
+        return self._puntajes(matriz, estadisticas, Q, maximos)
+
+    def _puntajes(self, matriz, estadisticas, Q, maximos):
+        saturacion = self._saturacion(matriz, estadisticas)
+        puntajes = (matriz @ Q.T).toarray()
+        puntajes *= saturacion[:, None]
+        return _dividir(puntajes, np.broadcast_to(maximos[None, :], puntajes.shape))
+
+
+MOTORES: Dict[str, Motor] = {m.nombre: m for m in (Coseno(), TfIdfCoseno(), BM25())}
+
+def motor(nombre: Optional[str] = None) -> Motor:
+    """El motor con ese nombre (None = RECOMENDACIONES_MOTOR). ValueError si no existe."""
+    nombre = nombre or MOTOR
+    if nombre not in MOTORES:
+        raise ValueError(f"Motor de recomendaciones desconocido: {nombre}")
+    return MOTORES[nombre]
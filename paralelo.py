@@ -0,0 +1,315 @@
+"""
+Puntuación repartida en varios procesos para catálogos enormes.
+
+IndiceEtiquetas puntúa con numpy en un solo hilo: un refresco masivo de
+recomendaciones_precalculadas o /recomendaciones sobre millones de mascotas
+ocupan un núcleo y el resto de la máquina queda libre. Con
+RECOMENDACIONES_PROCESOS > 0 se publica una copia compacta de la matriz (solo
+las filas activas) en memoria compartida, se parte en tramos contiguos de
+filas, uno por proceso, y cada proceso puntúa su tramo y devuelve solo su
+top-k local; acá se mezclan con seleccionar(). Las tareas llevan el nombre del
+segmento y los límites del tramo, nunca la matriz.
+
+La copia se rehace cuando cambia la versión del índice (O(nnz)), así que
+conviene con catálogos grandes: por debajo de RECOMENDACIONES_PARALELO_MIN_MASCOTAS
+se sigue puntuando en el proceso. La geo y la búsqueda aproximada se quedan
+siempre en el proceso.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np # type: ignore
+from scipy import sparse # type: ignore
+
+import motores
+import recomendaciones
+from motores import Estadisticas, etiquetas_adoptante
+
+PROCESOS = int(os.getenv("RECOMENDACIONES_PROCESOS", "0"))   # 0 = todo en el proceso
+MIN_MASCOTAS = int(os.getenv("RECOMENDACIONES_PARALELO_MIN_MASCOTAS", "200000"))
+
+
+def _vistas(buf, n: int, nnz: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(ids, indptr, datos, indices) sobre el buffer del segmento, sin copiar."""
+    ids = np.ndarray((n,), dtype=np.int64, buffer=buf, offset=0)
+    indptr = np.ndarray((n + 1,), dtype=np.int64, buffer=buf, offset=8 * n)
+    datos = np.ndarray((nnz,), dtype=np.float64, buffer=buf, offset=8 * (2 * n + 1))
+    indices = np.ndarray((nnz,), dtype=np.int32, buffer=buf, offset=8 * (2 * n + 1 + nnz))
+    return ids, indptr, datos, indices
+
+def _tamano(n: int, nnz: int) -> int:
+    return max(1, 8 * (2 * n + 1 + nnz) + 4 * nnz)
+
+
+class Publicacion:
+    """
+    Una versión del índice copiada a un segmento de memoria compartida.
+    `usos` cuenta los top()/puntuar_lote en curso que la tienen; reemplazada
+    pasa a True cuando hay una versión más nueva.
+    """
+
+    def __init__(self, indice: "recomendaciones.IndiceEtiquetas"):
+        self.usos = 0
+        self.reemplazada = False
+        self.version, ids, matriz, self.vocabulario, self.estadisticas = indice.filas_activas()
+        self.n, self.nnz, self.n_cols = matriz.shape[0], matriz.nnz, matriz.shape[1]
+
+        self.shm = shared_memory.SharedMemory(create=True, size=_tamano(self.n, self.nnz))
+        v_ids, v_indptr, v_datos, v_indices = _vistas(self.shm.buf, self.n, self.nnz)
+        v_ids[:] = ids
+        v_indptr[:] = matriz.indptr
+        v_datos[:] = 1.0
+        v_indices[:] = matriz.indices
+        del v_ids, v_indptr, v_datos, v_indices
+
+    def descriptor(self) -> Dict[str, Any]:
+        """Lo que viaja en cada tarea para encontrar la matriz."""
+        return {
+            "nombre": self.shm.name, "n": self.n, "nnz": self.nnz, "n_cols": self.n_cols,
+            "estadisticas": self.estadisticas,
+        }
+
+    def tramos(self, partes: int) -> List[Tuple[int, int]]:
+        limites = np.linspace(0, self.n, max(1, min(partes, self.n)) + 1).astype(int)
+        return [(int(a), int(b)) for a, b in zip(limites[:-1], limites[1:])]
+
+    def vocabulario_de(self, perfiles: Iterable[Tuple[Dict[str, Any], Dict[str, Any]]]) -> Dict[str, int]:
+        """Solo las columnas que miran estos perfiles: los motores no usan las demás."""
+        nombres = set()
+        for etiquetas, pesos in perfiles:
+            nombres.update(etiquetas_adoptante(etiquetas))
+            nombres.update(pesos)
+        return {t: self.vocabulario[t] for t in nombres if t in self.vocabulario}
+
+    def cerrar(self):
+        try:
+            self.shm.close()
+            self.shm.unlink()
+        except (FileNotFoundError, BufferError):
+            pass
+
+
+# ---------- lado del proceso hijo ----------
+
+# Segmento al que está pegado este proceso y las matrices de sus tramos
+_adjunto: Dict[str, Any] = {"nombre": None, "shm": None, "tramos": {}}
+
+def _tramo(desc: Dict[str, Any], inicio: int, fin: int) -> Tuple[np.ndarray, sparse.csr_matrix]:
+    """(ids, matriz) del tramo sobre el segmento compartido, sin copiar la matriz."""
+    if _adjunto["nombre"] != desc["nombre"]:
+        viejo = _adjunto["shm"]
+        _adjunto.update(nombre=None, shm=None, tramos={})   # suelta las vistas antes de cerrar
+        if viejo is not None:
+            try:
+                viejo.close()
+            except BufferError:
+                pass
+        _adjunto.update(nombre=desc["nombre"], shm=shared_memory.SharedMemory(name=desc["nombre"]))
+    tramos = _adjunto["tramos"]
+    if (inicio, fin) not in tramos:
+        ids, indptr, datos, indices = _vistas(_adjunto["shm"].buf, desc["n"], desc["nnz"])
+        a, b = int(indptr[inicio]), int(indptr[fin])
+        matriz = sparse.csr_matrix(
+            (datos[a:b], indices[a:b], indptr[inicio:fin + 1] - a),
+            shape=(fin - inicio, desc["n_cols"]),
+            copy=False,
+        )
+        tramos[(inicio, fin)] = (ids[inicio:fin], matriz)
+    return tramos[(inicio, fin)]
+
+def _top_tramo(
+    desc: Dict[str, Any],
+    inicio: int,
+    fin: int,
+    motor: Optional[str],
+    vocabulario: Dict[str, int],
+    perfiles: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+    excluir: List[Iterable[int]],
+    k: int,
+    despues: Optional[Tuple[float, int]] = None,
+    lote: bool = True,
+) -> List[Tuple[np.ndarray, np.ndarray, bool]]:
+    """Top-k local del tramo para cada perfil: (ids, similitudes redondeadas, quedan_mas)."""
+    ids, matriz = _tramo(desc, inicio, fin)
+    puntuador = motores.motor(motor)
+    estadisticas: Estadisticas = desc["estadisticas"]
+    if lote:
+        sims = puntuador.puntuar_lote(matriz, vocabulario, estadisticas, perfiles)
+    else:
+        sims = np.column_stack([
+            puntuador.puntuar(matriz, vocabulario, estadisticas, etiquetas, pesos) for etiquetas, pesos in perfiles
+        ])
+    np.round(sims, 4, out=sims)
+
+    resultado = []
+    for j in range(len(perfiles)):
+        ids_j, sims_j = ids, sims[:, j]
+        fuera = np.fromiter(excluir[j], dtype=np.int64) if excluir else ()
+        if len(fuera):
+            quedan = ~np.isin(ids, fuera)
+            ids_j, sims_j = ids[quedan], sims_j[quedan]
+        pagina, hay_mas = recomendaciones.seleccionar(ids_j, sims_j, k, despues)
+        resultado.append((ids_j[pagina].copy(), sims_j[pagina].copy(), hay_mas))
+    return resultado
+
+def _mezclar(partes: List[Tuple[np.ndarray, np.ndarray, bool]], k: int) -> Tuple[np.ndarray, np.ndarray, bool]:
+    ids = np.concatenate([p[0] for p in partes])
+    sims = np.concatenate([p[1] for p in partes])
+    pagina, recortado = recomendaciones.seleccionar(ids, sims, k)
+    return ids[pagina], sims[pagina], recortado or any(p[2] for p in partes)
+
+
+# ---------- lado del servidor ----------
+
+class PuntuadorParalelo:
+    """
+    Pool de procesos + la publicación vigente del índice. Las reemplazadas se
+    guardan mientras alguna llamada en curso las use (usos > 0): sus tareas
+    tienen que poder volver a pegarse al segmento aunque la versión haya
+    cambiado varias veces en el medio.
+    """
+
+    def __init__(self, procesos: int = PROCESOS, min_mascotas: int = MIN_MASCOTAS):
+        self.procesos = procesos
+        self.min_mascotas = min_mascotas
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._publicaciones: List[Publicacion] = []   # la vigente al final
+
+    def activo(self, indice: "recomendaciones.IndiceEtiquetas") -> bool:
+        return self.procesos > 0 and len(indice.fila_de) >= self.min_mascotas
+
+    def _preparar(self, indice) -> Tuple[ProcessPoolExecutor, Publicacion]:
+        """Pool y publicación vigente, ya contada como en uso: devolverla con _soltar."""
+        with self._lock:
+            if self._pool is None:
+                # spawn: el servidor tiene hilos y fork los copiaría a medias
+                self._pool = ProcessPoolExecutor(self.procesos, mp_context=multiprocessing.get_context("spawn"))
+            if not self._publicaciones or self._publicaciones[-1].version != indice.version:
+                for vieja in self._publicaciones:
+                    vieja.reemplazada = True
+                self._publicaciones.append(Publicacion(indice))
+                self._limpiar()
+            pub = self._publicaciones[-1]
+            pub.usos += 1
+            return self._pool, pub
+
+    def _soltar(self, pub: Publicacion):
+        with self._lock:
+            pub.usos -= 1
+            self._limpiar()
+
+    def _limpiar(self):
+        """Con el lock: cierra las reemplazadas que ya nadie usa."""
+        quedan = []
+        for pub in self._publicaciones:
+            if pub.reemplazada and pub.usos <= 0:
+                pub.cerrar()
+            else:
+                quedan.append(pub)
+        self._publicaciones = quedan
+
+    def top(
+        self,
+        indice: "recomendaciones.IndiceEtiquetas",
+        etiquetas_dict: Dict[str, Any],
+        pesos_dict: Dict[str, Any],
+        excluir: Iterable[int] = (),
+        k: int = 0,
+        despues: Optional[Tuple[float, int]] = None,
+        motor: Optional[str] = None,
+    ) -> Tuple[np.ndarray, np.ndarray, bool]:
+        """
+        Lo mismo que indice.puntuar + round(4) + seleccionar(k, despues), con
+        cada proceso puntuando un tramo. Devuelve (ids, similitudes, quedan_mas)
+        ya en orden.
+        """
+        pool, pub = self._preparar(indice)
+        try:
+            perfiles = [(etiquetas_dict, pesos_dict)]
+            vocabulario = pub.vocabulario_de(perfiles)
+            excluir = [list(excluir)]
+            futuros = [
+                pool.submit(_top_tramo, pub.descriptor(), a, b, motor, vocabulario, perfiles, excluir, k, despues, False)
+                for a, b in pub.tramos(self.procesos)
+            ]
+            return _mezclar([f.result()[0] for f in futuros], k)
+        finally:
+            self._soltar(pub)
+
+    def puntuar_lote(
+        self,
+        indice: "recomendaciones.IndiceEtiquetas",
+        perfiles: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+        excluir: Optional[List[Iterable[int]]] = None,
+        top_n: int = 0,
+        bloque: Optional[int] = None,
+        motor: Optional[str] = None,
+    ) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+        """
+        Como indice.puntuar_lote (mismos valores y orden) pero repartiendo cada
+        bloque de adoptantes entre los tramos. Se encolan dos bloques a la vez
+        para que los procesos no esperen a que se mezcle el anterior. Si el
+        modo no está activo para este índice, es indice.puntuar_lote tal cual.
+        """
+        if not self.activo(indice):
+            yield from indice.puntuar_lote(perfiles, excluir, top_n, bloque, motor=motor)
+            return
+        pool, pub = self._preparar(indice)
+        try:
+            yield from self._lote_publicado(pool, pub, perfiles, excluir, top_n, bloque, motor)
+        finally:
+            # también si quien itera corta antes (el generador se cierra)
+            self._soltar(pub)
+
+    def _lote_publicado(self, pool, pub, perfiles, excluir, top_n, bloque, motor):
+        desc, tramos = pub.descriptor(), pub.tramos(self.procesos)
+        # Los tramos suman pub.n filas: entre todos los procesos, el mismo presupuesto
+        bloque = recomendaciones.bloque_lote(pub.n, bloque)
+
+        def encolar(inicio: int):
+            trozo = perfiles[inicio:inicio + bloque]
+            fuera = [list(e) for e in excluir[inicio:inicio + bloque]] if excluir else None
+            vocabulario = pub.vocabulario_de(trozo)
+            return inicio, [
+                pool.submit(_top_tramo, desc, a, b, motor, vocabulario, trozo, fuera, top_n)
+                for a, b in tramos
+            ]
+
+        inicios = iter(range(0, len(perfiles), bloque))
+        en_curso = deque(encolar(i) for _, i in zip(range(2), inicios))
+        try:
+            while en_curso:
+                inicio, futuros = en_curso.popleft()
+                siguiente = next(inicios, None)
+                if siguiente is not None:
+                    en_curso.append(encolar(siguiente))
+                por_tramo = [f.result() for f in futuros]
+                for j in range(len(por_tramo[0])):
+                    ids, sims, _ = _mezclar([r[j] for r in por_tramo], top_n)
+                    yield inicio + j, ids, sims
+        finally:
+            # si se cortó antes: lo encolado no llega a pegarse a un segmento que se va a cerrar
+            for _, futuros in en_curso:
+                for f in futuros:
+                    f.cancel()
+
+    def cerrar(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+            for pub in self._publicaciones:
+                pub.cerrar()
+            self._publicaciones = []
+
+
+# Puntuador único del proceso (inactivo con RECOMENDACIONES_PROCESOS=0)
+puntuador = PuntuadorParalelo()
+atexit.register(puntuador.cerrar)
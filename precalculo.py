@@ -0,0 +1,180 @@
+"""
+Tabla recomendaciones_precalculadas y su refresco en segundo plano.
+
+Cada adoptante tiene guardado su top (RECOMENDACIONES_PRECALCULADAS_TOP filas)
+junto con la huella del catálogo con que se calculó. Una fila está vigente si
+su huella coincide con la actual (la del índice combinada con el motor de
+RECOMENDACIONES_MOTOR, ver huella_vigente); patch_etiquetas_pesos,
+crear_match y endpoint_denegar_match borran las filas del adoptante al
+cambiar sus datos. El refresco solo recalcula a los adoptantes sin filas
+vigentes.
+
+Limitación: la huella es una sola para todo el catálogo, así que cualquier
+alta, edición o adopción de una mascota deja viejas las filas de todos los
+adoptantes, aunque no cambie su top. Mientras el refresco no pasa, esos
+adoptantes vuelven al cálculo en línea (más lento, mismo resultado). Con un
+catálogo que cambia más seguido que RECOMENDACIONES_REFRESCO_SEGUNDOS, la
+tabla casi nunca está vigente. Invalidar por adoptante (solo aquellos cuyo
+top contiene o dejaría entrar a la mascota cambiada) queda pendiente.
+
+Con varios workers cada uno arranca su hilo de refresco, pero en Postgres
+solo corre el que toma el advisory lock REFRESCO_LOCK; los demás saltean esa
+vuelta. Si dos recalcularan los mismos adoptantes, el DELETE de uno no ve
+las filas que el otro acaba de insertar y el top queda duplicado.
+"""
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytz # type: ignore
+from sqlalchemy import exists, func, select # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+
+import etiquetado
+import models
+import motores
+import paralelo
+import recomendaciones
+from database import SessionLocal
+
+TOP = int(os.getenv("RECOMENDACIONES_PRECALCULADAS_TOP", "100"))
+INTERVALO_SEGUNDOS = int(os.getenv("RECOMENDACIONES_REFRESCO_SEGUNDOS", "0"))  # 0 = apagado
+BLOQUE = 500
+REFRESCO_LOCK = 0x646f67676f01   # clave de pg_try_advisory_lock para refrescar()
+
+P = models.RecomendacionPrecalculada
+
+# Cambiar de motor deja viejas las filas aunque el catálogo sea el mismo;
+# coseno aporta 0 para que sigan valiendo las filas de antes de que hubiera motores
+HUELLA_MOTOR = 0 if motores.MOTOR == "coseno" else int.from_bytes(
+    hashlib.blake2b(motores.MOTOR.encode(), digest_size=8).digest(), "big", signed=True
+)
+
+
+def huella_vigente() -> int:
+    return recomendaciones.indice.huella ^ HUELLA_MOTOR
+
+def invalidar(db: Session, adoptante_id: int):
+    """Borra el top guardado del adoptante (sin commit: va en la transacción de quien llama)."""
+    db.query(P).filter(P.adoptante_id == adoptante_id).delete(synchronize_session=False)
+
+def pendientes(db: Session, huella: int, despues_de: int = 0, limite: int = BLOQUE) -> List[int]:
+    """Adoptantes sin filas calculadas con el catálogo actual."""
+    vigente = exists().where(P.adoptante_id == models.Adoptante.id).where(P.huella_catalogo == huella)
+    filas = (
+        db.query(models.Adoptante.id)
+          .filter(models.Adoptante.id > despues_de)
+          .filter(~vigente)
+          .order_by(models.Adoptante.id)
+          .limit(limite)
+          .all()
+    )
+    return [f[0] for f in filas]
+
+def refrescar(db: Session, top_n: int = TOP) -> int:
+    """
+    Recalcula a todos los adoptantes pendientes, por bloques. Devuelve
+    cuántos; 0 sin hacer nada si en Postgres otro proceso ya está refrescando.
+    """
+    bind = db.get_bind()
+    if bind.dialect.name != "postgresql":
+        return _refrescar(db, top_n)
+    # Lock de sesión en una conexión aparte: la de `db` vuelve al pool en cada commit
+    with bind.connect() as conexion:
+        if not conexion.execute(select(func.pg_try_advisory_lock(REFRESCO_LOCK))).scalar():
+            conexion.rollback()
+            return 0
+        conexion.commit()
+        try:
+            return _refrescar(db, top_n)
+        finally:
+            conexion.execute(select(func.pg_advisory_unlock(REFRESCO_LOCK)))
+            conexion.commit()
+
+def _refrescar(db: Session, top_n: int) -> int:
+    indice = recomendaciones.indice
+    indice.asegurar(db)
+    huella = huella_vigente()
+
+    total, ultimo = 0, 0
+    while True:
+        ids = pendientes(db, huella, ultimo)
+        if not ids:
+            return total
+        ultimo = ids[-1]
+
+        ids, perfiles, excluir = recomendaciones.cargar_perfiles(db, ids)
+        ahora = datetime.now(pytz.utc)
+        filas = []
+        for j, mascota_ids, sims in paralelo.puntuador.puntuar_lote(indice, perfiles, excluir, top_n):
+            filas.extend(
+                {
+                    "adoptante_id": ids[j],
+                    "mascota_id": int(m),
+                    "similitud": float(s),
+                    "rango": rango,
+                    "calculado_en": ahora,
+                    "huella_catalogo": huella,
+                }
+                for rango, (m, s) in enumerate(zip(mascota_ids, sims))
+            )
+
+        db.query(P).filter(P.adoptante_id.in_(ids)).delete(synchronize_session=False)
+        if filas:
+            db.execute(P.__table__.insert(), filas)
+        db.commit()
+        total += len(ids)
+
+def leer(
+    db: Session,
+    adoptante_id: int,
+    top_n: int,
+    despues: Optional[Tuple[float, int]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Página del top guardado en dos consultas: las filas por el índice
+    (adoptante_id, huella_catalogo, rango) junto con sus mascotas, y después
+    las etiquetas de esas mascotas (etiquetado.de_mascotas). Si vienen menos
+    de top_n filas es que no hay filas vigentes o el cursor llegó al final
+    del top guardado.
+    """
+    query = (
+        db.query(models.Mascota, P.similitud)
+          .join(P, P.mascota_id == models.Mascota.id)
+          .filter(P.adoptante_id == adoptante_id)
+          .filter(P.huella_catalogo == huella_vigente())
+          .filter(recomendaciones.sin_adoptar())
+    )
+    if despues is not None:
+        sim0, id0 = despues
+        query = query.filter((P.similitud < sim0) | ((P.similitud == sim0) & (P.mascota_id > id0)))
+    filas = query.order_by(P.rango).limit(top_n).all()
+    tags = etiquetado.de_mascotas(db, [m.id for m, _ in filas], vacunas=False)
+    return [
+        {**recomendaciones.datos_mascota(m, tags.get(m.id, etiquetado.VACIO)["etiquetas"]), "similitud": similitud}
+        for m, similitud in filas
+    ]
+
+def iniciar_refresco(intervalo: int = INTERVALO_SEGUNDOS):
+    """Hilo de fondo que refresca la tabla cada `intervalo` segundos."""
+    if intervalo <= 0:
+        return
+
+    def bucle():
+        while True:
+            db = SessionLocal()
+            try:
+                n = refrescar(db)
+                if n:
+                    print(f"🔄 Recomendaciones precalculadas: {n} adoptantes")
+            except Exception as e:
+                db.rollback()
+                print(f"⚠️ Error refrescando recomendaciones precalculadas: {e}")
+            finally:
+                db.close()
+            time.sleep(intervalo)
+
+    threading.Thread(target=bucle, name="refresco-recomendaciones", daemon=True).start()
@@ -0,0 +1,576 @@
+"""
+Índice en memoria para /recomendaciones.
+
+Guarda el vocabulario de etiquetas y una matriz dispersa mascota x etiqueta
+(CSR binaria) de todo el catálogo disponible. Se construye una sola vez al
+arrancar la app y luego se parchea cuando cambia el catálogo (crear, editar,
+adoptar), así cada petición solo tiene que vectorizar al adoptante. Junto con
+la matriz se llevan las estadísticas del corpus que usan los motores tfidf y
+bm25 (ver motores.py).
+
+Ojo: el índice vive en el proceso. Con varios workers cada uno tiene el suyo
+y solo ve los cambios que pasan por él (o los que encuentra al reconstruir).
+"""
+import base64
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np # type: ignore
+from scipy import sparse # type: ignore
+from sklearn.preprocessing import MultiLabelBinarizer # type: ignore
+from sqlalchemy import and_, exists # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+
+import etiquetado
+import models
+import motores
+from aproximado import IndiceLSH
+from motores import Estadisticas, etiquetas_adoptante
+
+BUSQUEDA = os.getenv("RECOMENDACIONES_BUSQUEDA", "exacta")   # "exacta" o "aproximada"
+BLOQUE_LOTE = 256   # adoptantes por bloque de puntuar_lote, como máximo
+MEMORIA_LOTE = int(os.getenv("RECOMENDACIONES_LOTE_MB", "256")) * 1024 * 1024
+
+
+def bloque_lote(n_mascotas: int, maximo: Optional[int] = None) -> int:
+    """
+    Adoptantes por bloque para que las dos matrices densas float64
+    (mascotas x bloque) que arma un motor entren en MEMORIA_LOTE: con un
+    millón de mascotas son 16 por bloque y no 256 (~4 GB).
+    """
+    return max(1, min(maximo or BLOQUE_LOTE, MEMORIA_LOTE // (2 * 8 * max(1, n_mascotas))))
+
+
+def construir_matriz_tags(
+    adoptante_tag_dict: Dict[str, Any],
+    mascotas: List[Dict[str, Any]],
+) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    Cálculo original de /recomendaciones (vocabulario y matriz densa armados
+    en cada petición). Ya no se usa al servir; queda como referencia de los
+    valores que debe dar el índice y como línea base en benchmarks/.
+    """
+    adoptante_tags = etiquetas_adoptante(adoptante_tag_dict)
+    lista_tags_mascotas = [m["tags"] for m in mascotas]
+
+    mlb = MultiLabelBinarizer()
+    mlb.fit([adoptante_tags] + lista_tags_mascotas)
+
+    vector_adoptante = mlb.transform([adoptante_tags])[0]
+    vectores_mascotas = mlb.transform(lista_tags_mascotas)
+
+    return mlb.classes_.tolist(), vector_adoptante, vectores_mascotas
+
+def datos_mascota(m, tags: List[str]) -> Dict[str, Any]:
+    """Lo que devuelve /recomendaciones por cada mascota (sin la similitud); tags de etiquetado."""
+    return {
+        "id": m.id,
+        "nombre": m.nombre,
+        "especie": m.especie,
+        "edad_valor": m.edad_valor,
+        "edad_unidad": m.edad_unidad,
+        "descripcion": m.descripcion,
+        "albergue_id": m.albergue_id,
+        "imagen_id": m.imagen_id,
+        "tags": list(tags),
+    }
+
+# Lo único que se lee de mascotas para el índice (datos_mascota acepta estas filas;
+# las etiquetas vienen aparte de etiquetado.de_mascotas)
+COLUMNAS_MASCOTA = (
+    models.Mascota.id,
+    models.Mascota.nombre,
+    models.Mascota.especie,
+    models.Mascota.edad_valor,
+    models.Mascota.edad_unidad,
+    models.Mascota.descripcion,
+    models.Mascota.albergue_id,
+    models.Mascota.imagen_id,
+)
+
+def sin_adoptar():
+    """
+    La regla de "se puede recomendar o buscar", como filtro SQL: ni marcada
+    "Adoptado" ni con fila en adopciones. Las adopciones van como NOT EXISTS
+    correlacionado (anti-join por ix_adopciones_mascota), no como lista de ids
+    armada en Python. La usan este módulo, busqueda y precalculo.
+    """
+    return and_(
+        models.Mascota.estado != "Adoptado",
+        ~exists().where(models.Adopcion.mascota_id == models.Mascota.id),
+    )
+
+def disponible(mascota) -> bool:
+    """
+    La misma regla para una mascota ya cargada, al parchear los índices. Las
+    filas de COLUMNAS_MASCOTA (importación) no traen la relación: son mascotas
+    recién creadas, sin adopción.
+    """
+    return mascota.estado != "Adoptado" and getattr(mascota, "adopcion", None) is None
+
+def consulta_disponibles(db: Session):
+    """Mascotas que se pueden recomendar (sin_adoptar), solo con COLUMNAS_MASCOTA."""
+    return db.query(*COLUMNAS_MASCOTA).filter(sin_adoptar())
+
+def excluidas(db: Session, adoptante_id: int) -> set:
+    """
+    Mascotas que no se le recomiendan al adoptante: las denegadas y las que ya
+    tienen match con él. Una sola consulta que se resuelve con los índices
+    (adoptante_id, mascota_id) de denegaciones y matches, sin tocar mascotas.
+    """
+    denegadas = db.query(models.Denegacion.mascota_id).filter(models.Denegacion.adoptante_id == adoptante_id)
+    con_match = db.query(models.Match.mascota_id).filter(models.Match.adoptante_id == adoptante_id)
+    return {m for (m,) in denegadas.union(con_match)}
+
+def huella_fila(datos: Dict[str, Any]) -> int:
+    """
+    Hash estable (entre procesos y reinicios) de lo que cuenta para puntuar una
+    mascota. El índice guarda el XOR de todas: así `huella` identifica el
+    catálogo entero y se actualiza en O(1) al agregar o quitar una fila.
+    """
+    crudo = json.dumps([datos["id"], sorted(t for t in datos["tags"] if isinstance(t, str))]).encode()
+    return int.from_bytes(hashlib.blake2b(crudo, digest_size=8).digest(), "big", signed=True)
+
+
+class IndiceEtiquetas:
+    """
+    Vocabulario + matriz CSR mascota x etiqueta mantenida de forma incremental.
+
+    Las filas se agregan al final de buffers que crecen al doble; editar una
+    mascota marca su fila vieja como inactiva y agrega una nueva, y adoptarla
+    solo la marca como inactiva. Cuando las filas inactivas pasan de la mitad
+    se compacta todo. La frecuencia de documento de cada columna y el total de
+    etiquetas de las filas activas se ajustan en cada alta y baja de fila.
+    """
+
+    def __init__(self, capacidad: int = 1024):
+        self._lock = threading.RLock()
+        self.construido = False
+        self.version = 0   # sube con cada cambio del catálogo
+        self.lsh = IndiceLSH()   # candidatas para la búsqueda aproximada (se arma con la primera)
+        self.lsh_construido = False
+        self._reset(capacidad)
+
+    def _reset(self, capacidad: int):
+        self.vocabulario: Dict[str, int] = {}      # etiqueta -> columna
+        self.etiquetas: List[str] = []             # columna -> etiqueta
+        self.fila_de: Dict[int, int] = {}          # mascota_id -> fila activa
+        self.datos: Dict[int, Dict[str, Any]] = {} # mascota_id -> datos públicos
+        self._ids = np.zeros(capacidad, dtype=np.int64)
+        self._albergues = np.zeros(capacidad, dtype=np.int64)   # albergue de cada fila (-1 = ninguno)
+        self._activa = np.zeros(capacidad, dtype=bool)
+        self._indptr = np.zeros(capacidad + 1, dtype=np.int64)
+        self._indices = np.zeros(capacidad * 4, dtype=np.int32)
+        self._unos = np.ones(capacidad * 4, dtype=np.float64)      # datos de la CSR (binaria)
+        self._fila_por_id = np.full(capacidad, -1, dtype=np.int64) # mascota_id -> fila, vectorizado
+        self._n_filas = 0
+        self._nnz = 0
+        self._inactivas = 0
+        self._df = np.zeros(64, dtype=np.int64)   # columna -> nº de filas activas con esa etiqueta
+        self._nnz_activo = 0                      # etiquetas de las filas activas
+        self.huella = 0   # XOR de huella_fila() de las mascotas activas
+
+    # ---------- construcción ----------
+
+    def construir(self, db: Session):
+        """Carga todas las mascotas disponibles (no adoptadas) desde la BD."""
+        disponibles = consulta_disponibles(db)
+        mascotas = disponibles.order_by(models.Mascota.id).all()
+        tags = etiquetado.de_mascotas(db, disponibles.with_entities(models.Mascota.id), vacunas=False)
+        self.cargar([datos_mascota(m, tags.get(m.id, etiquetado.VACIO)["etiquetas"]) for m in mascotas])
+
+    def cargar(self, mascotas: List[Dict[str, Any]]):
+        """Reemplaza todo el índice por estas mascotas (dicts como los de datos_mascota)."""
+        with self._lock:
+            self._reset(max(1024, len(mascotas)))
+            self.lsh.reset()
+            self.lsh_construido = False
+            for datos in mascotas:
+                self._agregar_fila(datos)
+            self.construido = True
+            self.version += 1
+
+    def asegurar(self, db: Session):
+        if not self.construido:
+            self.construir(db)
+
+    # ---------- parches ----------
+
+    def agregar(self, mascota, tags: List[str]):
+        self.actualizar(mascota, tags)
+
+    def actualizar(self, mascota, tags: List[str]):
+        """Refleja en el índice el estado actual de una mascota ya guardada (con sus etiquetas)."""
+        with self._lock:
+            if not self.construido:
+                return
+            self._quitar_fila(mascota.id)
+            if disponible(mascota):
+                self._agregar_fila(datos_mascota(mascota, tags))
+            self.version += 1
+
+    def quitar(self, mascota_id: int):
+        with self._lock:
+            if not self.construido:
+                return
+            self._quitar_fila(mascota_id)
+            self.version += 1
+
+    def _columna(self, etiqueta: str) -> int:
+        col = self.vocabulario.get(etiqueta)
+        if col is None:
+            col = len(self.etiquetas)
+            self.vocabulario[etiqueta] = col
+            self.etiquetas.append(etiqueta)
+        return col
+
+    def _agregar_fila(self, datos: Dict[str, Any], lsh: bool = True):
+        cols = sorted({self._columna(t) for t in datos["tags"] if isinstance(t, str)})
+        if lsh and self.lsh_construido:
+            self.lsh.agregar(datos["id"], cols)
+        fila = self._n_filas
+
+        if len(self.etiquetas) > len(self._df):
+            extra = max(len(self.etiquetas), len(self._df) * 2) - len(self._df)
+            self._df = np.concatenate([self._df, np.zeros(extra, dtype=np.int64)])
+        self._df[cols] += 1
+        self._nnz_activo += len(cols)
+
+        if fila == len(self._ids):
+            nueva = len(self._ids) * 2
+            self._ids = np.resize(self._ids, nueva)
+            self._albergues = np.resize(self._albergues, nueva)
+            self._activa = np.resize(self._activa, nueva)
+            self._indptr = np.resize(self._indptr, nueva + 1)
+        fin = self._nnz + len(cols)
+        if fin > len(self._indices):
+            self._indices = np.resize(self._indices, max(fin, len(self._indices) * 2))
+            self._unos = np.ones(len(self._indices), dtype=np.float64)
+
+        self._indices[self._nnz:fin] = cols
+        self._nnz = fin
+        self._indptr[fila + 1] = fin
+        self._ids[fila] = datos["id"]
+        self._albergues[fila] = datos["albergue_id"] if datos["albergue_id"] is not None else -1
+        self._activa[fila] = True
+        self._n_filas += 1
+
+        self.fila_de[datos["id"]] = fila
+        if datos["id"] >= len(self._fila_por_id):
+            extra = max(datos["id"] + 1, len(self._fila_por_id) * 2) - len(self._fila_por_id)
+            self._fila_por_id = np.concatenate([self._fila_por_id, np.full(extra, -1, dtype=np.int64)])
+        self._fila_por_id[datos["id"]] = fila
+        self.datos[datos["id"]] = datos
+        self.huella ^= huella_fila(datos)
+
+    def _quitar_fila(self, mascota_id: int):
+        fila = self.fila_de.pop(mascota_id, None)
+        if fila is not None:
+            self._fila_por_id[mascota_id] = -1
+        datos = self.datos.pop(mascota_id, None)
+        if fila is None:
+            return
+        self.huella ^= huella_fila(datos)
+        self.lsh.quitar(mascota_id)
+        cols = self._indices[self._indptr[fila]:self._indptr[fila + 1]]
+        self._df[cols] -= 1
+        self._nnz_activo -= len(cols)
+        self._activa[fila] = False
+        self._inactivas += 1
+        if self._inactivas * 2 > self._n_filas:
+            self._compactar()
+
+    def _compactar(self):
+        datos = [self.datos[i] for i in self._ids[:self._n_filas][self._activa[:self._n_filas]]]
+        vocabulario, etiquetas = self.vocabulario, self.etiquetas
+        self._reset(max(1024, len(datos)))
+        # el vocabulario no se encoge: así las columnas ya vistas no cambian
+        self.vocabulario, self.etiquetas = vocabulario, etiquetas
+        for d in datos:
+            self._agregar_fila(d, lsh=False)   # las mismas mascotas: el LSH no cambia
+
+    def _asegurar_lsh(self):
+        """
+        Firmas MinHash de las filas activas. Cuestan ~0.2 ms por mascota, así
+        que solo se calculan si alguien pide la búsqueda aproximada; desde ahí
+        se mantienen con cada parche.
+        """
+        if self.lsh_construido:
+            return
+        self.lsh.reset()
+        for fila in np.flatnonzero(self._activa[:self._n_filas]):
+            self.lsh.agregar(int(self._ids[fila]), self._indices[self._indptr[fila]:self._indptr[fila + 1]])
+        self.lsh_construido = True
+
+    # ---------- consulta ----------
+
+    def instantanea(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, sparse.csr_matrix, Dict[str, int]]:
+        """
+        (ids, albergues, activa, matriz, vocabulario) consistentes entre sí.
+        Los buffers solo se escriben más allá de n_filas/nnz o se reemplazan,
+        así que las vistas devueltas no cambian aunque el índice se parchee después.
+        """
+        with self._lock:
+            n, nnz = self._n_filas, self._nnz
+            matriz = sparse.csr_matrix(
+                (self._unos[:nnz], self._indices[:nnz], self._indptr[:n + 1]),
+                shape=(n, len(self.etiquetas)),
+                copy=False,
+            )
+            return self._ids[:n], self._albergues[:n], self._activa[:n].copy(), matriz, dict(self.vocabulario)
+
+    def filas_activas(self) -> Tuple[int, np.ndarray, sparse.csr_matrix, Dict[str, int], Estadisticas]:
+        """(version, ids, matriz, vocabulario, estadisticas) con solo las filas activas (copia compacta)."""
+        with self._lock:
+            version = self.version
+            ids, _, activa, matriz, vocabulario = self.instantanea()
+            estadisticas = self.estadisticas()
+        filas = np.flatnonzero(activa)
+        return version, ids[filas], matriz[filas], vocabulario, estadisticas
+
+    def estadisticas(self) -> Estadisticas:
+        """Estadísticas del corpus activo, del mismo ancho que la matriz de instantanea()."""
+        with self._lock:
+            n_docs = len(self.fila_de)
+            return Estadisticas(
+                n_docs=n_docs,
+                df=self._df[:len(self.etiquetas)].copy(),
+                longitud_media=self._nnz_activo / n_docs if n_docs else 0.0,
+            )
+
+    def puntuar(
+        self,
+        etiquetas_dict: Dict[str, Any],
+        pesos_dict: Dict[str, Any],
+        excluir: Iterable[int] = (),
+        albergues: Optional[Iterable[int]] = None,
+        aproximada: bool = False,
+        motor: Optional[str] = None,
+        perfil: Any = None,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Similitud del adoptante contra cada mascota disponible según `motor`
+        (ver motores.py; None = RECOMENDACIONES_MOTOR). Con "coseno" da los
+        mismos valores que construir_matriz_tags + cosine_similarity.
+        `perfil` es el de Motor.perfil del mismo adoptante, si ya se armó.
+        Si se pasan `albergues`, solo se consideran mascotas de esos albergues
+        (el recorte se hace antes de cualquier cálculo).
+        Con `aproximada` solo se puntúan las candidatas del LSH (ver aproximado.py).
+        Devuelve (ids, similitudes, albergue_ids) de las mascotas que quedan.
+        """
+        puntuador = motores.motor(motor)
+        with self._lock:
+            ids, albergue_ids, activa, matriz, vocabulario = self.instantanea()
+            estadisticas = self.estadisticas()
+            if aproximada:
+                self._asegurar_lsh()
+                cols = [vocabulario[t] for t in set(etiquetas_adoptante(etiquetas_dict)) if t in vocabulario]
+                candidatas = self.lsh.candidatas(cols)
+                filas = self._fila_por_id[np.fromiter(candidatas, dtype=np.int64, count=len(candidatas))]
+                filas.sort()
+            else:
+                filas = np.arange(len(ids))
+
+        excluir = np.fromiter(excluir, dtype=np.int64)
+        if len(excluir):
+            filas = filas[~np.isin(ids[filas], excluir)]
+        if albergues is not None:
+            filas = filas[np.isin(albergue_ids[filas], np.fromiter(albergues, dtype=np.int64))]
+        filas = filas[activa[filas]]
+        if len(filas) == 0:
+            return ids[:0], np.zeros(0), albergue_ids[:0]
+
+        sims = puntuador.puntuar(matriz[filas], vocabulario, estadisticas, etiquetas_dict, pesos_dict, perfil)
+        return ids[filas], sims, albergue_ids[filas]
+
+    def puntuar_lote(
+        self,
+        perfiles: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+        excluir: Optional[List[Iterable[int]]] = None,
+        top_n: int = 0,
+        bloque: Optional[int] = None,
+        motor: Optional[str] = None,
+    ) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+        """
+        Top-n de muchos adoptantes con un solo recorrido del catálogo.
+        `perfiles` son (etiquetas, pesos) de cada adoptante y `excluir` la lista
+        paralela de mascotas excluidas. Se calcula por bloques de adoptantes
+        (bloque_lote según el tamaño del catálogo; `bloque` es el tope) para
+        acotar la memoria y se va generando (posición, ids, similitudes)
+        con la similitud redondeada y en el mismo orden que /recomendaciones.
+        """
+        puntuador = motores.motor(motor)
+        with self._lock:
+            ids, _, activa, matriz, vocabulario = self.instantanea()
+            estadisticas = self.estadisticas()
+        filas = np.flatnonzero(activa)
+        ids, matriz = ids[filas], matriz[filas]
+        bloque = bloque_lote(len(ids), bloque)
+
+        for inicio in range(0, len(perfiles), bloque):
+            sims = puntuador.puntuar_lote(matriz, vocabulario, estadisticas, perfiles[inicio:inicio + bloque])
+            np.round(sims, 4, out=sims)   # sin otra copia del bloque
+            for j in range(sims.shape[1]):
+                ids_j, sims_j = ids, sims[:, j]
+                denegadas = np.fromiter(excluir[inicio + j], dtype=np.int64) if excluir else ()
+                if len(denegadas):
+                    quedan = ~np.isin(ids, denegadas)
+                    ids_j, sims_j = ids[quedan], sims_j[quedan]
+                pagina, _ = seleccionar(ids_j, sims_j, top_n)
+                yield inicio + j, ids_j[pagina], sims_j[pagina]
+
+
+def cargar_perfiles(
+    db: Session,
+    adoptante_ids: Optional[List[int]] = None,
+) -> Tuple[List[int], List[Tuple[Dict[str, Any], Dict[str, Any]]], List[set]]:
+    """
+    Perfiles (etiquetas, pesos) y mascotas excluidas (ver excluidas()) de varios
+    adoptantes (None = todos) con una consulta por tabla, listos para
+    IndiceEtiquetas.puntuar_lote.
+    """
+    query = db.query(models.Adoptante.id)
+    if adoptante_ids is not None:
+        query = query.filter(models.Adoptante.id.in_(adoptante_ids))
+    ids = [a_id for (a_id,) in query.order_by(models.Adoptante.id)]
+    guardados = etiquetado.de_adoptantes(db, adoptante_ids)
+
+    denegadas = db.query(models.Denegacion.adoptante_id, models.Denegacion.mascota_id)
+    con_match = db.query(models.Match.adoptante_id, models.Match.mascota_id)
+    if adoptante_ids is not None:
+        denegadas = denegadas.filter(models.Denegacion.adoptante_id.in_(adoptante_ids))
+        con_match = con_match.filter(models.Match.adoptante_id.in_(adoptante_ids))
+    excluidas_de: Dict[int, set] = {}
+    for a_id, m_id in denegadas.union_all(con_match):
+        excluidas_de.setdefault(a_id, set()).add(m_id)
+
+    perfiles = [guardados.get(a_id, ({}, {})) for a_id in ids]
+    excluir = [excluidas_de.get(a_id, set()) for a_id in ids]
+    return ids, perfiles, excluir
+
+
+# ---------- selección top-k y cursor ----------
+
+def seleccionar(
+    ids: np.ndarray,
+    sims: np.ndarray,
+    k: int = 0,
+    despues: Optional[Tuple[float, int]] = None,
+) -> Tuple[np.ndarray, bool]:
+    """
+    Posiciones de las k mejores mascotas en orden (similitud desc, id asc),
+    sin ordenar el arreglo completo: argpartition + orden de solo k elementos.
+    `despues` = (similitud, id) de la última mascota de la página anterior.
+    k=0 devuelve todas. También dice si quedan más después de la página.
+    """
+    posiciones = np.arange(len(ids))
+    if despues is not None:
+        sim0, id0 = despues
+        resto = (sims < sim0) | ((sims == sim0) & (ids > id0))
+        posiciones = posiciones[resto]
+
+    n = len(posiciones)
+    if k and k < n:
+        s = sims[posiciones]
+        umbral = np.partition(s, n - k)[n - k]   # k-ésima similitud más alta
+        mayores = posiciones[s > umbral]
+        empates = posiciones[s == umbral]
+        faltan = k - len(mayores)
+        if faltan < len(empates):
+            empates = empates[np.argpartition(ids[empates], faltan - 1)[:faltan]]
+        posiciones = np.concatenate([mayores, empates])
+
+    orden = np.lexsort((ids[posiciones], -sims[posiciones]))
+    return posiciones[orden], bool(k) and k < n
+
+def codificar_cursor(similitud: float, mascota_id: int) -> str:
+    crudo = json.dumps([similitud, mascota_id]).encode()
+    return base64.urlsafe_b64encode(crudo).decode().rstrip("=")
+
+def decodificar_cursor(cursor: str) -> Tuple[float, int]:
+    """ValueError si el cursor no es uno de los que entregamos."""
+    try:
+        crudo = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        similitud, mascota_id = json.loads(crudo)
+        return float(similitud), int(mascota_id)
+    except Exception:
+        raise ValueError("Cursor inválido")
+
+
+# ---------- caché de resultados ----------
+
+class CacheRecomendaciones:
+    """
+    LRU de respuestas de /recomendaciones.
+
+    La clave lleva la versión del perfil del adoptante, la de sus mascotas
+    excluidas y la del catálogo, así que nunca hay que borrar nada: cuando algo
+    cambia se sube la versión (patch_etiquetas_pesos, crear_match,
+    endpoint_denegar_match, el índice) y
+    las entradas viejas simplemente dejan de pedirse hasta que el LRU las saca.
+    Como el índice, es por proceso.
+    """
+
+    def __init__(self, indice: IndiceEtiquetas, max_entradas: int = 10000):
+        self._lock = threading.Lock()
+        self._indice = indice
+        self._entradas: "OrderedDict[tuple, Any]" = OrderedDict()
+        self.max_entradas = max_entradas
+        self.version_perfil: Dict[int, int] = {}
+        self.version_excluidas: Dict[int, int] = {}
+        self.aciertos = 0
+        self.fallos = 0
+
+    def clave(self, adoptante_id: int, *extra) -> tuple:
+        """Se arma ANTES de calcular: si algo cambia a mitad, se guarda con la clave vieja."""
+        return (
+            adoptante_id,
+            self.version_perfil.get(adoptante_id, 0),
+            self.version_excluidas.get(adoptante_id, 0),
+            self._indice.version,
+            *extra,
+        )
+
+    def obtener(self, clave: tuple):
+        with self._lock:
+            valor = self._entradas.get(clave)
+            if valor is None:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return valor
+
+    def guardar(self, clave: tuple, valor):
+        with self._lock:
+            self._entradas[clave] = valor
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def perfil_cambiado(self, adoptante_id: int):
+        with self._lock:
+            self.version_perfil[adoptante_id] = self.version_perfil.get(adoptante_id, 0) + 1
+
+    def excluidas_cambiaron(self, adoptante_id: int):
+        with self._lock:
+            self.version_excluidas[adoptante_id] = self.version_excluidas.get(adoptante_id, 0) + 1
+
+    def estadisticas(self) -> Dict[str, Any]:
+        total = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "ratio_aciertos": round(self.aciertos / total, 4) if total else 0.0,
+            "entradas": len(self._entradas),
+            "max_entradas": self.max_entradas,
+        }
+
+
+# Índice y caché únicos del proceso
+indice = IndiceEtiquetas()
+cache = CacheRecomendaciones(indice, int(os.getenv("RECOMENDACIONES_CACHE_MAX", "10000")))
@@ -1,6 +1,6 @@
-from pydantic import BaseModel, EmailStr # type: ignore
-from typing import Optional, List, Dict, Union
-import json
+from pydantic import BaseModel, EmailStr, Field # type: ignore
+from typing import Optional, List, Dict, Union, Literal
+from datetime import datetime
 
 # === REGISTRO DE USUARIOS ===
 class AdoptanteRegister(BaseModel):
@@ -53,16 +53,8 @@ class AdoptanteOut(BaseModel):
         from_attributes = True
 
     @classmethod
-    def from_orm_with_etiquetas(cls, adoptante_obj):
-        try:
-            etiquetas = json.loads(adoptante_obj.etiquetas) if adoptante_obj.etiquetas else {}
-        except:
-            etiquetas = {}
-        # parseamos pesos
-        try:
-            pesos = json.loads(adoptante_obj.pesos) if adoptante_obj.pesos else {}
-        except:
-            pesos = {}
+    def from_orm_with_etiquetas(cls, adoptante_obj, etiquetas: Dict, pesos: Dict):
+        # etiquetas y pesos vienen de etiquetado.de_adoptante (tablas normalizadas)
         return cls(
             id=adoptante_obj.id,
             nombre=adoptante_obj.nombre,
@@ -134,6 +126,24 @@ class MascotaUpdate(BaseModel):
     vacunas: List[str] = []  # NUEVO CAMPO
 
 
+class FiltrosMascotas(BaseModel):
+    """Query params de GET /mascotas y /mascotas/albergue/{id} (con Depends())."""
+    especie: Optional[str] = None
+    genero: Optional[str] = None
+    estado: Optional[str] = None
+    albergue_id: Optional[int] = None
+    edad_min_meses: Optional[int] = None   # edad normalizada (models.EDAD_MESES)
+    edad_max_meses: Optional[int] = None
+    # Paginación keyset: sin limit vienen todas; si hay más, X-Siguiente-Pagina
+    # trae los after_* de la siguiente página
+    orden: Literal["id", "recientes"] = "id"   # recientes = created_at desc, id desc
+    limit: Optional[int] = Field(None, ge=1)   # 422 si es 0 o negativo
+    after_id: Optional[int] = None
+    after_created_at: Optional[datetime] = None
+    # Campos a devolver separados por coma (?fields=id,nombre,imagen_id); sin él, todos
+    fields: Optional[str] = None
+
+
 # === OUTPUT DEL ALBERGUE ===
 class AlbergueOut(BaseModel):
     id: int
@@ -298,4 +308,11 @@ class MatchTotalSimpleOut(BaseModel):
     fecha: datetime
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+# === RECOMENDACIONES ===
+class RecomendacionesLote(BaseModel):
+    adoptante_ids: Union[List[int], Literal["todos"]] = "todos"
+    top_n: int = 20
+    motor: Optional[Literal["coseno", "tfidf", "bm25"]] = None   # None = RECOMENDACIONES_MOTOR
@@ -0,0 +1,178 @@
+"""
+Camino rápido para serializar mascotas en los listados.
+
+Armar un schemas.MascotaResponse por fila y dejar que FastAPI lo valide otra
+vez contra response_model y lo re-codifique cuesta más que la consulta misma
+en listados grandes. Acá se leen tuplas Core con solo las columnas de la
+respuesta, las etiquetas llegan ya como listas de etiquetado.de_mascotas y el
+JSON se arma de una vez (orjson si está instalado; si no, json con los mismos
+parámetros que JSONResponse). Los endpoints devuelven RespuestaJSON y FastAPI
+la entrega tal cual; el response_model queda para la documentación.
+
+Con ?fields= (elegir) el SELECT lleva solo las columnas pedidas y las
+etiquetas/vacunas se consultan solo si se pidieron; lo demás nunca sale de
+la BD.
+"""
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import Response # type: ignore
+
+import etiquetado
+import models
+
+try:
+    import orjson # type: ignore
+except ImportError:
+    orjson = None
+
+M = models.Mascota
+
+# Lo que lleva schemas.MascotaResponse, salvo etiquetas/vacunas
+COLUMNAS_MASCOTA = (
+    M.id, M.nombre, M.edad_valor, M.edad_unidad, M.especie, M.descripcion,
+    M.albergue_id, M.imagen_id, M.created_at, M.genero, M.estado,
+)
+# Campos de MascotaResponse en su orden; etiquetas/vacunas salen de etiquetado
+CAMPOS_MASCOTA = (
+    "id", "nombre", "edad_valor", "edad_unidad", "especie", "descripcion", "albergue_id",
+    "imagen_id", "etiquetas", "vacunas", "created_at", "genero", "estado",
+)
+CAMPOS_ETIQUETAS = ("etiquetas", "vacunas")
+
+# Ruta en la respuesta -> columna, para anidar()
+A = models.Adoptante
+CAMPOS_MATCH_ALBERGUE = {
+    "adoptante.id": A.id,
+    "adoptante.nombre": A.nombre,
+    "adoptante.imagen_perfil_id": A.imagen_perfil_id,
+    "mascota.id": M.id,
+    "mascota.nombre": M.nombre,
+    "mascota.imagen_id": M.imagen_id,
+    "fecha": models.Match.fecha,
+}
+CAMPOS_ADOPCION_ALBERGUE = {
+    "id": models.Adopcion.id,
+    "mascota.id": M.id,
+    "mascota.nombre": M.nombre,
+    "mascota.imagen_id": M.imagen_id,
+    "adoptante_id": models.Adopcion.adoptante_id,
+    "fecha": models.Adopcion.fecha,
+}
+
+
+def elegir(disponibles: Sequence[str], fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """
+    Campos de ?fields= (separados por coma) en el orden de `disponibles`; None
+    si no se pidió nada (= todos). Un nombre elige también sus rutas con punto
+    ("mascota" = "mascota.id", "mascota.nombre", ...). ValueError si alguno no existe.
+    """
+    if not fields:
+        return None
+    pedidos = {c.strip() for c in fields.split(",") if c.strip()}
+    if not pedidos:
+        return None
+    elegidos = tuple(d for d in disponibles if d in pedidos or d.split(".", 1)[0] in pedidos)
+    desconocidos = pedidos - set(disponibles) - {d.split(".", 1)[0] for d in disponibles}
+    if desconocidos:
+        raise ValueError(f"Campos desconocidos en fields: {', '.join(sorted(desconocidos))}")
+    return elegidos
+
+def columnas_mascota(campos: Optional[Sequence[str]], extra: Sequence[str] = ()) -> tuple:
+    """
+    SELECT para estos campos: id primero (hace falta para etiquetas y páginas),
+    después los pedidos y al final `extra` (p. ej. created_at para el cursor).
+    """
+    if campos is None:
+        return COLUMNAS_MASCOTA
+    nombres = ["id"] + [c for c in campos if c != "id" and c not in CAMPOS_ETIQUETAS]
+    nombres += [e for e in extra if e not in nombres]
+    return tuple(getattr(M, n) for n in nombres)
+
+def con_etiquetas(campos: Optional[Sequence[str]]) -> Tuple[bool, bool]:
+    """(hacen falta etiquetas, hacen falta vacunas) para estos campos."""
+    if campos is None:
+        return True, True
+    return "etiquetas" in campos, "vacunas" in campos
+
+
+def fecha_iso(valor) -> str:
+    return valor.isoformat() if isinstance(valor, datetime) else str(valor)
+
+def mascota(fila, tags: Dict[str, List[str]]) -> Dict[str, Any]:
+    """Dict con la forma y el orden de schemas.MascotaResponse para una fila de COLUMNAS_MASCOTA."""
+    # Desempaquetar la tupla es varias veces más rápido que fila.<columna> en Row
+    id_, nombre, edad_valor, edad_unidad, especie, descripcion, albergue_id, imagen_id, created_at, genero, estado = fila
+    return {
+        "id": id_,
+        "nombre": nombre,
+        "edad_valor": edad_valor,
+        "edad_unidad": edad_unidad,
+        "especie": especie,
+        "descripcion": descripcion,
+        "albergue_id": albergue_id,
+        "imagen_id": imagen_id,
+        "etiquetas": tags["etiquetas"],
+        "vacunas": tags["vacunas"],
+        "created_at": created_at.isoformat() if isinstance(created_at, datetime) else str(created_at),
+        "genero": genero,
+        "estado": estado,
+    }
+
+def mascotas(
+    filas: Iterable,
+    tags: Dict[int, Dict[str, List[str]]],
+    campos: Optional[Sequence[str]] = None,
+) -> List[Dict[str, Any]]:
+    """Filas de columnas_mascota(campos) -> dicts con solo esos campos (None = MascotaResponse completo)."""
+    vacio = etiquetado.VACIO
+    if campos is None:
+        return [mascota(f, tags.get(f[0], vacio)) for f in filas]
+
+    # posición de cada campo en la fila (None = etiquetas/vacunas), como en columnas_mascota
+    posiciones = {"id": 0}
+    for c in campos:
+        if c not in posiciones and c not in CAMPOS_ETIQUETAS:
+            posiciones[c] = len(posiciones)
+    plan = [(c, posiciones.get(c)) for c in campos]
+    fecha = "created_at" in campos
+    resultado = []
+    for f in filas:
+        t = tags.get(f[0], vacio)
+        d = {c: f[i] if i is not None else t[c] for c, i in plan}
+        if fecha:
+            d["created_at"] = fecha_iso(d["created_at"])
+        resultado.append(d)
+    return resultado
+
+
+def anidar(filas: Iterable, rutas: Sequence[str]) -> List[Dict[str, Any]]:
+    """
+    Filas con una columna por ruta ("mascota.nombre", "fecha") -> dicts
+    anidados; las fechas salen en ISO.
+    """
+    partes = [r.split(".") for r in rutas]
+    resultado = []
+    for f in filas:
+        d: Dict[str, Any] = {}
+        for camino, valor in zip(partes, f):
+            destino = d
+            for clave in camino[:-1]:
+                destino = destino.setdefault(clave, {})
+            destino[camino[-1]] = valor.isoformat() if isinstance(valor, datetime) else valor
+        resultado.append(d)
+    return resultado
+
+
+def codificar(contenido: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(contenido)
+    return json.dumps(contenido, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+class RespuestaJSON(Response):
+    """JSONResponse sin validación previa: el contenido ya tiene la forma final."""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return codificar(content)
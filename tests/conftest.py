@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Los módulos están en la raíz del repo; database.py necesita una URL aunque no se use
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
@@ -0,0 +1,74 @@
+"""
+Servidor mínimo que habla RESP2 (SUBSCRIBE/UNSUBSCRIBE/PUBLISH/AUTH), en el
+proceso, para probar mensajeria.BrokerRedis sin un Redis de verdad.
+"""
+import asyncio
+from typing import Dict, Set
+
+
+class ServidorRESP:
+    def __init__(self):
+        self.suscriptos: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+        self.clientes: Set[asyncio.StreamWriter] = set()
+        self.puerto = 0
+        self._servidor = None
+
+    async def iniciar(self) -> "ServidorRESP":
+        self._servidor = await asyncio.start_server(self._cliente, "127.0.0.1", 0)
+        self.puerto = self._servidor.sockets[0].getsockname()[1]
+        return self
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.puerto}/0"
+
+    def cuantos(self, canal: str) -> int:
+        return len(self.suscriptos.get(canal.encode(), ()))
+
+    def cortar(self):
+        """Corta todas las conexiones, como un reinicio del servidor."""
+        for writer in list(self.clientes):
+            writer.close()
+
+    async def cerrar(self):
+        self.cortar()
+        self._servidor.close()
+        await self._servidor.wait_closed()
+
+    async def _leer_comando(self, reader) -> list:
+        n = int((await reader.readuntil(b"\r\n"))[1:-2])
+        partes = []
+        for _ in range(n):
+            largo = int((await reader.readuntil(b"\r\n"))[1:-2])
+            partes.append((await reader.readexactly(largo + 2))[:-2])
+        return partes
+
+    async def _cliente(self, reader, writer):
+        self.clientes.add(writer)
+        try:
+            while True:
+                orden, *args = await self._leer_comando(reader)
+                orden = orden.upper()
+                if orden in (b"SUBSCRIBE", b"UNSUBSCRIBE"):
+                    for canal in args:
+                        conjunto = self.suscriptos.setdefault(canal, set())
+                        (conjunto.add if orden == b"SUBSCRIBE" else conjunto.discard)(writer)
+                        writer.write(b"*3\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n:%d\r\n"
+                                     % (len(orden), orden.lower(), len(canal), canal, len(conjunto)))
+                elif orden == b"PUBLISH":
+                    canal, datos = args
+                    destinos = list(self.suscriptos.get(canal, ()))
+                    for destino in destinos:
+                        destino.write(b"*3\r\n$7\r\nmessage\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n"
+                                      % (len(canal), canal, len(datos), datos))
+                    writer.write(b":%d\r\n" % len(destinos))
+                else:
+                    writer.write(b"+OK\r\n")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.clientes.discard(writer)
+            for conjunto in self.suscriptos.values():
+                conjunto.discard(writer)
+            writer.close()
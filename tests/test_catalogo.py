@@ -0,0 +1,12 @@
+import catalogo
+
+
+def test_coincide():
+    etag = catalogo.etag_mascota(7, 3)
+    assert catalogo.coincide(etag, etag)
+    assert catalogo.coincide(f'W/{etag}', etag)
+    assert catalogo.coincide(f'"c1", {etag}', etag)
+    assert catalogo.coincide("*", etag)
+    assert not catalogo.coincide(None, etag)
+    assert not catalogo.coincide("", etag)
+    assert not catalogo.coincide(catalogo.etag_mascota(7, 2), etag)
@@ -0,0 +1,25 @@
+import io
+
+import importacion
+
+
+def test_filas_ndjson_reporta_filas_malas():
+    texto = io.StringIO('{"nombre": "Firulais"}\n\n{roto\n[1, 2]\n')
+    filas = list(importacion.filas_ndjson(texto))
+    assert filas[0] == (1, {"nombre": "Firulais"}, None)
+    assert [(n, d) for n, d, _ in filas[1:]] == [(3, None), (4, None)]
+    assert filas[1][2].startswith("JSON inválido")
+    assert filas[2][2] == "La fila no es un objeto JSON"
+
+
+def test_importacion_valida_cada_fila():
+    # Las filas con error no llegan a la BD: sin lote pendiente no se usa la sesión
+    imp = importacion.Importacion(db=None, albergue_id=1, directorio="")
+    for numero, datos, error in importacion.filas_ndjson(io.StringIO('{roto\n{"nombre": "Sin especie"}\n{"nombre": "x", "especie": "perro", "imagen": "a.jpg"}\n')):
+        imp.agregar(numero, datos, error)
+    reporte = imp.reporte()
+    assert reporte["filas"] == 3 and reporte["creadas"] == 0 and reporte["total_errores"] == 3
+    errores = {e["fila"]: e["error"] for e in reporte["errores"]}
+    assert errores[1].startswith("JSON inválido")
+    assert "especie" in errores[2] and "imagen_id" in errores[2]
+    assert errores[3].startswith("imagen: solo se puede usar dentro de un zip")
@@ -0,0 +1,88 @@
+import asyncio
+
+import mensajeria
+from servidor_resp import ServidorRESP
+
+
+class SocketFalso:
+    def __init__(self):
+        self.recibidos = []
+
+    async def send_json(self, mensaje):
+        self.recibidos.append(mensaje)
+
+
+async def esperar(condicion, segundos: float = 3.0):
+    limite = asyncio.get_running_loop().time() + segundos
+    while not condicion():
+        assert asyncio.get_running_loop().time() < limite, "no se cumplió a tiempo"
+        await asyncio.sleep(0.01)
+
+
+def test_local_entrega_solo_a_la_clave():
+    async def prueba():
+        central = mensajeria.Central(mensajeria.BrokerLocal())
+        a, b = SocketFalso(), SocketFalso()
+        await central.conectar("albergue:1", a)
+        await central.conectar("adoptante:2", b)
+        await central.enviar("albergue:1", {"n": 1})
+        await central.enviar("albergue:9", {"n": 2})   # nadie conectado
+        assert a.recibidos == [{"n": 1}] and b.recibidos == []
+        await central.desconectar("albergue:1", a)
+        assert central.estadisticas() == {"broker": "local", "claves": 1, "conexiones": 1}
+    asyncio.run(prueba())
+
+
+def test_redis_reparte_entre_workers_y_se_desuscribe():
+    async def prueba():
+        servidor = await ServidorRESP().iniciar()
+        w1 = mensajeria.Central(mensajeria.BrokerRedis(servidor.url))
+        w2 = mensajeria.Central(mensajeria.BrokerRedis(servidor.url))
+        canal = "doggo:chat:albergue:9"
+        try:
+            pestana1, pestana2 = SocketFalso(), SocketFalso()
+            await w1.conectar("albergue:9", pestana1)
+            await w1.conectar("albergue:9", pestana2)   # misma clave: una sola suscripción
+            await w2.conectar("adoptante:3", SocketFalso())
+            await esperar(lambda: servidor.cuantos(canal) == 1 and servidor.cuantos("doggo:chat:adoptante:3") == 1)
+
+            # w2 publica y entrega w1, el único que tiene la clave
+            await w2.enviar("albergue:9", {"n": 1})
+            await esperar(lambda: pestana1.recibidos and pestana2.recibidos)
+            assert pestana1.recibidos == pestana2.recibidos == [{"n": 1}]
+
+            # se desuscribe recién al cerrarse el último socket de la clave
+            await w1.desconectar("albergue:9", pestana1)
+            await asyncio.sleep(0.05)
+            assert servidor.cuantos(canal) == 1
+            await w1.desconectar("albergue:9", pestana2)
+            await esperar(lambda: servidor.cuantos(canal) == 0)
+            await w2.enviar("albergue:9", {"n": 2})
+            await asyncio.sleep(0.05)
+            assert pestana2.recibidos == [{"n": 1}]
+        finally:
+            await w1.cerrar()
+            await w2.cerrar()
+            await servidor.cerrar()
+    asyncio.run(prueba())
+
+
+def test_redis_reconecta_y_vuelve_a_suscribir():
+    async def prueba():
+        servidor = await ServidorRESP().iniciar()
+        w1 = mensajeria.Central(mensajeria.BrokerRedis(servidor.url))
+        w2 = mensajeria.Central(mensajeria.BrokerRedis(servidor.url))
+        try:
+            socket = SocketFalso()
+            await w1.conectar("albergue:5", socket)
+            await esperar(lambda: servidor.cuantos("doggo:chat:albergue:5") == 1)
+            servidor.cortar()
+            await esperar(lambda: servidor.cuantos("doggo:chat:albergue:5") == 0)
+            await esperar(lambda: servidor.cuantos("doggo:chat:albergue:5") == 1)
+            await w2.enviar("albergue:5", {"n": 1})
+            await esperar(lambda: socket.recibidos == [{"n": 1}])
+        finally:
+            await w1.cerrar()
+            await w2.cerrar()
+            await servidor.cerrar()
+    asyncio.run(prueba())
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+import recomendaciones
+
+
+def test_cursor_ida_y_vuelta():
+    cursor = recomendaciones.codificar_cursor(0.8123, 42)
+    assert "=" not in cursor
+    assert recomendaciones.decodificar_cursor(cursor) == (0.8123, 42)
+
+
+@pytest.mark.parametrize("cursor", ["", "no-es-base64!", recomendaciones.codificar_cursor(0.5, 1)[:-3]])
+def test_cursor_invalido(cursor):
+    with pytest.raises(ValueError):
+        recomendaciones.decodificar_cursor(cursor)
+
+
+def test_seleccionar_ordena_y_desempata_por_id():
+    ids = np.array([5, 3, 9, 1, 7], dtype=np.int64)
+    sims = np.array([0.5, 0.9, 0.5, 0.5, 0.1])
+    posiciones, hay_mas = recomendaciones.seleccionar(ids, sims, 3)
+    assert ids[posiciones].tolist() == [3, 1, 5]
+    assert hay_mas
+
+
+def test_seleccionar_pagina_con_cursor_hasta_el_final():
+    ids = np.array([5, 3, 9, 1, 7], dtype=np.int64)
+    sims = np.array([0.5, 0.9, 0.5, 0.5, 0.1])
+    vistos, despues = [], None
+    while True:
+        posiciones, hay_mas = recomendaciones.seleccionar(ids, sims, 2, despues)
+        vistos += ids[posiciones].tolist()
+        if not hay_mas:
+            break
+        ultima = posiciones[-1]
+        despues = (float(sims[ultima]), int(ids[ultima]))
+    assert vistos == [3, 1, 5, 9, 7]
+    todas, hay_mas = recomendaciones.seleccionar(ids, sims)
+    assert ids[todas].tolist() == vistos and not hay_mas
@@ -0,0 +1,18 @@
+import pytest
+
+import serializacion
+
+DISPONIBLES = ["id", "nombre", "mascota.id", "mascota.nombre", "fecha"]
+
+
+def test_elegir_respeta_el_orden_y_expande_rutas():
+    assert serializacion.elegir(DISPONIBLES, None) is None
+    assert serializacion.elegir(DISPONIBLES, " , ") is None
+    assert serializacion.elegir(DISPONIBLES, "fecha, id") == ("id", "fecha")
+    assert serializacion.elegir(DISPONIBLES, "mascota") == ("mascota.id", "mascota.nombre")
+    assert serializacion.elegir(DISPONIBLES, "mascota.nombre") == ("mascota.nombre",)
+
+
+def test_elegir_campo_desconocido():
+    with pytest.raises(ValueError, match="edad"):
+        serializacion.elegir(DISPONIBLES, "id,edad")
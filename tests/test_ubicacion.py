@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+
+import pytest
+
+import ubicacion
+
+
+def indice_con(*albergues):
+    indice = ubicacion.IndiceAlbergues()
+    indice.construido = True
+    for albergue_id, lat, lon in albergues:
+        indice.actualizar(SimpleNamespace(id=albergue_id, latitud=lat, longitud=lon))
+    return indice
+
+
+def test_cercanos_filtra_por_radio():
+    # Miraflores, San Isidro (~4 km) y Arequipa (~770 km); el 4 no tiene coordenadas
+    indice = indice_con((1, "-12.1211", "-77.0297"), (2, "-12.0970", "-77.0360"), (3, "-16.4090", "-71.5375"), (4, None, None))
+    cerca = indice.cercanos(-12.1211, -77.0297, radio_km=10)
+    assert set(cerca) == {1, 2}
+    assert cerca[1] == pytest.approx(0.0, abs=1e-6)
+    assert 2 < cerca[2] < 4
+    assert set(indice.cercanos(-12.1211, -77.0297)) == {1, 2, 3}
+
+
+def test_cercanos_sigue_al_albergue_que_se_mueve():
+    indice = indice_con((1, "-12.1211", "-77.0297"))
+    indice.actualizar(SimpleNamespace(id=1, latitud="-16.4090", longitud="-71.5375"))
+    assert indice.cercanos(-12.1211, -77.0297, radio_km=50) == {}
+    assert set(indice.cercanos(-16.4, -71.5, radio_km=50)) == {1}
+
+
+@pytest.mark.parametrize("valor", ["abc", "nan", "inf", 91, None])
+def test_validar_coordenada_rechaza(valor):
+    with pytest.raises(ValueError):
+        ubicacion.validar_coordenada(valor, 90, "latitud")
@@ -0,0 +1,154 @@
+"""
+Índice espacial de albergues para filtrar y ponderar recomendaciones por distancia.
+
+Rejilla fija de celdas de CELDA_GRADOS x CELDA_GRADOS: cada albergue con
+coordenadas cae en una celda y una búsqueda por radio solo revisa las celdas
+que tocan el rectángulo del círculo, y luego filtra por distancia real
+(haversine). Se arma al arrancar y se actualiza en register_albergue y
+actualizar_albergue. Igual que el índice de etiquetas, es por proceso.
+"""
+import math
+import os
+import threading
+from typing import Dict, Optional, Set, Tuple
+
+import numpy as np # type: ignore
+from sqlalchemy.orm import Session # type: ignore
+
+import models
+
+CELDA_GRADOS = 0.25      # ~28 km de lado en el ecuador
+RADIO_TIERRA_KM = 6371.0
+ESCALA_KM = float(os.getenv("RECOMENDACIONES_ESCALA_KM", "25"))  # a esta distancia el puntaje cae a 1/e
+
+
+def parse_coordenada(valor) -> Optional[float]:
+    """latitud/longitud se guardan como texto; None si no es un número válido."""
+    try:
+        x = float(valor)
+    except (TypeError, ValueError):
+        return None
+    return x if math.isfinite(x) else None
+
+def validar_coordenada(valor, maximo: float, nombre: str) -> float:
+    """Número finito en [-maximo, maximo] (90 latitud, 180 longitud); ValueError si no."""
+    x = parse_coordenada(valor)
+    if x is None or not -maximo <= x <= maximo:
+        raise ValueError(f"{nombre} debe ser un número entre -{maximo:g} y {maximo:g}")
+    return x
+
+def haversine_km(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def decaimiento(distancias_km: np.ndarray, escala_km: float = ESCALA_KM) -> np.ndarray:
+    """Factor exp(-d/escala) que multiplica a la similitud; distancia desconocida (nan) = 0."""
+    factor = np.exp(-np.asarray(distancias_km, dtype=np.float64) / escala_km)
+    return np.nan_to_num(factor, nan=0.0)
+
+def distancias_por_fila(albergue_ids: np.ndarray, distancias: Dict[int, float]) -> np.ndarray:
+    """Distancia de cada fila según su albergue, vectorizado; nan si no se conoce."""
+    resultado = np.full(len(albergue_ids), np.nan)
+    if not distancias:
+        return resultado
+    claves = np.fromiter(distancias, dtype=np.int64)
+    valores = np.fromiter(distancias.values(), dtype=np.float64)
+    orden = np.argsort(claves)
+    claves, valores = claves[orden], valores[orden]
+    pos = np.clip(np.searchsorted(claves, albergue_ids), 0, len(claves) - 1)
+    encontrado = claves[pos] == albergue_ids
+    resultado[encontrado] = valores[pos[encontrado]]
+    return resultado
+
+
+class IndiceAlbergues:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.construido = False
+        self.version = 0   # sube con cada cambio (entra en la clave de la caché de recomendaciones)
+        self.coordenadas: Dict[int, Tuple[float, float]] = {}   # albergue_id -> (lat, lon)
+        self.celdas: Dict[Tuple[int, int], Set[int]] = {}       # celda -> albergue_ids
+
+    @staticmethod
+    def _celda(lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / CELDA_GRADOS)), int(math.floor(lon / CELDA_GRADOS))
+
+    def construir(self, db: Session):
+        albergues = db.query(models.Albergue.id, models.Albergue.latitud, models.Albergue.longitud).all()
+        with self._lock:
+            self.coordenadas, self.celdas = {}, {}
+            for a in albergues:
+                self._poner(a.id, a.latitud, a.longitud)
+            self.construido = True
+            self.version += 1
+
+    def asegurar(self, db: Session):
+        if not self.construido:
+            self.construir(db)
+
+    def actualizar(self, albergue):
+        with self._lock:
+            if not self.construido:
+                return
+            self._sacar(albergue.id)
+            self._poner(albergue.id, albergue.latitud, albergue.longitud)
+            self.version += 1
+
+    def _poner(self, albergue_id: int, latitud, longitud):
+        lat, lon = parse_coordenada(latitud), parse_coordenada(longitud)
+        if lat is None or lon is None:
+            return
+        self.coordenadas[albergue_id] = (lat, lon)
+        self.celdas.setdefault(self._celda(lat, lon), set()).add(albergue_id)
+
+    def _sacar(self, albergue_id: int):
+        anterior = self.coordenadas.pop(albergue_id, None)
+        if anterior is None:
+            return
+        celda = self._celda(*anterior)
+        self.celdas[celda].discard(albergue_id)
+        if not self.celdas[celda]:
+            del self.celdas[celda]
+
+    def cercanos(self, lat: float, lon: float, radio_km: Optional[float] = None) -> Dict[int, float]:
+        """
+        {albergue_id: distancia_km} de los albergues con coordenadas,
+        solo los que están a menos de radio_km si se indica.
+        """
+        with self._lock:
+            if radio_km is None:
+                candidatos = list(self.coordenadas)
+            else:
+                dlat = radio_km / 111.0
+                dlon = radio_km / (111.0 * max(math.cos(math.radians(lat)), 1e-6))
+                c0 = self._celda(lat - dlat, lon - dlon)
+                c1 = self._celda(lat + dlat, lon + dlon)
+                n_celdas = (c1[0] - c0[0] + 1) * (c1[1] - c0[1] + 1)
+                if n_celdas > len(self.celdas):
+                    # radio enorme: sale más barato revisar todas las celdas ocupadas
+                    candidatos = [
+                        a for (cx, cy), ids in self.celdas.items()
+                        if c0[0] <= cx <= c1[0] and c0[1] <= cy <= c1[1]
+                        for a in ids
+                    ]
+                else:
+                    candidatos = [
+                        a
+                        for cx in range(c0[0], c1[0] + 1)
+                        for cy in range(c0[1], c1[1] + 1)
+                        for a in self.celdas.get((cx, cy), ())
+                    ]
+            coords = np.array([self.coordenadas[a] for a in candidatos], dtype=np.float64).reshape(-1, 2)
+
+        distancias = haversine_km(lat, lon, coords[:, 0], coords[:, 1])
+        if radio_km is not None:
+            dentro = distancias <= radio_km
+            candidatos = [a for a, ok in zip(candidatos, dentro) if ok]
+            distancias = distancias[dentro]
+        return dict(zip(candidatos, distancias.tolist()))
+
+
+# Índice único del proceso
+indice_albergues = IndiceAlbergues()
@@ -0,0 +1,153 @@
+"""
+Versiones reducidas de las imágenes (GET /imagenes/{id}?size=thumb|medium|full).
+
+Las tarjetas piden miniaturas y recibían la foto original del teléfono.
+Apenas se sube una imagen, encolar() la manda a un pool de procesos. Cada
+proceso la abre una vez con Pillow (respetando la orientación EXIF) y la
+reduce a cada tamaño de TAMANOS (lado mayor en px, sin agrandar). Cada tamaño
+se recomprime en cada formato de FORMATOS: AVIF y WebP si Pillow los
+soporta, y JPEG siempre, para los clientes que no aceptan los otros.
+
+Cada versión queda al lado del original, como <ruta>.<tamaño>.<formato>.
+Con el almacenamiento por contenido (archivos.py) las fotos iguales
+comparten también sus versiones. Al pedirla se elige el formato por Accept.
+Si la versión no existe (imágenes anteriores a esto, o recién subidas) se
+encola y se sirve el original. La petición nunca genera nada; la siguiente
+ya la encuentra en disco.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+PROCESOS = int(os.getenv("IMAGENES_PROCESOS", "1"))   # 0 = sin versiones (siempre el original)
+TAMANOS: Dict[str, int] = {"thumb": 200, "medium": 800, "full": 1600}
+CALIDAD = {"avif": 55, "webp": 80, "jpeg": 82}
+TIPOS = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+def _soportados() -> Tuple[str, ...]:
+    try:
+        from PIL import features # type: ignore
+    except ImportError:
+        return ()
+    pedidos = os.getenv("IMAGENES_FORMATOS", "avif,webp,jpeg").split(",")
+    return tuple(f for f in pedidos if f == "jpeg" or (f in ("avif", "webp") and features.check(f)))
+
+FORMATOS = _soportados()   # vacío si Pillow no está instalado
+
+
+def ruta_variante(ruta: str, tamano: str, formato: str) -> str:
+    return f"{ruta}.{tamano}.{formato}"
+
+def elegir_formato(accept: Optional[str], pedido: Optional[str] = None) -> str:
+    """El formato a servir: el pedido si se genera, si no el mejor que acepte el cliente."""
+    if pedido in FORMATOS:
+        return pedido
+    accept = accept or ""
+    for formato in ("avif", "webp"):
+        if formato in FORMATOS and TIPOS[formato] in accept:
+            return formato
+    return "jpeg"
+
+
+# ---------- en el proceso del pool ----------
+
+def generar(ruta: str, tamanos: Dict[str, int], formatos: Sequence[str]) -> List[str]:
+    """Escribe todas las versiones de `ruta` que falten y devuelve sus rutas."""
+    from PIL import Image, ImageOps # type: ignore
+
+    hechas = []
+    with Image.open(ruta) as original:
+        original = ImageOps.exif_transpose(original)   # primer cuadro si es animada
+        con_alfa = original.mode in ("RGBA", "LA") or "transparency" in original.info
+        original = original.convert("RGBA" if con_alfa else "RGB")
+        for tamano, lado in tamanos.items():
+            imagen = original.copy()
+            imagen.thumbnail((lado, lado), Image.LANCZOS)
+            for formato in formatos:
+                destino = ruta_variante(ruta, tamano, formato)
+                if os.path.exists(destino):
+                    continue
+                salida = imagen
+                if formato == "jpeg" and con_alfa:
+                    salida = Image.new("RGB", imagen.size, (255, 255, 255))
+                    salida.paste(imagen, mask=imagen.getchannel("A"))
+                temporal = f"{destino}.{os.getpid()}.tmp"
+                try:
+                    salida.save(temporal, format=formato.upper(), quality=CALIDAD[formato], optimize=formato == "jpeg")
+                    os.replace(temporal, destino)
+                finally:
+                    if os.path.exists(temporal):
+                        os.remove(temporal)
+                hechas.append(destino)
+    return hechas
+
+
+# ---------- lado del servidor ----------
+
+class GeneradorVariantes:
+    """
+    Pool de procesos (se crea con el primer encargo) y las imágenes en curso,
+    para no encolar dos veces la misma. Las que Pillow no puede abrir se
+    recuerdan y no se reintentan en este proceso.
+    """
+
+    def __init__(self, procesos: int = PROCESOS):
+        self.procesos = procesos if FORMATOS else 0
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._en_curso: Dict[str, Future] = {}
+        self._fallidas: Set[str] = set()
+
+    def encolar(self, ruta: str) -> Optional[Future]:
+        if self.procesos <= 0:
+            return None
+        with self._lock:
+            if ruta in self._fallidas:
+                return None
+            if ruta in self._en_curso:
+                return self._en_curso[ruta]
+            if self._pool is None:
+                # spawn: el servidor tiene hilos y fork los copiaría a medias
+                self._pool = ProcessPoolExecutor(self.procesos, mp_context=multiprocessing.get_context("spawn"))
+            futuro = self._pool.submit(generar, ruta, TAMANOS, FORMATOS)
+            self._en_curso[ruta] = futuro
+        futuro.add_done_callback(lambda f: self._terminada(ruta, f))
+        return futuro
+
+    def _terminada(self, ruta: str, futuro: Future):
+        error = None if futuro.cancelled() else futuro.exception()
+        with self._lock:
+            self._en_curso.pop(ruta, None)
+            if isinstance(error, BrokenProcessPool):
+                # murió un proceso (p. ej. sin memoria): el próximo encargo arma otro pool
+                if self._pool is not None:
+                    self._pool.shutdown(wait=False, cancel_futures=True)
+                    self._pool = None
+            elif error is not None:
+                self._fallidas.add(ruta)
+        if error is not None:
+            print(f"⚠️ No se pudieron generar las versiones de {ruta}: {error}")
+
+    def servir(self, ruta: str, tamano: str, formato: str) -> Optional[str]:
+        """La ruta de la versión si ya existe; si no, la encola y devuelve None (servir el original)."""
+        destino = ruta_variante(ruta, tamano, formato)
+        if os.path.exists(destino):
+            return destino
+        self.encolar(ruta)
+        return None
+
+    def cerrar(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+
+# Generador único del proceso
+generador = GeneradorVariantes()
+atexit.register(generador.cerrar)